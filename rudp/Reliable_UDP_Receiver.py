@@ -1,6 +1,7 @@
 import socket
 import struct
-import random
+from rudp_serial import random_isn, seq_add
+from rudp_sockets import bdp_buffer_size, set_buffers
 
 
 class TCPOverUDPReceiver:
@@ -22,33 +23,17 @@ class TCPOverUDPReceiver:
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.address, self.port))
+        # Room for a full window of datagrams, the default buffer overruns with 63 KB segments
+        set_buffers(self.socket, bdp_buffer_size(window_size, MSS))
         self.buffer = {}
-        self.seq_num = random.randint(0, 2 ** 32 - 1)
+        self.seq_num = random_isn()
 
     def run(self):
         """
         run and receive new packages.
         :return:
         """
-        # Send SYN packet
-        print('Sending SYN packet')
-        syn_packet = self.create_packet(syn=True, seq_num=self.seq_num)
-        self.socket.sendto(syn_packet, (self.address, self.server_port))
-
-        # Wait for SYN-ACK packet
-        while True:
-            print('Waiting for SYN-ACK packet')
-            syn_ack_packet, address = self.socket.recvfrom(self.MSS)
-            syn_ack_packet_dict = self.parse_packet(syn_ack_packet)
-            print(syn_ack_packet_dict)
-            if syn_ack_packet_dict.get('syn') and syn_ack_packet_dict.get('ack'):
-                print('Received SYN-ACK packet')
-                self.expected_seq_num = syn_ack_packet_dict['seq_num'] + 1
-                break
-
-        # Send ACK packet
-        ack_packet = self.create_packet(ack=True, ack_num=self.expected_seq_num)
-        self.socket.sendto(ack_packet, address)
+        address = self.connect()
 
         # Receive data packets
         while True:
@@ -58,13 +43,13 @@ class TCPOverUDPReceiver:
                 print('Received packet with seq_num = {}'.format(self.expected_seq_num))
                 data = packet_dict['data']
                 self.buffer[self.expected_seq_num] = data
-                self.expected_seq_num += len(data)
+                self.expected_seq_num = seq_add(self.expected_seq_num, len(data))
 
                 # Send cumulative ACK packet
                 while self.expected_seq_num in self.buffer:
                     print('Sending ACK packet with ack_num = {}'.format(self.expected_seq_num))
                     data = self.buffer.pop(self.expected_seq_num)
-                    self.expected_seq_num += len(data)
+                    self.expected_seq_num = seq_add(self.expected_seq_num, len(data))
                 ack_packet = self.create_packet(ack=True, ack_num=self.expected_seq_num)
                 self.socket.sendto(ack_packet, address)
 
@@ -80,6 +65,47 @@ class TCPOverUDPReceiver:
                 self.socket.sendto(fin_ack_packet, address)
                 break
 
+    def connect(self):
+        """
+        Performs the 3-way handshake with the server.
+        :return: the address of the server
+        """
+        # Send SYN packet
+        print('Sending SYN packet')
+        syn_packet = self.create_packet(syn=True, seq_num=self.seq_num, data=self.handshake_offer())
+        self.socket.sendto(syn_packet, (self.address, self.server_port))
+
+        # Wait for SYN-ACK packet
+        while True:
+            print('Waiting for SYN-ACK packet')
+            syn_ack_packet, address = self.socket.recvfrom(self.MSS)
+            syn_ack_packet_dict = self.parse_packet(syn_ack_packet)
+            print(syn_ack_packet_dict)
+            if syn_ack_packet_dict.get('syn') and syn_ack_packet_dict.get('ack'):
+                print('Received SYN-ACK packet')
+                self.expected_seq_num = seq_add(syn_ack_packet_dict['seq_num'], 1)
+                self.handshake_accepted(syn_ack_packet_dict['data'])
+                break
+
+        # Send ACK packet
+        ack_packet = self.create_packet(ack=True, ack_num=self.expected_seq_num)
+        self.socket.sendto(ack_packet, address)
+        return address
+
+    def handshake_offer(self):
+        """
+        Options to offer the server in the SYN packet.
+        :return: the payload of the SYN packet, or None
+        """
+        return None
+
+    def handshake_accepted(self, options):
+        """
+        Called with the options the server accepted in its SYN-ACK packet.
+        :param options: the payload of the SYN-ACK packet
+        """
+        pass
+
     def create_packet(self, syn=False, ack=False, fin=False, seq_num=None, ack_num=None, data=None):
         """
 
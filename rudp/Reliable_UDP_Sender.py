@@ -1,9 +1,11 @@
 import socket
 import struct
-import random
 import time
 import os
 
+from rudp_serial import random_isn, seq_add
+from rudp_sockets import bdp_buffer_size, set_buffers
+
 N_CHUNKS = 2
 MSS = 63000
 
@@ -47,6 +49,10 @@ class TCPOverUDPSender:
     -------
     run(data):
         Implements the initial 3-way handshake protocol to establish a reliable connection between a TCP-over-UDP server and a client. Once the connection is established, it sends the data to the client.
+    accept():
+        Waits for a client and performs the 3-way handshake with it.
+    negotiate(offer):
+        Answers the options the client sent in its SYN packet.
     create_packet(syn=False, ack=False, fin=False, seq_num=None, ack_num=None, data=None):
         Creates a packet with the given flags, sequence number, acknowledgment number, and data.
     parse_packet(packet):
@@ -56,7 +62,7 @@ class TCPOverUDPSender:
 """
 
     def __init__(self, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
-                 congestion_control=True):
+                 congestion_control=True, sock=None):
         """
         Initializes the TCPOverUDPSender object with default values for server_address, server_port, window_size, timeout, and congestion_control.
         
@@ -72,17 +78,24 @@ class TCPOverUDPSender:
             The timeout for the sender's socket. Default is 0.5.
         congestion_control : bool, optional
             A flag indicating whether congestion control is enabled. Default is True.
+        sock : socket, optional
+            An already bound socket to use instead of binding a new one, e.g. one shared by a server
+            that serves many connections. Default is None.
         """
         self.available_space = MSS * window_size
         self.server_address = server_address
         self.server_port = server_port
         self.window_size = window_size
         self.timeout = timeout
-        self.seq_num = random.randint(0, 2 ** 32 - 1)
+        self.seq_num = random_isn()
         self.unacked_packets = []
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(('localhost', server_port))
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('localhost', server_port))
+            # Room for a full window of datagrams, the default buffer overruns with 63 KB segments
+            set_buffers(sock, bdp_buffer_size(window_size, MSS))
+        self.socket = sock
         self.congestion_control = congestion_control
         self.slow_start_threshold = window_size * MSS // 2
         self.cwnd = MSS
@@ -94,6 +107,17 @@ class TCPOverUDPSender:
         Runs the TCP server, receiving and sending packets as necessary to transfer the given data.
         :param data: the data to transfer
         """
+        if not self.accept():
+            return
+
+        # Send data
+        self.send(data)
+
+    def accept(self):
+        """
+        Waits for a client and performs the 3-way handshake with it.
+        :return: True if the connection was established, False otherwise
+        """
         while True:
             # Wait for SYN packet
             print('Waiting for SYN packet')
@@ -103,12 +127,13 @@ class TCPOverUDPSender:
 
             if syn_packet_dict.get('syn'):
                 print('Received SYN packet')
-                self.seq_num = random.randint(0, 2 ** 32 - 1)
+                self.seq_num = self.initial_seq_num()
                 break
 
         # Send SYN-ACK packet
         print('Sending SYN-ACK packet')
-        syn_ack_packet = self.create_packet(syn=True, ack=True, ack_num=syn_packet_dict['seq_num'] + 1)
+        syn_ack_packet = self.create_packet(syn=True, ack=True, ack_num=seq_add(syn_packet_dict['seq_num'], 1),
+                                            data=self.negotiate(syn_packet_dict['data']))
         self.socket.sendto(syn_ack_packet, self.client_address)
 
         # Receive ACK packet
@@ -117,16 +142,29 @@ class TCPOverUDPSender:
 
         if address != self.client_address:
             print('Received ACK packet from wrong address')
-            return
+            return False
 
         ack_packet_dict = self.parse_packet(ack_packet)
 
         if ack_packet_dict.get('ack'):
             print('Received ACK packet')
             self.seq_num = ack_packet_dict['ack_num']
+        return True
 
-        # Send data
-        self.send(data)
+    def initial_seq_num(self):
+        """
+        Picks the initial sequence number of a new connection.
+        :return: a random sequence number, anywhere in the 32-bit sequence space
+        """
+        return random_isn()
+
+    def negotiate(self, offer):
+        """
+        Answers the options the client sent in its SYN packet. The answer travels in the SYN-ACK packet.
+        :param offer: the payload of the SYN packet
+        :return: the payload of the SYN-ACK packet, or None to accept nothing
+        """
+        return None
 
     def create_packet(self, syn=False, ack=False, fin=False, seq_num=None, ack_num=None, data=None):
         """
@@ -209,7 +247,7 @@ class TCPOverUDPSender:
                                                   self.cwnd // MSS) and chunks and self.available_space > 0:
                 # Take the next chunk to send
                 chunk = chunks.pop(0)
-                self.seq_num += len(chunk)
+                self.seq_num = seq_add(self.seq_num, len(chunk))
                 # Create a packet with the chunk of data
                 packet = self.create_packet(data=chunk)
                 print('Sending packet with seq_num {}'.format(self.seq_num))
@@ -251,7 +289,7 @@ class TCPOverUDPSender:
                             break
 
                         packet = self.unacked_packets[i]
-                        if struct.unpack('!I', packet[:4])[0] == ack_num - MSS:
+                        if struct.unpack('!I', packet[:4])[0] == seq_add(ack_num, -MSS):
                             # Remove the acknowledged packet from the list of unacknowledged packets
                             self.unacked_packets.pop(i)
                             # Update congestion control parameters
@@ -331,7 +369,7 @@ class TCPOverUDPSender:
                 fin_ack_packet_dict = self.parse_packet(fin_ack_packet)
 
                 if fin_ack_packet_dict.get('fin') and fin_ack_packet_dict.get('ack'):
-                    ack_packet = self.create_packet(ack=True, ack_num=fin_ack_packet_dict['seq_num'] + 1)
+                    ack_packet = self.create_packet(ack=True, ack_num=seq_add(fin_ack_packet_dict['seq_num'], 1))
                     print('Sending ACK packet')
                     self.socket.sendto(ack_packet, self.client_address)
                     break
@@ -0,0 +1,76 @@
+import argparse
+import contextlib
+import functools
+import io
+import multiprocessing
+import os
+import time
+
+from rudp_server import RUDPServer
+from rudp_streams import StreamReceiver
+
+SERVER_PORT = 56000
+CLIENT_PORT = 57000
+
+
+def send_payload(payload, connection):
+    """
+    A server handler that sends the same payload to every receiver.
+    :param payload: the data to send
+    :param connection: the new connection
+    """
+    connection.write(connection.open_stream(), payload, end=True)
+
+
+def run_worker(server, index):
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.worker(index)
+
+
+def run_client(index, results):
+    with contextlib.redirect_stdout(io.StringIO()):
+        receiver = StreamReceiver(port=CLIENT_PORT + index, server_port=SERVER_PORT)
+        streams = receiver.run()
+    results.put(sum(len(data) for data in streams.values()))
+
+
+def benchmark(workers, clients, size):
+    """
+    Starts an RUDPServer and lets several receivers download from it at the same time.
+    :param workers: the number of server worker processes
+    :param clients: the number of concurrent receivers
+    :param size: the number of bytes every receiver downloads
+    :return: the aggregate throughput in bytes per second
+    """
+    server = RUDPServer(functools.partial(send_payload, os.urandom(size)), port=SERVER_PORT, workers=workers)
+    server_processes = [multiprocessing.Process(target=run_worker, args=(server, i)) for i in range(workers)]
+    for process in server_processes:
+        process.start()
+    time.sleep(1)
+
+    results = multiprocessing.Queue()
+    start = time.time()
+    processes = [multiprocessing.Process(target=run_client, args=(i, results)) for i in range(clients)]
+    for process in processes:
+        process.start()
+    received = sum(results.get() for _ in processes)
+    elapsed = time.time() - start
+    for process in processes:
+        process.join()
+    for process in server_processes:
+        process.terminate()
+        process.join()
+    return received / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate throughput of the multi-process RUDP server.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='worker counts to measure')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent receivers')
+    parser.add_argument('--size', type=int, default=8, help='megabytes per receiver')
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        throughput = benchmark(workers, args.clients, args.size * 1000000)
+        print('{} worker(s): {:.1f} MB/s'.format(workers, throughput / 1e6))
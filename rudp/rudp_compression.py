@@ -0,0 +1,216 @@
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from rudp_streams import StreamSender, StreamReceiver, encode_options, decode_options
+
+# Block methods
+RAW = 0
+ZLIB = 1
+# method and length of a block inside a compressed stream
+BLOCK_HEADER = '!BI'
+BLOCK_HEADER_SIZE = 5
+# Stream data is compressed in blocks of several segments
+BATCH_SIZE = 256 * 1024
+SAMPLE_SIZE = 16 * 1024
+# A sample that does not shrink below this ratio marks the block as incompressible
+INCOMPRESSIBLE_RATIO = 0.9
+
+
+def compress_block(block, level):
+    """
+    Compresses one block unless a sample of it shows that it is incompressible.
+    Runs in a worker thread; zlib releases the GIL while it works.
+    :param block: the bytes of the block
+    :param level: the zlib compression level
+    :return: the encoded block (header and body), the method used, and the CPU seconds spent
+    """
+    start = time.thread_time()
+    middle = max(len(block) // 2 - SAMPLE_SIZE // 2, 0)
+    sample = block[middle:middle + SAMPLE_SIZE]
+    method = RAW
+    body = block
+    if len(zlib.compress(sample, 1)) < INCOMPRESSIBLE_RATIO * len(sample):
+        compressed = zlib.compress(block, level)
+        if len(compressed) < len(block):
+            method = ZLIB
+            body = compressed
+    return struct.pack(BLOCK_HEADER, method, len(body)) + body, method, time.thread_time() - start
+
+
+def decode_blocks(data):
+    """
+    Restores the original data of a compressed stream.
+    :param data: the received stream, a sequence of blocks
+    :return: the original data
+    """
+    view = memoryview(data)
+    parts = []
+    position = 0
+    while position < len(view):
+        method, length = struct.unpack(BLOCK_HEADER, view[position:position + BLOCK_HEADER_SIZE])
+        body = view[position + BLOCK_HEADER_SIZE:position + BLOCK_HEADER_SIZE + length]
+        parts.append(zlib.decompress(body) if method == ZLIB else body)
+        position += BLOCK_HEADER_SIZE + length
+    return b''.join(parts)
+
+
+class CompressingSender(StreamSender):
+    """
+    A stream sender that compresses stream data when the receiver supports it.
+
+    The receiver offers compression in its SYN and the sender accepts it in the SYN-ACK. Data written to a
+    stream is cut into blocks of BATCH_SIZE bytes that are compressed by a pool of worker threads, so the
+    send loop keeps handling acknowledgements meanwhile. A block whose sample does not compress is sent as
+    is. stats() reports the compression ratio and the CPU time spent compressing.
+    """
+
+    def __init__(self, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, compression_level=6, workers=2, **kwargs):
+        """
+        :param server_address: the IP address of the server
+        :param server_port: the port the sender listens on
+        :param window_size: the largest number of segments in flight
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        :param compression_level: the zlib level, 0 disables compression
+        :param workers: the number of compression threads
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, **kwargs)
+        self.compression_level = compression_level
+        self.compress = False
+        self.executor = ThreadPoolExecutor(max_workers=workers) if compression_level else None
+        # stream id -> list of [future, end] in stream order
+        self.jobs = {}
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+        self.incompressible_bytes = 0
+        self.compression_cpu = 0
+
+    def negotiate(self, offer):
+        reply = decode_options(super().negotiate(offer))
+        if self.executor and 'zlib' in decode_options(offer).get('compress', '').split(','):
+            self.compress = True
+            reply['compress'] = 'zlib'
+        return encode_options(reply)
+
+    def write(self, stream_id, data, end=False):
+        """
+        Queues data on a stream. With compression, the data is handed to the worker threads and joins the
+        stream once its blocks are compressed.
+        :param stream_id: the stream to write to
+        :param data: the data to send
+        :param end: whether this is the last data of the stream
+        """
+        if not self.compress:
+            super().write(stream_id, data, end)
+            return
+        jobs = self.jobs.setdefault(stream_id, [])
+        view = memoryview(data)
+        blocks = [view[i:i + BATCH_SIZE] for i in range(0, len(view), BATCH_SIZE)] or [view]
+        for i, block in enumerate(blocks):
+            jobs.append([self.executor.submit(compress_block, block, self.compression_level),
+                         end and i == len(blocks) - 1, len(block)])
+
+    def collect(self):
+        """
+        Moves compressed blocks, in order, from the worker threads onto their streams.
+        """
+        for stream_id, jobs in list(self.jobs.items()):
+            while jobs and jobs[0][0].done():
+                future, end, size = jobs.pop(0)
+                encoded, method, cpu = future.result()
+                super().write(stream_id, encoded, end)
+                self.raw_bytes += size
+                self.encoded_bytes += len(encoded)
+                self.compression_cpu += cpu
+                if method == RAW:
+                    self.incompressible_bytes += size
+            if not jobs:
+                del self.jobs[stream_id]
+
+    def has_pending(self):
+        return bool(self.jobs) or super().has_pending()
+
+    def step(self):
+        """
+        One round of the send loop. If there is nothing to send yet, waits for the worker threads.
+        """
+        self.collect()
+        if self.jobs and not self.in_flight and not super().has_pending():
+            wait([jobs[0][0] for jobs in self.jobs.values()], timeout=self.timeout, return_when=FIRST_COMPLETED)
+            self.collect()
+        super().step()
+
+    def stats(self):
+        """
+        :return: the transfer statistics, including the compression ratio (sent / original bytes) and the CPU
+            seconds spent compressing
+        """
+        stats = super().stats()
+        stats['compression'] = 'zlib' if self.compress else None
+        stats['compression_ratio'] = self.encoded_bytes / self.raw_bytes if self.raw_bytes else 1.0
+        stats['incompressible_bytes'] = self.incompressible_bytes
+        stats['compression_cpu'] = self.compression_cpu
+        return stats
+
+    def close(self):
+        """
+        Closes the connection and stops the worker threads.
+        """
+        super().close()
+        if self.executor:
+            self.executor.shutdown()
+
+
+class CompressingReceiver(StreamReceiver):
+    """
+    The receiving side of CompressingSender. It offers compression in the handshake and decompresses every
+    stream once it is complete.
+    """
+
+    def __init__(self, address='127.0.0.1', port=55552, server_port=55555, window_size=10, **kwargs):
+        """
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        """
+        super().__init__(address, port, server_port, window_size, **kwargs)
+        self.compress = False
+        self.decompression_cpu = 0
+
+    def handshake_offer(self):
+        options = decode_options(super().handshake_offer())
+        options['compress'] = 'zlib'
+        return encode_options(options)
+
+    def handshake_accepted(self, options):
+        super().handshake_accepted(options)
+        self.compress = decode_options(options).get('compress') == 'zlib'
+
+    def complete_stream(self, stream_id, data):
+        if self.compress:
+            start = time.process_time()
+            data = decode_blocks(data)
+            self.decompression_cpu += time.process_time() - start
+        super().complete_stream(stream_id, data)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'send':
+        # Send every file given on the command line, one stream per file
+        sender = CompressingSender()
+        sender.accept()
+        for name in sys.argv[2:]:
+            with open(name, 'rb') as f:
+                sender.write(sender.open_stream(), f.read(), end=True)
+        sender.flush()
+        print(sender.stats())
+        sender.close()
+    else:
+        receiver = CompressingReceiver()
+        receiver.run()
+        print('Decompression took {:.3f} s of CPU'.format(receiver.decompression_cpu))
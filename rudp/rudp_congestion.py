@@ -0,0 +1,207 @@
+import time
+from collections import deque
+
+MIN_RTO = 0.05
+MAX_RTO = 4.0
+
+# LEDBAT (RFC 6817) parameters
+TARGET_DELAY = 0.1
+GAIN = 1
+# Minutes of one-way delay minima that make up the base delay
+BASE_HISTORY = 10
+# Samples whose minimum is the current delay
+CURRENT_FILTER = 4
+MIN_CWND = 2
+
+
+class RenoCongestionControl:
+    """
+    Loss-based (Reno style) congestion control and RTT estimation for one RUDP connection.
+
+    The congestion window is counted in bytes, the RTT estimator follows RFC 6298.
+
+    Attributes
+    ----------
+    mss : int
+        The maximum segment size in bytes.
+    cwnd : float
+        The congestion window in bytes.
+    ssthresh : float
+        The slow start threshold in bytes.
+    srtt : float
+        The smoothed round trip time in seconds, or None before the first sample.
+    rttvar : float
+        The round trip time variation in seconds.
+    rto : float
+        The current retransmission timeout in seconds.
+    bytes_in_flight : int
+        The number of payload bytes sent and not yet acknowledged.
+    """
+
+    def __init__(self, mss, initial_window=1, max_window=10, initial_rto=0.5, enabled=True):
+        """
+        :param mss: the maximum segment size in bytes
+        :param initial_window: the initial congestion window in segments
+        :param max_window: the largest window allowed in segments (the receiver's window)
+        :param initial_rto: the retransmission timeout used before the first RTT sample
+        :param enabled: whether the window reacts to acknowledgements and losses, otherwise it stays at max_window
+        """
+        self.mss = mss
+        self.enabled = enabled
+        self.cwnd = (initial_window if enabled else max_window) * mss
+        self.max_window = max_window
+        self.ssthresh = max_window * mss
+        self.srtt = None
+        self.rttvar = 0
+        self.rto = initial_rto
+        self.bytes_in_flight = 0
+
+    def reconfigure(self, mss, initial_window, initial_rto):
+        """
+        Restarts the controller with new parameters, e.g. a tuned profile.
+        :param mss: the maximum segment size in bytes
+        :param initial_window: the initial congestion window in segments
+        :param initial_rto: the retransmission timeout used before the first RTT sample
+        """
+        self.mss = mss
+        self.cwnd = (initial_window if self.enabled else self.max_window) * mss
+        self.ssthresh = self.max_window * mss
+        self.srtt = None
+        self.rttvar = 0
+        self.rto = initial_rto
+
+    def can_send(self, size):
+        """
+        Checks whether a segment of the given size fits in the current window.
+        :param size: the payload size of the segment
+        :return: True if the segment may be sent now
+        """
+        window = min(self.cwnd, self.max_window * self.mss)
+        return self.bytes_in_flight == 0 or self.bytes_in_flight + size <= window
+
+    def on_send(self, size):
+        """
+        Accounts for a newly sent segment.
+        :param size: the payload size of the segment
+        """
+        self.bytes_in_flight += size
+
+    def on_rtt_sample(self, rtt):
+        """
+        Updates the smoothed RTT and the retransmission timeout with a new sample.
+        :param rtt: the measured round trip time in seconds
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    def on_delay_sample(self, delay):
+        """
+        Takes a one-way delay sample. Loss-based control ignores it.
+        :param delay: the time between sending a segment and its arrival at the receiver, including the
+            offset between the two clocks
+        """
+        pass
+
+    def on_ack(self, size):
+        """
+        Grows the window after a segment was acknowledged.
+        :param size: the payload size of the acknowledged segment
+        """
+        self.bytes_in_flight = max(self.bytes_in_flight - size, 0)
+        if not self.enabled:
+            return
+        if self.cwnd < self.ssthresh:
+            self.cwnd += size
+        else:
+            self.cwnd += self.mss * size / self.cwnd
+
+    def on_loss(self):
+        """
+        Halves the window after a loss detected by duplicate acknowledgements.
+        """
+        if not self.enabled:
+            return
+        self.ssthresh = max(self.cwnd / 2, 2 * self.mss)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self):
+        """
+        Collapses the window and backs off the timer after a retransmission timeout.
+        """
+        self.rto = min(self.rto * 2, MAX_RTO)
+        if not self.enabled:
+            return
+        self.ssthresh = max(self.cwnd / 2, 2 * self.mss)
+        self.cwnd = self.mss
+
+    def on_discard(self, size):
+        """
+        Removes an abandoned segment from the flight without counting it as delivered.
+        :param size: the payload size of the segment
+        """
+        self.bytes_in_flight = max(self.bytes_in_flight - size, 0)
+
+
+class LedbatCongestionControl(RenoCongestionControl):
+    """
+    Delay-based scavenger congestion control (LEDBAT, RFC 6817) for background transfers.
+
+    The base delay is the smallest one-way delay seen in the last BASE_HISTORY minutes and the current
+    delay the smallest of the last CURRENT_FILTER samples; their difference is the queueing delay the
+    connection causes. The window grows while the queueing delay is below the target and shrinks in
+    proportion as it exceeds it, so the connection backs off before the queue overflows and leaves the
+    link to loss-based connections. Losses and timeouts are handled like Reno.
+
+    Attributes
+    ----------
+    target : float
+        The queueing delay the connection aims for in seconds.
+    queuing_delay : float
+        The last estimate of the queueing delay in seconds.
+    """
+
+    def __init__(self, mss, initial_window=1, max_window=10, initial_rto=0.5, enabled=True, target=TARGET_DELAY):
+        """
+        :param mss: the maximum segment size in bytes
+        :param initial_window: the initial congestion window in segments
+        :param max_window: the largest window allowed in segments (the receiver's window)
+        :param initial_rto: the retransmission timeout used before the first RTT sample
+        :param enabled: whether the window reacts to delay and losses, otherwise it stays at max_window
+        :param target: the target queueing delay in seconds
+        """
+        super().__init__(mss, initial_window, max_window, initial_rto, enabled)
+        self.target = target
+        self.base_delays = deque(maxlen=BASE_HISTORY)
+        self.current_delays = deque(maxlen=CURRENT_FILTER)
+        self.queuing_delay = 0
+
+    def on_delay_sample(self, delay):
+        """
+        Updates the base and current delay with a new one-way delay sample. The clock offset between the
+        hosts is part of both and cancels out in the queueing delay.
+        :param delay: the time between sending a segment and its arrival at the receiver
+        """
+        minute = int(time.time() // 60)
+        if self.base_delays and self.base_delays[-1][0] == minute:
+            self.base_delays[-1][1] = min(self.base_delays[-1][1], delay)
+        else:
+            self.base_delays.append([minute, delay])
+        self.current_delays.append(delay)
+        self.queuing_delay = min(self.current_delays) - min(base for _, base in self.base_delays)
+
+    def on_ack(self, size):
+        """
+        Moves the window towards the target delay after a segment was acknowledged.
+        :param size: the payload size of the acknowledged segment
+        """
+        self.bytes_in_flight = max(self.bytes_in_flight - size, 0)
+        if not self.enabled:
+            return
+        off_target = (self.target - self.queuing_delay) / self.target
+        self.cwnd += GAIN * off_target * size * self.mss / self.cwnd
+        self.cwnd = min(max(self.cwnd, MIN_CWND * self.mss), self.max_window * self.mss)
@@ -0,0 +1,224 @@
+import os
+import struct
+import sys
+import time
+
+from rudp_serial import seq_lt
+from rudp_streams import StreamSender, StreamReceiver, HEADER_SIZE, STREAM_HEADER_SIZE
+
+# Flag bit (next to STREAM=8) telling the receiver to give up on a message
+SKIP = 16
+# sequence number and length of an abandoned segment
+SKIP_ENTRY = '!II'
+SKIP_ENTRY_SIZE = 8
+DEFAULT_LIFETIME = 0.2
+
+
+class MessageSender(StreamSender):
+    """
+    A partially reliable, message oriented TCP-over-UDP sender for real-time data such as video frames.
+
+    Every message travels on its own stream, so its boundaries are preserved, and carries a lifetime.
+    Messages are retransmitted like any stream data until their deadline; after that the sender drops
+    whatever is left of them and sends a SKIP packet so the receiver stops waiting for the missing
+    segments. Among messages of the same priority the one with the earliest deadline is sent first.
+
+    Usage::
+
+        sender = MessageSender()
+        sender.accept()
+        for frame in frames:
+            sender.send_message(frame, lifetime=0.1)
+            sender.pump(time.time() + 1 / 30)
+        sender.flush()
+        sender.close()
+    """
+
+    def __init__(self, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, **kwargs):
+        """
+        :param server_address: the IP address of the server
+        :param server_port: the port the sender listens on
+        :param window_size: the largest number of segments in flight
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, **kwargs)
+        self.deadlines = {}
+        self.segment_streams = {}
+        self.expired = 0
+
+    def send_message(self, data, lifetime=DEFAULT_LIFETIME, priority=0):
+        """
+        Queues a message. It is sent by the next pump() or flush().
+        :param data: the message
+        :param lifetime: the number of seconds after which the message is worthless
+        :param priority: the scheduling priority, lower values are sent first
+        :return: the id of the stream carrying the message
+        """
+        stream_id = self.open_stream(priority)
+        self.write(stream_id, data, end=True)
+        self.deadlines[stream_id] = time.time() + lifetime
+        return stream_id
+
+    def pump(self, until):
+        """
+        Runs the send loop until the given time, or until all messages are delivered or expired.
+        :param until: the time (as returned by time.time()) to stop at
+        """
+        while (self.has_pending() or self.in_flight) and time.time() < until:
+            self.step()
+        remaining = until - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def step(self):
+        """
+        One round of the send loop, dropping expired messages first.
+        """
+        self.expire_messages()
+        super().step()
+
+    def next_stream(self):
+        """
+        Picks the pending message with the lowest priority value and, among those, the earliest deadline.
+        :return: the chosen Stream, or None if nothing is pending
+        """
+        ready = [stream for stream in self.streams.values() if stream.pending]
+        if not ready:
+            return None
+        return min(ready, key=lambda stream: (stream.priority, self.deadlines.get(stream.stream_id, float('inf'))))
+
+    def next_deadline(self):
+        """
+        :return: the earliest retransmission timer or message deadline
+        """
+        deadline = super().next_deadline()
+        if self.deadlines:
+            deadline = min(deadline, min(self.deadlines.values()))
+        return deadline
+
+    def flush(self):
+        """
+        Sends all queued messages and waits until each is acknowledged or expired, then forgets the
+        deadlines of the delivered ones.
+        """
+        super().flush()
+        self.deadlines = {stream_id: deadline for stream_id, deadline in self.deadlines.items()
+                          if stream_id in self.streams}
+
+    def send_segment(self, stream_id, offset, chunk, end, flags=0):
+        if not flags & SKIP:
+            self.segment_streams[self.seq_num] = stream_id
+        super().send_segment(stream_id, offset, chunk, end, flags)
+
+    def expire_messages(self):
+        """
+        Forgets delivered messages and abandons the ones whose deadline has passed.
+        """
+        now = time.time()
+        self.segment_streams = {seq: stream_id for seq, stream_id in self.segment_streams.items()
+                                if seq in self.in_flight}
+        in_flight = {}
+        for seq, stream_id in self.segment_streams.items():
+            in_flight.setdefault(stream_id, []).append(seq)
+
+        for stream_id, deadline in list(self.deadlines.items()):
+            stream = self.streams.get(stream_id)
+            seqs = in_flight.get(stream_id, [])
+            if stream is None:
+                # flush() already forgot the delivered stream
+                del self.deadlines[stream_id]
+            elif not stream.pending and not seqs:
+                # Every segment of the message was acknowledged
+                del self.deadlines[stream_id]
+                del self.streams[stream_id]
+            elif now >= deadline:
+                self.abandon(stream, seqs)
+
+    def abandon(self, stream, seqs):
+        """
+        Stops sending a message. If the receiver may already hold part of it, a SKIP packet listing the
+        abandoned segments is sent; SKIP packets are retransmitted like data until acknowledged.
+        :param stream: the Stream of the message
+        :param seqs: the sequence numbers of its unacknowledged segments
+        """
+        started = bool(seqs) or not stream.pending or stream.pending[0][0] > 0
+        entries = []
+        for seq in seqs:
+            entry = self.in_flight.pop(seq)
+            self.path_cc(entry[4]).on_discard(entry[2])
+            entries.append(struct.pack(SKIP_ENTRY, seq, max(entry[2], 1)))
+        if started:
+            self.send_segment(stream.stream_id, 0, b''.join(entries), False, SKIP)
+        del self.deadlines[stream.stream_id]
+        del self.streams[stream.stream_id]
+        self.expired += 1
+        print('Message on stream {} expired'.format(stream.stream_id))
+
+
+class MessageReceiver(StreamReceiver):
+    """
+    The receiving side of MessageSender. Complete messages are handed to on_message; messages the
+    sender abandoned are dropped and recorded in skipped, with the sequence number of the SKIP packet.
+    """
+
+    def __init__(self, address='127.0.0.1', port=55552, server_port=55555, window_size=10, on_message=None,
+                 **kwargs):
+        """
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        :param on_message: called with (stream_id, data) for every complete message
+        """
+        super().__init__(address, port, server_port, window_size, on_stream=on_message, **kwargs)
+        self.skipped = {}
+
+    def on_segment(self, flags, packet):
+        seq_num = struct.unpack('!I', packet[:4])[0]
+        stream_id = struct.unpack('!H', packet[HEADER_SIZE:HEADER_SIZE + 2])[0]
+        if flags & SKIP:
+            self.skip(stream_id, packet[HEADER_SIZE + STREAM_HEADER_SIZE:], seq_num)
+            return
+        if stream_id in self.skipped and seq_lt(self.skipped[stream_id], seq_num):
+            # The abandoned message was sent before its SKIP packet, so this is a new message that
+            # reuses the stream id
+            del self.skipped[stream_id]
+        if stream_id not in self.skipped:
+            super().on_segment(flags, packet)
+
+    def skip(self, stream_id, entries, seq_num):
+        """
+        Drops a message and treats its missing segments as received.
+        :param stream_id: the stream of the message
+        :param entries: the packed (sequence number, length) pairs of the abandoned segments
+        :param seq_num: the sequence number of the SKIP packet
+        """
+        for i in range(0, len(entries), SKIP_ENTRY_SIZE):
+            seq, length = struct.unpack(SKIP_ENTRY, entries[i:i + SKIP_ENTRY_SIZE])
+            self.mark_received(seq, length)
+        self.streams.pop(stream_id, None)
+        self.skipped[stream_id] = seq_num
+        print('Message on stream {} skipped'.format(stream_id))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'send':
+        # Stream the pictures of one quality folder as frames at 10 frames per second
+        folder = sys.argv[2] if len(sys.argv) > 2 else '240P'
+        sender = MessageSender()
+        sender.accept()
+        for i in range(1, 21):
+            name = os.path.join(folder, '{}.png'.format(i))
+            if os.path.isfile(name):
+                with open(name, 'rb') as f:
+                    sender.send_message(f.read(), lifetime=0.3)
+                sender.pump(time.time() + 0.1)
+        sender.flush()
+        print('{} of the frames expired'.format(sender.expired))
+        sender.close()
+    else:
+        receiver = MessageReceiver()
+        receiver.run()
+        print('Received {} frames, skipped {}'.format(len(receiver.completed), len(receiver.skipped)))
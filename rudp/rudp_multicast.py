@@ -0,0 +1,491 @@
+import argparse
+import os
+import select
+import socket
+import struct
+import time
+from collections import deque
+
+from Reliable_UDP_Sender import MSS
+from rudp_multipath import JOIN, JOIN_RETRIES
+from rudp_sockets import bdp_buffer_size, set_buffers
+from rudp_streams import StreamReceiver, Stream, HEADER, HEADER_SIZE, STREAM, STREAM_HEADER, BUFFER_SIZE, \
+    END_OF_STREAM, FIN_RETRIES, next_stream_id
+
+# Flag bit (next to SHM=64) marking the packets of a one-to-many session
+MULTICAST = 128
+# A NAK lists the sequence numbers of missing segments
+NAK_ENTRY = '!I'
+NAK_ENTRY_SIZE = 4
+MAX_NAKS = 1024
+# How long the sender collects NAKs before repairing, so one repair serves every receiver that lost a segment
+NAK_HOLDOFF = 0.01
+# A segment is repaired at most once per interval, however many receivers ask for it
+REPAIR_INTERVAL = 0.02
+# A receiver asks for the same segment again after this long
+NAK_RETRY = 0.05
+HEARTBEAT_INTERVAL = 0.05
+# Receivers report their progress every ACK_EVERY segments
+ACK_EVERY = 8
+# The sender stays at most this many segments ahead of the slowest receiver
+WINDOW = 32
+# Receivers not heard from for this long are dropped from the session, and receivers give up on a
+# silent sender after it
+RECEIVER_TIMEOUT = 5.0
+GROUP_PORT = 56100
+
+
+class ReceiverState:
+    """
+    What a MulticastSender knows about one receiver of the session.
+    """
+
+    def __init__(self, address):
+        """
+        :param address: the unicast address of the receiver
+        """
+        self.address = address
+        self.ack = 0
+        self.closed = False
+        self.last_heard = time.time()
+
+
+class MulticastSender:
+    """
+    Sends the same streams to many receivers, transmitting every segment once.
+
+    Segments go to a multicast group, or, without a group, are fanned out to the address of every
+    receiver from the same packet. Receivers register with a JOIN, report their cumulative progress
+    every ACK_EVERY segments and send NAKs listing the segments they miss. The sender collects NAKs
+    for NAK_HOLDOFF and repairs each missing segment once for all receivers that asked for it. Periodic
+    heartbeats carry the number of segments sent so far, so that receivers also detect a lost tail.
+    The sender never runs more than WINDOW segments ahead of the slowest receiver, and keeps a segment for
+    repairs only until every receiver reported it, so at most about a window is held in memory. A receiver
+    that joins late starts at the oldest segment still held.
+
+    Usage::
+
+        sender = MulticastSender(group=('239.1.2.3', 56000))
+        sender.wait_for_receivers(8)
+        sender.write(sender.open_stream(), data, end=True)
+        sender.flush()
+        sender.close()
+    """
+
+    def __init__(self, server_address='127.0.0.1', server_port=55555, group=None, window=WINDOW, mss=MSS):
+        """
+        :param server_address: the IP address of the sender, also the interface used for multicast
+        :param server_port: the port receivers join on
+        :param group: the (address, port) of the multicast group, or None to fan out to every receiver
+        :param window: the largest number of segments ahead of the slowest receiver
+        :param mss: the largest stream payload per packet
+        """
+        self.server_address = server_address
+        self.group = group
+        self.window = window
+        self.mss = mss
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((server_address, server_port))
+        set_buffers(self.socket, bdp_buffer_size(window, mss))
+        if group is not None:
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(server_address))
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.streams = {}
+        self.last_stream_id = 0
+        self.pending = deque()
+        # The packets of segments base, base + 1, ... that some receiver has not reported yet, kept for repairs
+        self.packets = deque()
+        self.base = 0
+        self.next_seq = 0
+        self.receivers = {}
+        # segment number -> addresses of the receivers that miss it
+        self.naks = {}
+        self.nak_deadline = None
+        self.last_repair = {}
+        self.last_heartbeat = 0
+        self.start_cpu = time.process_time()
+        self.segments_sent = 0
+        self.repairs = 0
+        self.naks_received = 0
+        self.datagrams_sent = 0
+
+    def stats(self):
+        """
+        :return: a dictionary with the statistics of the session
+        """
+        return {
+            'receivers': len(self.receivers),
+            'segments_sent': self.segments_sent,
+            'repairs': self.repairs,
+            'naks_received': self.naks_received,
+            'datagrams_sent': self.datagrams_sent,
+            'buffered': len(self.packets),
+            'cpu': time.process_time() - self.start_cpu,
+        }
+
+    def open_stream(self):
+        """
+        :return: the id of a new stream
+        """
+        stream_id = next_stream_id(self.last_stream_id, self.streams)
+        self.last_stream_id = stream_id
+        self.streams[stream_id] = Stream(stream_id)
+        return stream_id
+
+    def write(self, stream_id, data, end=False):
+        """
+        Queues data on a stream. Nothing is sent until flush() is called.
+        :param stream_id: the stream to write to
+        :param data: the data to send
+        :param end: whether this is the last data of the stream
+        """
+        stream = self.streams[stream_id]
+        stream.write(data, self.mss, end)
+        while stream.pending:
+            self.pending.append((stream_id,) + stream.pending.popleft())
+        if end:
+            del self.streams[stream_id]
+
+    def wait_for_receivers(self, count, timeout=None):
+        """
+        Waits until `count` receivers joined the session.
+        :param count: the number of receivers to wait for
+        :param timeout: the longest time to wait in seconds, None to wait forever
+        :return: True if enough receivers joined
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self.receivers) < count:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            self.socket.settimeout(remaining)
+            try:
+                packet, address = self.socket.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                return False
+            self.handle_packet(packet, address)
+        return True
+
+    def transmit(self, packet, addresses=None):
+        """
+        Sends a packet to the receivers: once to the group, or once per receiver when fanning out.
+        :param packet: the raw packet
+        :param addresses: the receivers that need the packet when fanning out, all of them by default
+        """
+        if self.group is not None:
+            self.socket.sendto(packet, self.group)
+            self.datagrams_sent += 1
+            return
+        for address in self.receivers if addresses is None else addresses:
+            self.socket.sendto(packet, address)
+            self.datagrams_sent += 1
+
+    def send_new(self):
+        """
+        Sends queued segments while the slowest receiver is less than a window behind.
+        """
+        active = [receiver.ack for receiver in self.receivers.values() if not receiver.closed]
+        limit = (min(active) if active else self.next_seq) + self.window
+        while self.pending and self.next_seq < limit:
+            stream_id, offset, chunk, end = self.pending.popleft()
+            packet = struct.pack(HEADER, self.next_seq, 0, MULTICAST | STREAM, 0) + \
+                struct.pack(STREAM_HEADER, stream_id, END_OF_STREAM if end else 0, offset) + chunk
+            self.packets.append(packet)
+            self.next_seq += 1
+            self.transmit(packet)
+            self.segments_sent += 1
+
+    def heartbeat(self, fin=False):
+        """
+        Tells the receivers how many segments were sent.
+        :param fin: whether the session is over
+        """
+        self.transmit(struct.pack(HEADER, self.next_seq, 0, MULTICAST | (1 if fin else 0), 0))
+        self.last_heartbeat = time.time()
+
+    def repair(self):
+        """
+        Resends every segment some receiver asked for, each once: to the group, or when fanning out to
+        the receivers that asked.
+        """
+        now = time.time()
+        for seq in sorted(self.naks):
+            if seq >= self.base and now - self.last_repair.get(seq, 0) >= REPAIR_INTERVAL:
+                self.transmit(self.packets[seq - self.base], self.naks[seq])
+                self.last_repair[seq] = now
+                self.repairs += 1
+        self.naks.clear()
+        self.nak_deadline = None
+
+    def release(self):
+        """
+        Forgets the segments every receiver in the session has reported, no repair can ask for them.
+        """
+        active = [receiver.ack for receiver in self.receivers.values() if not receiver.closed]
+        target = min(active) if active else self.next_seq
+        while self.base < target and self.packets:
+            self.packets.popleft()
+            self.last_repair.pop(self.base, None)
+            self.base += 1
+
+    def handle_packet(self, packet, address):
+        """
+        Handles a JOIN, progress report, NAK or FIN-ACK from a receiver.
+        :param packet: the raw packet
+        :param address: the address of the receiver
+        """
+        if len(packet) < HEADER_SIZE:
+            return
+        seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+        if not flags & MULTICAST:
+            return
+        if flags & JOIN:
+            if address not in self.receivers:
+                print('Receiver {} joined'.format(address))
+                self.receivers[address] = ReceiverState(address)
+                self.receivers[address].ack = self.base
+            # The receiver starts at the oldest segment still held
+            self.socket.sendto(struct.pack(HEADER, self.next_seq, self.base, MULTICAST | JOIN | 2, 0), address)
+            return
+        receiver = self.receivers.get(address)
+        if receiver is None:
+            return
+        receiver.last_heard = time.time()
+        if flags & 1 and flags & 2:
+            receiver.closed = True
+            self.release()
+        elif flags & 2:
+            receiver.ack = max(receiver.ack, ack_num)
+            self.release()
+            count = min((len(packet) - HEADER_SIZE) // NAK_ENTRY_SIZE, MAX_NAKS)
+            if count:
+                self.naks_received += 1
+                missing = struct.unpack('!{}I'.format(count),
+                                        packet[HEADER_SIZE:HEADER_SIZE + count * NAK_ENTRY_SIZE])
+                for seq in missing:
+                    # Segments below base were reported by everyone, the NAK is stale
+                    if self.base <= seq < self.next_seq:
+                        self.naks.setdefault(seq, set()).add(address)
+                if self.nak_deadline is None:
+                    self.nak_deadline = time.time() + NAK_HOLDOFF
+
+    def drop_silent_receivers(self):
+        """
+        Removes receivers that have not been heard from for RECEIVER_TIMEOUT.
+        """
+        now = time.time()
+        for address, receiver in list(self.receivers.items()):
+            if not receiver.closed and now - receiver.last_heard > RECEIVER_TIMEOUT:
+                print('Receiver {} timed out'.format(address))
+                del self.receivers[address]
+        self.release()
+
+    def poll(self):
+        """
+        Waits for receiver packets until the next heartbeat or repair is due and handles them.
+        """
+        deadlines = [self.last_heartbeat + HEARTBEAT_INTERVAL]
+        if self.nak_deadline is not None:
+            deadlines.append(self.nak_deadline)
+        readable, _, _ = select.select([self.socket], [], [], max(min(deadlines) - time.time(), 0.001))
+        if not readable:
+            return
+        self.socket.setblocking(False)
+        try:
+            while True:
+                packet, address = self.socket.recvfrom(BUFFER_SIZE)
+                self.handle_packet(packet, address)
+        except BlockingIOError:
+            pass
+
+    def flush(self):
+        """
+        Sends everything queued and waits until every receiver has all of it.
+        """
+        while True:
+            self.send_new()
+            if self.nak_deadline is not None and time.time() >= self.nak_deadline:
+                self.repair()
+            if time.time() - self.last_heartbeat >= HEARTBEAT_INTERVAL:
+                self.heartbeat()
+                self.drop_silent_receivers()
+            if not self.pending and all(receiver.ack >= self.next_seq for receiver in self.receivers.values()):
+                return
+            self.poll()
+
+    def close(self):
+        """
+        Ends the session: sends FIN heartbeats until every receiver answered with a FIN-ACK, up to
+        FIN_RETRIES times, and closes the socket.
+        """
+        for _ in range(FIN_RETRIES):
+            if all(receiver.closed for receiver in self.receivers.values()):
+                break
+            self.heartbeat(fin=True)
+            deadline = time.time() + HEARTBEAT_INTERVAL
+            while time.time() < deadline and not all(receiver.closed for receiver in self.receivers.values()):
+                self.poll()
+        self.socket.close()
+
+
+class MulticastReceiver(StreamReceiver):
+    """
+    The receiving side of MulticastSender. It joins the session from its own unicast port, receives
+    segments on the group (or on that port when the sender fans out) and reassembles the streams like
+    StreamReceiver. Segments are numbered 0, 1, ... in the session, so each takes one sequence number.
+    """
+
+    def __init__(self, address='127.0.0.1', port=55552, server_port=55555, group=None, on_stream=None):
+        """
+        :param address: the IP address of the receiver and the sender
+        :param port: the unicast port of the receiver
+        :param server_port: the port of the sender
+        :param group: the (address, port) of the multicast group, or None if the sender fans out
+        :param on_stream: called with (stream_id, data) whenever a stream is complete
+        """
+        super().__init__(address, port, server_port, on_stream=on_stream)
+        # Room for a window of the session whichever socket the segments arrive on
+        set_buffers(self.socket, bdp_buffer_size(WINDOW, MSS))
+        self.sockets = [self.socket]
+        if group is not None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('', group[1]))
+            membership = struct.pack('4s4s', socket.inet_aton(group[0]), socket.inet_aton(address))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            set_buffers(sock, bdp_buffer_size(WINDOW, MSS))
+            self.sockets.append(sock)
+        self.server = (address, server_port)
+        self.total = 0
+        self.nak_times = {}
+        self.unreported = 0
+
+    def join(self):
+        """
+        Registers with the sender.
+        :return: True if the sender answered
+        """
+        self.socket.settimeout(0.5)
+        join_packet = struct.pack(HEADER, 0, 0, MULTICAST | JOIN, 0)
+        try:
+            for _ in range(JOIN_RETRIES):
+                self.socket.sendto(join_packet, self.server)
+                try:
+                    while True:
+                        packet, address = self.socket.recvfrom(BUFFER_SIZE)
+                        seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+                        if address == self.server and flags & JOIN:
+                            # Segments before ack_num were released by the sender, a late receiver starts
+                            # after them
+                            self.expected_seq_num = max(self.expected_seq_num, ack_num)
+                            return True
+                except socket.timeout:
+                    continue
+            return False
+        finally:
+            self.socket.settimeout(None)
+
+    def run(self):
+        """
+        Joins the session and receives streams until the sender ends it.
+        :return: a dictionary of stream id to the data of the stream
+        """
+        if not self.join():
+            print('The sender did not answer')
+            return self.completed
+        while True:
+            readable, _, _ = select.select(self.sockets, [], [], RECEIVER_TIMEOUT)
+            if not readable:
+                if self.expected_seq_num < self.total:
+                    print('The sender went silent with {} segments missing'.format(
+                        self.total - self.expected_seq_num))
+                return self.completed
+            for sock in readable:
+                packet, address = sock.recvfrom(BUFFER_SIZE)
+                if self.handle_packet(packet):
+                    return self.completed
+
+    def handle_packet(self, packet):
+        """
+        Handles a segment or a heartbeat from the sender.
+        :param packet: the raw packet
+        :return: True if the session is over
+        """
+        seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+        if not flags & MULTICAST:
+            return False
+        if flags & STREAM:
+            self.segments_received += 1
+            self.total = max(self.total, seq_num + 1)
+            if self.mark_received(seq_num, 1):
+                self.on_segment(flags, packet)
+                self.unreported += 1
+            else:
+                self.duplicates += 1
+            if seq_num > self.expected_seq_num or self.unreported >= ACK_EVERY:
+                self.report()
+            return False
+        if flags & JOIN:
+            return False
+        # A heartbeat: seq_num segments were sent so far
+        self.total = max(self.total, seq_num)
+        if flags & 1 and self.expected_seq_num >= self.total:
+            self.socket.sendto(struct.pack(HEADER, 0, self.expected_seq_num, MULTICAST | 2 | 1, 0), self.server)
+            return True
+        self.report(force=True)
+        return False
+
+    def report(self, force=False):
+        """
+        Sends the sender the cumulative progress and the segments that are missing and were not asked for
+        within NAK_RETRY.
+        :param force: send the progress even if nothing is missing
+        """
+        now = time.time()
+        missing = []
+        for seq in range(self.expected_seq_num, self.total):
+            if len(missing) == MAX_NAKS:
+                break
+            if seq not in self.buffer and now - self.nak_times.get(seq, 0) >= NAK_RETRY:
+                missing.append(seq)
+                self.nak_times[seq] = now
+        if not missing and not force and self.unreported < ACK_EVERY:
+            return
+        self.unreported = 0
+        packet = struct.pack(HEADER, 0, self.expected_seq_num, MULTICAST | 2, 0) + \
+            struct.pack('!{}I'.format(len(missing)), *missing)
+        self.socket.sendto(packet, self.server)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send a quality folder to many receivers at once.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    send_parser = subparsers.add_parser('send', help='wait for the receivers and send the pictures')
+    send_parser.add_argument('folder')
+    send_parser.add_argument('--receivers', type=int, default=1, help='receivers to wait for')
+    send_parser.add_argument('--port', type=int, default=55555, help='the port receivers join on')
+    send_parser.add_argument('--group', help='the multicast group, the sender fans out without one')
+    receive_parser = subparsers.add_parser('receive', help='join a session and receive the pictures')
+    receive_parser.add_argument('--port', type=int, default=55552, help='the local port')
+    receive_parser.add_argument('--server-port', type=int, default=55555, help='the port of the sender')
+    receive_parser.add_argument('--group', help='the multicast group of the session')
+    args = parser.parse_args()
+    group = (args.group, GROUP_PORT) if args.group else None
+
+    if args.command == 'send':
+        sender = MulticastSender(server_port=args.port, group=group)
+        sender.wait_for_receivers(args.receivers)
+        for i in range(1, 21):
+            name = os.path.join(args.folder, '{}.png'.format(i))
+            if os.path.isfile(name):
+                with open(name, 'rb') as f:
+                    sender.write(sender.open_stream(), f.read(), end=True)
+        sender.flush()
+        print(sender.stats())
+        sender.close()
+    else:
+        receiver = MulticastReceiver(port=args.port, server_port=args.server_port, group=group)
+        receiver.run()
+        print(receiver.stats())
@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import functools
+import io
+import multiprocessing
+import os
+import time
+
+from rudp_bench import send_payload, run_worker
+from rudp_multicast import MulticastSender, MulticastReceiver, GROUP_PORT
+from rudp_server import RUDPServer
+from rudp_streams import StreamReceiver
+
+SERVER_PORT = 56200
+CLIENT_PORT = 57000
+
+
+def process_cpu(pid):
+    """
+    :param pid: a process id
+    :return: the user and system CPU time the process used so far in seconds (Linux only)
+    """
+    with open('/proc/{}/stat'.format(pid)) as f:
+        # the command name may contain spaces, the fields after it do not
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def run_unicast_client(index, done):
+    with contextlib.redirect_stdout(io.StringIO()):
+        StreamReceiver(port=CLIENT_PORT + index, server_port=SERVER_PORT).run()
+    done.put(index)
+
+
+def run_multicast_client(index, group, done):
+    with contextlib.redirect_stdout(io.StringIO()):
+        MulticastReceiver(port=CLIENT_PORT + index, server_port=SERVER_PORT, group=group).run()
+    done.put(index)
+
+
+def run_multicast_sender(payload, receivers, group, results):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sender = MulticastSender(server_port=SERVER_PORT, group=group)
+        sender.wait_for_receivers(receivers)
+        start = time.process_time()
+        sender.write(sender.open_stream(), payload, end=True)
+        sender.flush()
+        stats = sender.stats()
+        stats['cpu'] = time.process_time() - start
+        sender.close()
+    results.put(stats)
+
+
+def unicast(payload, receivers):
+    """
+    Serves every receiver over its own connection from a single RUDPServer worker.
+    :param payload: the data every receiver downloads
+    :param receivers: the number of receivers
+    :return: the CPU time of the server worker in seconds
+    """
+    server = RUDPServer(functools.partial(send_payload, payload), port=SERVER_PORT, workers=1)
+    worker = multiprocessing.Process(target=run_worker, args=(server, 0))
+    worker.start()
+    time.sleep(1)
+    before = process_cpu(worker.pid)
+    done = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=run_unicast_client, args=(i, done)) for i in range(receivers)]
+    for client in clients:
+        client.start()
+    for _ in clients:
+        done.get()
+    cpu = process_cpu(worker.pid) - before
+    for client in clients:
+        client.join()
+    worker.terminate()
+    worker.join()
+    return cpu
+
+
+def multicast(payload, receivers, group):
+    """
+    Sends one stream to every receiver with a MulticastSender.
+    :param payload: the data every receiver downloads
+    :param receivers: the number of receivers
+    :param group: the multicast group address, or None to fan out
+    :return: the sender statistics, with the CPU time of the transfer in seconds
+    """
+    results = multiprocessing.Queue()
+    done = multiprocessing.Queue()
+    sender = multiprocessing.Process(target=run_multicast_sender, args=(payload, receivers, group, results))
+    sender.start()
+    time.sleep(0.5)
+    clients = [multiprocessing.Process(target=run_multicast_client, args=(i, group, done))
+               for i in range(receivers)]
+    for client in clients:
+        client.start()
+    stats = results.get()
+    for client in clients:
+        client.join()
+    sender.join()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Server CPU of unicast, fan-out and multicast distribution.')
+    parser.add_argument('--receivers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='receiver counts to measure')
+    parser.add_argument('--size', type=int, default=8, help='megabytes every receiver downloads')
+    parser.add_argument('--group', default='239.1.2.3', help='the multicast group, empty to skip multicast')
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size * 1000000)
+    group = (args.group, GROUP_PORT) if args.group else None
+    for receivers in args.receivers:
+        line = '{} receiver(s): unicast {:.3f} s'.format(receivers, unicast(payload, receivers))
+        stats = multicast(payload, receivers, None)
+        line += ', fan-out {:.3f} s ({} datagrams)'.format(stats['cpu'], stats['datagrams_sent'])
+        if group:
+            stats = multicast(payload, receivers, group)
+            line += ', multicast {:.3f} s ({} datagrams)'.format(stats['cpu'], stats['datagrams_sent'])
+        print(line)
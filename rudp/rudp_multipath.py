@@ -0,0 +1,296 @@
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+from Reliable_UDP_Sender import MSS
+from rudp_congestion import RenoCongestionControl
+from rudp_serial import seq_lt
+from rudp_sockets import bdp_buffer_size, set_buffers
+from rudp_streams import StreamSender, StreamReceiver, HEADER, HEADER_SIZE, STREAM, BUFFER_SIZE, DUP_ACK_THRESHOLD
+
+# Flag bit (next to SKIP=16) used to attach an extra subflow to an established connection
+JOIN = 32
+JOIN_RETRIES = 5
+
+
+class Subflow:
+    """
+    One UDP flow (socket and peer address) of a multipath connection with its own congestion state.
+    """
+
+    def __init__(self, sock, cc, address=None):
+        """
+        :param sock: the local socket of the subflow
+        :param cc: the congestion controller of the subflow
+        :param address: the peer address, None until the peer joined
+        """
+        self.socket = sock
+        self.cc = cc
+        self.address = address
+
+    def capacity(self):
+        """
+        :return: the estimated capacity of the subflow in bytes per second (window over round trip time)
+        """
+        return self.cc.cwnd / (self.cc.srtt or self.cc.rto)
+
+
+class MultipathSender(StreamSender):
+    """
+    A stream sender that stripes one connection over several UDP sockets.
+
+    The sender listens on server_port, server_port + 1, ... server_port + subflows - 1. The primary
+    subflow is set up by the normal handshake; the receiver attaches the other ones with JOIN packets
+    at any time during the connection. Every subflow has its own congestion window and RTT estimate,
+    and each segment goes to the subflow with the largest estimated capacity that still has room.
+    Sequence numbers and streams are shared, so the receiver reassembles across subflows.
+
+    Subflows with different round trips reorder the shared sequence space, so duplicate cumulative
+    acknowledgements say nothing about loss. Instead a segment counts as lost once DUP_ACK_THRESHOLD
+    segments sent after it on the same subflow were acknowledged, and only that subflow's window shrinks.
+    """
+
+    def __init__(self, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, subflows=2, **kwargs):
+        """
+        :param server_address: the IP address of the server
+        :param server_port: the port of the primary subflow
+        :param window_size: the largest number of segments in flight per subflow
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        :param subflows: the largest number of subflows the receiver may open
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, **kwargs)
+        self.subflows = [Subflow(self.socket, self.cc)]
+        for i in range(1, subflows):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('localhost', server_port + i))
+            sock.setblocking(False)
+            cc = RenoCongestionControl(self.mss, max_window=window_size, initial_rto=timeout,
+                                       enabled=congestion_control)
+            self.subflows.append(Subflow(sock, cc))
+        # Segments sent later on the same subflow and acknowledged, per unacknowledged segment
+        self.acked_after = {}
+
+    def accept(self):
+        """
+        Performs the handshake on the primary subflow.
+        :return: True if the connection was established, False otherwise
+        """
+        if not super().accept():
+            return False
+        self.subflows[0].address = self.client_address
+        return True
+
+    def apply_profile(self, profile):
+        """
+        Uses tuned transport parameters for every subflow. The extra subflows were created before the
+        handshake loaded the profile, so their controllers and sockets are reconfigured here as well.
+        :param profile: a dictionary with any of mss, initial_window, initial_rto and buffer_size
+        """
+        super().apply_profile(profile)
+        for subflow in self.subflows[1:]:
+            subflow.cc.reconfigure(self.mss, profile.get('initial_window', 1),
+                                   profile.get('initial_rto', self.timeout))
+            if profile.get('buffer_size'):
+                set_buffers(subflow.socket, profile['buffer_size'])
+
+    def choose_path(self, size):
+        """
+        Picks the joined subflow with the largest estimated capacity that has room for the segment.
+        :param size: the payload size of the segment
+        :return: the index of the subflow, or None if every window is full
+        """
+        best = None
+        for i, subflow in enumerate(self.subflows):
+            if subflow.address is None or not subflow.cc.can_send(size):
+                continue
+            if best is None or subflow.capacity() > self.subflows[best].capacity():
+                best = i
+        return best
+
+    def path_cc(self, path):
+        return self.subflows[path].cc
+
+    def path_send(self, path, packet):
+        subflow = self.subflows[path]
+        subflow.socket.sendto(packet, subflow.address)
+
+    def detect_loss(self, ack_num, acked_seq, entry):
+        """
+        Fast retransmit per subflow: every acknowledgement of a first transmission counts against the
+        older segments still in flight on the same subflow.
+        """
+        if entry is None or entry[3]:
+            return
+        path = entry[4]
+        for seq, older in self.in_flight.items():
+            if not seq_lt(seq, acked_seq):
+                break
+            if older[4] != path or older[3]:
+                continue
+            self.acked_after[seq] = self.acked_after.get(seq, 0) + 1
+            if self.acked_after[seq] == DUP_ACK_THRESHOLD:
+                self.retransmit(seq)
+                self.path_cc(path).on_loss()
+        self.acked_after = {seq: count for seq, count in self.acked_after.items() if seq in self.in_flight}
+
+    def receive_acks(self):
+        """
+        Waits on all subflows for acknowledgements (and JOIN requests) until the earliest retransmission
+        deadline.
+        """
+        if not self.in_flight:
+            return
+        sockets = [subflow.socket for subflow in self.subflows]
+        readable, _, _ = select.select(sockets, [], [], max(self.next_deadline() - time.time(), 0.001))
+        for sock in readable:
+            path = sockets.index(sock)
+            sock.setblocking(False)
+            try:
+                while True:
+                    packet, address = sock.recvfrom(BUFFER_SIZE)
+                    self.handle_subflow_packet(path, packet, address)
+            except BlockingIOError:
+                pass
+
+    def handle_subflow_packet(self, path, packet, address):
+        """
+        Handles a packet that arrived on a subflow: a JOIN attaches the peer, anything else must come
+        from the subflow's peer and is processed as an acknowledgement.
+        :param path: the index of the subflow
+        :param packet: the raw packet
+        :param address: the address the packet came from
+        """
+        subflow = self.subflows[path]
+        flags = struct.unpack(HEADER, packet[:HEADER_SIZE])[2]
+        if flags & JOIN:
+            if path > 0 and address[0] == self.client_address[0]:
+                if subflow.address is None:
+                    print('Subflow {} joined from {}'.format(path, address))
+                subflow.address = address
+                join_ack = struct.pack(HEADER, self.seq_num, 0, JOIN | 2, self.window_size)
+                subflow.socket.sendto(join_ack, address)
+        elif address == subflow.address:
+            self.handle_ack(packet)
+
+    def close(self):
+        """
+        Closes the connection on the primary subflow and releases the other sockets.
+        """
+        self.socket.setblocking(True)
+        self.socket.settimeout(self.timeout)
+        super().close()
+        for subflow in self.subflows[1:]:
+            subflow.socket.close()
+
+
+class MultipathReceiver(StreamReceiver):
+    """
+    The receiving side of MultipathSender. It binds port, port + 1, ... and joins one extra subflow per
+    socket after the handshake; segments and acknowledgements travel on whichever subflow the sender
+    chose and streams are reassembled across all of them.
+    """
+
+    def __init__(self, address='127.0.0.1', port=55552, server_port=55555, window_size=10, subflows=2,
+                 **kwargs):
+        """
+        :param address: the IP address of the receiver
+        :param port: the port of the primary subflow
+        :param server_port: the port of the sender's primary subflow
+        :param window_size: window size of the receiver
+        :param subflows: the number of subflows to open
+        """
+        super().__init__(address, port, server_port, window_size, **kwargs)
+        self.sockets = [self.socket]
+        for i in range(1, subflows):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.address, self.port + i))
+            # Sized like the primary socket, a subflow may carry a whole window too
+            set_buffers(sock, bdp_buffer_size(window_size, MSS))
+            self.sockets.append(sock)
+
+    def join(self, index):
+        """
+        Attaches an extra subflow to the connection.
+        :param index: the index of the subflow (1 for the first extra one)
+        :return: True if the sender accepted the subflow
+        """
+        sock = self.sockets[index]
+        sock.settimeout(0.5)
+        join_packet = struct.pack(HEADER, self.seq_num, 0, JOIN, self.window_size)
+        for _ in range(JOIN_RETRIES):
+            sock.sendto(join_packet, (self.address, self.server_port + index))
+            try:
+                while True:
+                    packet, address = sock.recvfrom(BUFFER_SIZE)
+                    if struct.unpack(HEADER, packet[:HEADER_SIZE])[2] & JOIN:
+                        return True
+                    self.handle_packet(packet, sock, address)
+            except socket.timeout:
+                continue
+        print('Subflow {} could not join'.format(index))
+        return False
+
+    def run(self):
+        """
+        Connects, joins the extra subflows and receives streams until the connection is closed.
+        :return: a dictionary of stream id to the data of the stream
+        """
+        self.connect()
+        for i in range(1, len(self.sockets)):
+            self.join(i)
+        for sock in self.sockets:
+            sock.setblocking(True)
+        while True:
+            readable, _, _ = select.select(self.sockets, [], [])
+            for sock in readable:
+                packet, address = sock.recvfrom(BUFFER_SIZE)
+                if self.handle_packet(packet, sock, address):
+                    return self.completed
+
+    def handle_packet(self, packet, sock, address):
+        """
+        Handles one packet from any subflow.
+        :param packet: the raw packet
+        :param sock: the socket the packet arrived on
+        :param address: the address of the sender
+        :return: True if the packet closed the connection
+        """
+        seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+        if flags & 1:
+            fin_ack_packet = self.create_packet(fin=True, ack=True, ack_num=self.expected_seq_num)
+            sock.sendto(fin_ack_packet, address)
+            return True
+        if flags & STREAM and not flags & JOIN:
+            self.handle_segment(seq_num, flags, packet, address, sock)
+        return False
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    if len(sys.argv) > 1 and sys.argv[1] == 'send':
+        # Send every picture of one quality folder striped over several subflows
+        folder = sys.argv[2] if len(sys.argv) > 2 else '240P'
+        sender = MultipathSender(subflows=count)
+        sender.accept()
+        start = time.time()
+        for i in range(1, 21):
+            name = os.path.join(folder, '{}.png'.format(i))
+            if os.path.isfile(name):
+                with open(name, 'rb') as f:
+                    sender.write(sender.open_stream(), f.read(), end=True)
+        sender.flush()
+        elapsed = time.time() - start
+        for i, subflow in enumerate(sender.subflows):
+            print('Subflow {}: cwnd {:.0f} srtt {}'.format(i, subflow.cc.cwnd, subflow.cc.srtt))
+        print('Sent in {:.3f} s'.format(elapsed))
+        sender.close()
+    else:
+        receiver = MultipathReceiver(subflows=count)
+        receiver.run()
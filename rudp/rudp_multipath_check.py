@@ -0,0 +1,82 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+
+from rudp_multipath import MultipathSender, MultipathReceiver
+
+SERVER_PORT = 56700
+CLIENT_PORT = 57700
+
+
+class DelayedPathSender(MultipathSender):
+    """
+    A multipath sender whose subflows have different one-way delays, so segments striped over them
+    arrive out of order although none is lost.
+    """
+
+    def __init__(self, delays, **kwargs):
+        """
+        :param delays: the delay in seconds added to every packet of each subflow
+        """
+        super().__init__(subflows=len(delays), **kwargs)
+        self.delays = delays
+
+    def path_send(self, path, packet):
+        if self.delays[path]:
+            threading.Timer(self.delays[path], self.delayed_send, (path, packet)).start()
+        else:
+            super().path_send(path, packet)
+
+    def delayed_send(self, path, packet):
+        try:
+            super().path_send(path, packet)
+        except OSError:
+            # The connection was closed while the packet was delayed
+            pass
+
+
+def run_receiver(subflows, results):
+    with contextlib.redirect_stdout(io.StringIO()):
+        streams = MultipathReceiver(port=CLIENT_PORT, server_port=SERVER_PORT, subflows=subflows).run()
+    results.put({stream_id: hashlib.sha256(data).hexdigest() for stream_id, data in streams.items()})
+
+
+def transfer(payloads, delays):
+    """
+    Sends every payload on its own stream over subflows with the given delays, without loss.
+    :return: the number of retransmissions and the congestion window of every subflow
+    """
+    results = multiprocessing.Queue()
+    receiver = multiprocessing.Process(target=run_receiver, args=(len(delays), results))
+    with contextlib.redirect_stdout(io.StringIO()):
+        sender = DelayedPathSender(delays, server_port=SERVER_PORT)
+        receiver.start()
+        sender.accept()
+        for payload in payloads:
+            sender.write(sender.open_stream(), payload, end=True)
+        sender.flush()
+        sender.close()
+    digests = results.get()
+    receiver.join()
+    if sorted(digests.values()) != sorted(hashlib.sha256(payload).hexdigest() for payload in payloads):
+        raise RuntimeError('the received data does not match')
+    return sender.retransmissions, [subflow.cc.cwnd for subflow in sender.subflows]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks that reordering between subflows with different '
+                                                 'delays causes no retransmissions on a lossless path.')
+    parser.add_argument('--delays', type=float, nargs='+', default=[0.0, 0.005, 0.02],
+                        help='the one-way delay of every subflow in seconds')
+    parser.add_argument('--streams', type=int, default=200, help='streams of 50 kB to send')
+    args = parser.parse_args()
+
+    retransmissions, windows = transfer([os.urandom(50000) for _ in range(args.streams)], args.delays)
+    print('{} retransmissions, subflow windows {}'.format(retransmissions, ', '.join('{:.0f}'.format(w)
+                                                                                      for w in windows)))
+    if retransmissions:
+        raise RuntimeError('{} spurious retransmissions without loss'.format(retransmissions))
@@ -0,0 +1,41 @@
+import json
+import os
+
+# Tuned transport parameters per destination, written by rudp_tune.py
+PROFILES_PATH = os.path.join(os.path.expanduser('~'), '.rudp_profiles.json')
+
+
+def load_profiles(path=PROFILES_PATH):
+    """
+    :param path: the profile file
+    :return: a dictionary of destination address to profile, empty if there is no file
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_profile(destination, path=PROFILES_PATH):
+    """
+    :param destination: the IP address of the peer
+    :param path: the profile file
+    :return: the profile of the destination (mss, initial_window, initial_rto, buffer_size), or None
+    """
+    return load_profiles(path).get(destination)
+
+
+def save_profile(destination, profile, path=PROFILES_PATH):
+    """
+    Stores the profile of a destination, keeping the profiles of the others.
+    :param destination: the IP address of the peer
+    :param profile: the profile
+    :param path: the profile file
+    """
+    profiles = load_profiles(path)
+    profiles[destination] = profile
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(temp_path, path)
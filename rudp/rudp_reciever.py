@@ -1,6 +1,8 @@
 import socket
 import struct
-import random
+
+from rudp_serial import random_isn, seq_add
+from rudp_sockets import bdp_buffer_size, set_buffers
 
 
 class TCPOverUDPReceiver:
@@ -22,8 +24,10 @@ class TCPOverUDPReceiver:
         self.server_port = server_port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind((self.address, self.port))
+        # Room for a full window of datagrams, the default buffer overruns with 60 KB segments
+        set_buffers(self.socket, bdp_buffer_size(window_size, MSS))
         self.buffer = {}
-        self.seq_num = random.randint(0, 2 ** 32 - 1)
+        self.seq_num = random_isn()
 
     def run(self):
         """
@@ -43,7 +47,7 @@ class TCPOverUDPReceiver:
             print(syn_ack_packet_dict)
             if syn_ack_packet_dict.get('syn') and syn_ack_packet_dict.get('ack'):
                 print('Received SYN-ACK packet')
-                self.expected_seq_num = syn_ack_packet_dict['seq_num'] + 1
+                self.expected_seq_num = seq_add(syn_ack_packet_dict['seq_num'], 1)
                 break
 
         # Send ACK packet
@@ -58,13 +62,13 @@ class TCPOverUDPReceiver:
                 print('Received packet with seq_num = {}'.format(self.expected_seq_num))
                 data = packet_dict['data']
                 self.buffer[self.expected_seq_num] = data
-                self.expected_seq_num += 1  # Change this line
+                self.expected_seq_num = seq_add(self.expected_seq_num, 1)  # Change this line
 
                 # Send cumulative ACK packet
                 while self.expected_seq_num in self.buffer:
                     print('Sending ACK packet with ack_num = {}'.format(self.expected_seq_num))
                     data = self.buffer.pop(self.expected_seq_num)
-                    self.expected_seq_num += 1  # Change this line
+                    self.expected_seq_num = seq_add(self.expected_seq_num, 1)  # Change this line
                 ack_packet = self.create_packet(ack=True, ack_num=self.expected_seq_num)
                 self.socket.sendto(ack_packet, address)
 
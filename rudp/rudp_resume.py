@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import sys
+
+from rudp_streams import StreamSender, StreamReceiver, encode_options, decode_options
+
+# The sidecar is rewritten after this many new bytes have been stored
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+# How much of the file the sender keeps queued ahead of the window
+READ_AHEAD = 4 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+
+
+def prefix_hash(f, length):
+    """
+    :param f: a file opened in binary mode
+    :param length: the length of the prefix
+    :return: the SHA-256 hex digest of the first length bytes of the file
+    """
+    digest = hashlib.sha256()
+    f.seek(0)
+    remaining = length
+    while remaining > 0:
+        chunk = f.read(min(HASH_CHUNK, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+class FileSink:
+    """
+    Writes a received stream into a file at the offsets it arrives with and checkpoints which byte ranges are
+    stored on disk.
+
+    The data goes to <path>.part and the ranges to the sidecar <path>.ranges; once every byte has arrived the
+    part file is renamed to path and the sidecar removed. The sidecar is only written after the data it
+    describes has been synced, so it never claims more than the disk holds.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the final path of the file
+        """
+        self.path = path
+        self.part_path = path + '.part'
+        self.ranges_path = path + '.ranges'
+        self.ranges = []
+        self.size = None
+        if os.path.exists(self.part_path) and os.path.exists(self.ranges_path):
+            with open(self.ranges_path) as f:
+                checkpoint = json.load(f)
+            self.ranges = checkpoint['ranges']
+            self.size = checkpoint['size']
+            self.file = open(self.part_path, 'r+b')
+        else:
+            self.file = open(self.part_path, 'w+b')
+        self.unsaved = 0
+
+    def prefix(self):
+        """
+        :return: the length of the stored prefix, i.e. the first missing byte
+        """
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1]
+        return 0
+
+    def prefix_hash(self):
+        """
+        :return: the SHA-256 hex digest of the stored prefix
+        """
+        return prefix_hash(self.file, self.prefix())
+
+    def reset(self):
+        """
+        Forgets everything stored so far.
+        """
+        self.file.truncate(0)
+        self.ranges = []
+        self.size = None
+        self.checkpoint()
+
+    def write(self, offset, data):
+        """
+        Stores a segment.
+        :param offset: the offset of the segment in the file
+        :param data: the segment data
+        """
+        if data:
+            self.file.seek(offset)
+            self.file.write(data)
+            self.add_range(offset, offset + len(data))
+            self.unsaved += len(data)
+        if self.unsaved >= CHECKPOINT_BYTES:
+            self.checkpoint()
+
+    def add_range(self, start, end):
+        """
+        Adds [start, end) to the stored ranges, merging neighbours.
+        """
+        merged = []
+        for range_start, range_end in self.ranges:
+            if range_end < start or range_start > end:
+                merged.append([range_start, range_end])
+            else:
+                start = min(start, range_start)
+                end = max(end, range_end)
+        merged.append([start, end])
+        self.ranges = sorted(merged)
+
+    def checkpoint(self):
+        """
+        Syncs the data and atomically rewrites the sidecar.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        temp_path = self.ranges_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'size': self.size, 'ranges': self.ranges}, f)
+        os.replace(temp_path, self.ranges_path)
+        self.unsaved = 0
+
+    def complete(self):
+        """
+        :return: True once every byte of the file has been stored
+        """
+        return self.size is not None and self.prefix() >= self.size
+
+    def finish(self):
+        """
+        Moves the complete file into place and removes the sidecar.
+        """
+        self.file.close()
+        os.replace(self.part_path, self.path)
+        if os.path.exists(self.ranges_path):
+            os.remove(self.ranges_path)
+
+    def close(self):
+        """
+        Checkpoints and closes an incomplete file so a later connection can resume it.
+        """
+        if not self.file.closed:
+            self.checkpoint()
+            self.file.close()
+
+
+class ResumableSender(StreamSender):
+    """
+    A stream sender that sends one file, reading it as the window advances instead of loading it into
+    memory, and resumes an interrupted transfer.
+
+    The receiver offers resume=<prefix length>:<sha256 of the prefix> in its SYN. If the hash matches the
+    same prefix of the local file the transfer starts at the first missing byte, otherwise at zero; the
+    SYN-ACK carries the chosen offset and the file size.
+    """
+
+    def __init__(self, path, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, **kwargs):
+        """
+        :param path: the file to send
+        :param server_address: the IP address of the server
+        :param server_port: the port the sender listens on
+        :param window_size: the largest number of segments in flight
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, **kwargs)
+        self.source = open(path, 'rb')
+        self.size = os.fstat(self.source.fileno()).st_size
+        self.position = 0
+        self.stream_id = None
+
+    def negotiate(self, offer):
+        reply = decode_options(super().negotiate(offer))
+        start = 0
+        resume = decode_options(offer).get('resume')
+        if resume:
+            length, _, digest = resume.partition(':')
+            length = int(length)
+            if 0 < length <= self.size and prefix_hash(self.source, length) == digest:
+                start = length
+        print('Sending from byte {} of {}'.format(start, self.size))
+        self.stream_id = self.open_stream()
+        self.streams[self.stream_id].offset = start
+        self.position = start
+        self.source.seek(start)
+        reply['resume'] = start
+        reply['size'] = self.size
+        return encode_options(reply)
+
+    def step(self):
+        """
+        One round of the send loop, reading more of the file first if the queue runs low.
+        """
+        self.read_ahead()
+        super().step()
+
+    def read_ahead(self):
+        """
+        Queues the next part of the file while less than READ_AHEAD bytes are waiting to be sent.
+        """
+        stream = self.streams.get(self.stream_id)
+        if stream is None or stream.ended:
+            return
+        queued = sum(len(chunk) for _, chunk, _ in stream.pending)
+        while queued < READ_AHEAD and not stream.ended:
+            chunk = self.source.read(min(READ_AHEAD, self.size - self.position))
+            self.position += len(chunk)
+            stream.write(chunk, self.mss, end=self.position >= self.size or not chunk)
+            queued += len(chunk)
+
+    def has_pending(self):
+        stream = self.streams.get(self.stream_id)
+        return (stream is not None and not stream.ended) or super().has_pending()
+
+    def close(self):
+        """
+        Closes the connection and the file.
+        """
+        super().close()
+        self.source.close()
+
+
+class ResumableReceiver(StreamReceiver):
+    """
+    The receiving side of ResumableSender. It stores the file through a FileSink and offers the stored
+    prefix for resumption.
+    """
+
+    def __init__(self, path, address='127.0.0.1', port=55552, server_port=55555, window_size=10, **kwargs):
+        """
+        :param path: where to store the file
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        """
+        super().__init__(address, port, server_port, window_size, **kwargs)
+        self.sink = FileSink(path)
+
+    def handshake_offer(self):
+        options = decode_options(super().handshake_offer())
+        if self.sink.prefix():
+            options['resume'] = '{}:{}'.format(self.sink.prefix(), self.sink.prefix_hash())
+        return encode_options(options)
+
+    def handshake_accepted(self, options):
+        super().handshake_accepted(options)
+        options = decode_options(options)
+        if int(options.get('resume', 0)) == 0 and self.sink.ranges:
+            self.sink.reset()
+        self.sink.size = int(options['size']) if 'size' in options else None
+        print('Receiving from byte {}'.format(options.get('resume', 0)))
+
+    def deliver(self, stream_id, offset, payload, end):
+        """
+        Stores a segment in the file and finishes the file once it is complete.
+        """
+        self.sink.write(offset, payload)
+        if self.sink.complete() and not self.sink.file.closed:
+            self.sink.finish()
+            self.keep(stream_id, self.sink.path)
+            print('Stream {} complete ({} bytes)'.format(stream_id, self.sink.size))
+
+    def receive(self):
+        try:
+            return super().receive()
+        finally:
+            self.sink.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'send':
+        sender = ResumableSender(sys.argv[2])
+        sender.accept()
+        sender.flush()
+        sender.close()
+    else:
+        receiver = ResumableReceiver(sys.argv[1] if len(sys.argv) > 1 else 'received.bin')
+        receiver.run()
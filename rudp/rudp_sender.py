@@ -1,9 +1,11 @@
 import socket
 import struct
-import random
 import time
 import os
 
+from rudp_serial import random_isn, seq_add, seq_le
+from rudp_sockets import bdp_buffer_size, set_buffers, DEFAULT_WINDOW
+
 
 class TCPOverUDPSender:
     def __init__(self, server_address='127.0.0.1', server_port=55555, mss=60000, timeout=0.5,
@@ -29,10 +31,12 @@ class TCPOverUDPSender:
         self.server_port = server_port
         self.mss = mss
         self.timeout = timeout
-        self.seq_num = random.randint(0, 2 ** 32 - 1)
+        self.seq_num = random_isn()
         self.unacked_packets = []
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind(('localhost', server_port))
+        # Room for a full window of datagrams, the default buffer overruns with 60 KB segments
+        set_buffers(self.socket, bdp_buffer_size(DEFAULT_WINDOW, mss))
         self.congestion_control = congestion_control
         self.slow_start_threshold = mss // 2
         self.cwnd = mss
@@ -54,12 +58,12 @@ class TCPOverUDPSender:
 
             if syn_packet_dict.get('syn'):
                 print('Received SYN packet')
-                self.seq_num = random.randint(0, 2 ** 32 - 1)
+                self.seq_num = random_isn()
                 break
 
         # Send SYN-ACK packet
         print('Sending SYN-ACK packet')
-        syn_ack_packet = self.create_packet(syn=True, ack=True, ack_num=syn_packet_dict['seq_num'] + 1)
+        syn_ack_packet = self.create_packet(syn=True, ack=True, ack_num=seq_add(syn_packet_dict['seq_num'], 1))
         print(len(syn_ack_packet))
         self.socket.sendto(syn_ack_packet, self.client_address)
 
@@ -167,7 +171,7 @@ class TCPOverUDPSender:
                 sent_packets.append((self.seq_num, time.time()))
 
                 # Update the sequence number and the list of unacknowledged packets
-                self.seq_num += len(chunk)
+                self.seq_num = seq_add(self.seq_num, len(chunk))
                 self.unacked_packets.append(packet)
 
                 # Update the available space in the buffer
@@ -201,7 +205,7 @@ class TCPOverUDPSender:
                             break
 
                         packet = self.unacked_packets[i]
-                        if struct.unpack('!I', packet[:4])[0] >= ack_num - 1:
+                        if seq_le(seq_add(ack_num, -1), struct.unpack('!I', packet[:4])[0]):
                             # Remove the acknowledged packet from the list of unacknowledged packets
                             self.unacked_packets.pop(i)
                             # Update congestion control parameters
@@ -281,7 +285,7 @@ class TCPOverUDPSender:
                 fin_ack_packet_dict = self.parse_packet(fin_ack_packet)
 
                 if fin_ack_packet_dict.get('fin') and fin_ack_packet_dict.get('ack'):
-                    ack_packet = self.create_packet(ack=True, ack_num=fin_ack_packet_dict['seq_num'] + 1)
+                    ack_packet = self.create_packet(ack=True, ack_num=seq_add(fin_ack_packet_dict['seq_num'], 1))
                     print('Sending ACK packet')
                     self.socket.sendto(ack_packet, self.client_address)
                     break
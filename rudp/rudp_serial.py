@@ -0,0 +1,46 @@
+import random
+
+# Sequence numbers are 32 bits on the wire and wrap around; they are compared with serial number
+# arithmetic (RFC 1982), which holds as long as less than half the space is in flight
+SEQ_BITS = 32
+SEQ_SPACE = 2 ** SEQ_BITS
+SEQ_HALF = SEQ_SPACE // 2
+
+
+def random_isn():
+    """
+    :return: a random initial sequence number
+    """
+    return random.randint(0, SEQ_SPACE - 1)
+
+
+def seq_add(seq, n):
+    """
+    :param seq: a sequence number
+    :param n: the amount of sequence space to advance by
+    :return: the sequence number n after seq, wrapped into the sequence space
+    """
+    return (seq + n) % SEQ_SPACE
+
+
+def seq_diff(a, b):
+    """
+    :param a: a sequence number
+    :param b: a sequence number
+    :return: the signed distance from b to a, in [-SEQ_HALF, SEQ_HALF)
+    """
+    return (a - b + SEQ_HALF) % SEQ_SPACE - SEQ_HALF
+
+
+def seq_lt(a, b):
+    """
+    :return: True if sequence number a comes before b
+    """
+    return seq_diff(a, b) < 0
+
+
+def seq_le(a, b):
+    """
+    :return: True if sequence number a comes before b or is b
+    """
+    return seq_diff(a, b) <= 0
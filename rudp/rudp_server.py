@@ -0,0 +1,263 @@
+import functools
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+from rudp_serial import seq_add
+from rudp_sockets import bdp_buffer_size, set_buffers
+from rudp_streams import StreamSender, HEADER, HEADER_SIZE, STREAM, BUFFER_SIZE, FIN_RETRIES, MSS
+
+# Seconds without a packet from the peer after which a connection is dropped
+IDLE_TIMEOUT = 30.0
+
+
+class ServerConnection(StreamSender):
+    """
+    One receiver connection of an RUDPServer worker. It shares the worker's socket, so the worker reads
+    the packets and drives the send loop instead of accept()/flush().
+    """
+
+    def __init__(self, sock, client_address, window_size=10, timeout=0.5, congestion_control=True):
+        """
+        :param sock: the worker's socket
+        :param client_address: the address of the receiver
+        :param window_size: the largest number of segments in flight
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        """
+        super().__init__(window_size=window_size, timeout=timeout, congestion_control=congestion_control,
+                         sock=sock)
+        self.client_address = client_address
+        self.established = False
+        self.fin_sent = None
+        self.fin_retries = 0
+        self.last_heard = time.time()
+
+    def path_send(self, path, packet):
+        send(self.socket, packet, self.client_address)
+
+    def finished(self):
+        """
+        :return: True once everything queued on the connection has been acknowledged
+        """
+        return self.established and not self.has_pending() and not self.in_flight
+
+
+def send(sock, packet, address):
+    """
+    Sends a packet on a worker's non-blocking socket. A packet that does not fit in the send buffer, or
+    that the network refuses, is dropped: the peer or a retransmission timer recovers it, and one peer's
+    error must not stop the worker serving the others.
+    :param sock: the worker's socket
+    :param packet: the raw packet
+    :param address: the address of the peer
+    """
+    try:
+        sock.sendto(packet, address)
+    except BlockingIOError:
+        pass
+    except OSError as e:
+        print('Sending to {} failed: {}'.format(address, e))
+
+
+class RUDPServer:
+    """
+    A TCP-over-UDP server that serves many receivers at once.
+
+    The server starts `workers` processes that all bind the same port with SO_REUSEPORT. The kernel
+    hashes every peer address to one of the sockets, so each worker owns a disjoint set of connections
+    and runs its own send loop on its own core. Inside a worker, packets are dispatched to the
+    connection of their peer address.
+
+    Usage::
+
+        def handler(connection):
+            connection.write(connection.open_stream(), data, end=True)
+
+        RUDPServer(handler, workers=4).serve_forever()
+    """
+
+    def __init__(self, handler, address='localhost', port=55555, workers=None, window_size=10, timeout=0.5,
+                 congestion_control=True, idle_timeout=IDLE_TIMEOUT):
+        """
+        :param handler: called in the worker with the ServerConnection once it is established; it queues
+            the data to send on it
+        :param address: the address to listen on
+        :param port: the port shared by all workers
+        :param workers: the number of worker processes, one per core by default
+        :param window_size: the largest number of segments in flight per connection
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        :param idle_timeout: the seconds without a packet from a peer after which its connection is dropped
+        """
+        self.handler = handler
+        self.address = address
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.window_size = window_size
+        self.timeout = timeout
+        self.congestion_control = congestion_control
+        self.idle_timeout = idle_timeout
+        if self.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            print('SO_REUSEPORT is not available, running a single worker')
+            self.workers = 1
+
+    def serve_forever(self):
+        """
+        Starts the workers and waits for them.
+        """
+        if self.workers == 1:
+            self.worker(0)
+            return
+        processes = [multiprocessing.Process(target=self.worker, args=(i,), daemon=True)
+                     for i in range(self.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    def bind(self):
+        """
+        :return: a socket bound to the server port that shares it with the other workers
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.workers > 1:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.address, self.port))
+        # Room for at least one full window; every connection of the worker shares these buffers
+        set_buffers(sock, bdp_buffer_size(self.window_size, MSS))
+        sock.setblocking(False)
+        return sock
+
+    def worker(self, index):
+        """
+        The event loop of one worker process.
+        :param index: the number of the worker
+        """
+        sock = self.bind()
+        connections = {}
+        print('Worker {} (pid {}) listening on port {}'.format(index, os.getpid(), self.port))
+        while True:
+            readable, _, _ = select.select([sock], [], [], self.next_timeout(connections))
+            if readable:
+                try:
+                    while True:
+                        packet, address = sock.recvfrom(BUFFER_SIZE)
+                        self.handle_packet(sock, connections, packet, address)
+                except BlockingIOError:
+                    pass
+            for connection in list(connections.values()):
+                self.service(connection, connections)
+            self.expire_idle(connections)
+
+    def next_timeout(self, connections):
+        """
+        :param connections: the connections of the worker
+        :return: how long the worker may wait for packets before a timer of some connection expires
+        """
+        deadlines = []
+        for connection in connections.values():
+            if connection.in_flight:
+                deadlines.append(connection.next_deadline())
+            elif connection.fin_sent is not None:
+                deadlines.append(connection.fin_sent + connection.fin_timeout(connection.fin_retries - 1))
+        if not deadlines:
+            return 1.0
+        return min(max(min(deadlines) - time.time(), 0.001), 1.0)
+
+    def expire_idle(self, connections):
+        """
+        Drops the connections whose peer has been silent for idle_timeout, e.g. a receiver that went away
+        without closing or a SYN that was never followed by an ACK.
+        :param connections: the connections of the worker by peer address
+        """
+        now = time.time()
+        for address, connection in list(connections.items()):
+            if now - connection.last_heard > self.idle_timeout:
+                print('Connection from {} idle for {:.0f} s, dropped'.format(address, now - connection.last_heard))
+                del connections[address]
+
+    def handle_packet(self, sock, connections, packet, address):
+        """
+        Dispatches a packet to the connection of its sender, creating the connection on a SYN.
+        :param sock: the worker's socket
+        :param connections: the connections of the worker by peer address
+        :param packet: the raw packet
+        :param address: the address of the peer
+        """
+        if len(packet) < HEADER_SIZE:
+            return
+        seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+        connection = connections.get(address)
+        if connection is not None:
+            connection.last_heard = time.time()
+        if flags & 4:
+            if connection is None or connection.established:
+                connection = ServerConnection(sock, address, self.window_size, self.timeout,
+                                              self.congestion_control)
+                connections[address] = connection
+                print('New connection from {}'.format(address))
+            syn_ack = struct.pack(HEADER, connection.seq_num, seq_add(seq_num, 1), 4 | 2, self.window_size) + \
+                (connection.negotiate(packet[HEADER_SIZE:]) or b'')
+            send(sock, syn_ack, address)
+        elif connection is None:
+            return
+        elif flags & 1 and flags & 2:
+            ack_packet = struct.pack(HEADER, connection.seq_num, seq_add(seq_num, 1), 2, self.window_size)
+            send(sock, ack_packet, address)
+            del connections[address]
+            print('Connection from {} closed'.format(address))
+        elif flags & STREAM:
+            connection.handle_ack(packet)
+        elif flags & 2 and not connection.established:
+            connection.seq_num = ack_num
+            connection.established = True
+            self.handler(connection)
+
+    def service(self, connection, connections):
+        """
+        Sends what the connection's window allows, handles its timers and closes it when it is done.
+        :param connection: the connection
+        :param connections: the connections of the worker by peer address
+        """
+        if not connection.established:
+            return
+        connection.fill_window()
+        connection.check_timeouts()
+        if not connection.finished():
+            return
+        if connection.fin_sent is None or \
+                time.time() - connection.fin_sent > connection.fin_timeout(connection.fin_retries - 1):
+            if connection.fin_retries == FIN_RETRIES:
+                print('Connection from {} timed out while closing'.format(connection.client_address))
+                del connections[connection.client_address]
+                return
+            fin_packet = struct.pack(HEADER, connection.seq_num, 0, 1, self.window_size)
+            send(connection.socket, fin_packet, connection.client_address)
+            connection.fin_sent = time.time()
+            connection.fin_retries += 1
+
+
+def send_folder(folder, connection):
+    """
+    A handler that sends every picture of a quality folder, one stream per picture.
+    :param folder: the quality folder
+    :param connection: the new connection
+    """
+    for i in range(1, 21):
+        name = os.path.join(folder, '{}.png'.format(i))
+        if os.path.isfile(name):
+            with open(name, 'rb') as f:
+                connection.write(connection.open_stream(), f.read(), end=True)
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else '240P'
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    server = RUDPServer(functools.partial(send_folder, folder), workers=workers)
+    server.serve_forever()
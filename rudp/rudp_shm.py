@@ -0,0 +1,287 @@
+import ipaddress
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+from rudp_streams import StreamSender, StreamReceiver, HEADER, HEADER_SIZE, END_OF_STREAM, BUFFER_SIZE, \
+    encode_options, decode_options
+
+# Flag bit (next to JOIN=32) of the control packets of the shared memory transport
+SHM = 64
+# A position in the ring, counted in bytes since the start of the connection
+POSITION = '!Q'
+POSITION_SIZE = 8
+# length, stream id, stream flags, offset of one record in the ring (64 bits, like the stream header)
+RECORD_HEADER = '!IHHQ'
+RECORD_HEADER_SIZE = 16
+RING_SIZE = 16 * 1024 * 1024
+
+
+def is_local(host):
+    """
+    :param host: a host name or IP address
+    :return: True if the host is this machine's loopback interface
+    """
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def attach(name):
+    """
+    Attaches to a shared memory block created by another process without taking ownership of it.
+    :param name: the name of the block
+    :return: the SharedMemory object
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block, which would unlink it when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class Ring:
+    """
+    A single producer, single consumer byte ring inside a shared memory block.
+
+    The read and write positions are not stored in the block: they travel in the control packets, so
+    the sender only writes bytes the receiver has released and the receiver only reads bytes the
+    sender has announced.
+    """
+
+    def __init__(self, shm, size):
+        """
+        :param shm: the SharedMemory block
+        :param size: the usable size of the ring in bytes
+        """
+        self.shm = shm
+        self.size = size
+
+    def write(self, position, data):
+        """
+        Copies data into the ring, wrapping around its end.
+        :param position: the position to write at
+        :param data: the bytes to write
+        """
+        start = position % self.size
+        first = min(len(data), self.size - start)
+        self.shm.buf[start:start + first] = data[:first]
+        if first < len(data):
+            self.shm.buf[:len(data) - first] = data[first:]
+
+    def read(self, position, length):
+        """
+        Copies bytes out of the ring, wrapping around its end.
+        :param position: the position to read from
+        :param length: the number of bytes to read
+        :return: the bytes
+        """
+        start = position % self.size
+        first = min(length, self.size - start)
+        if first == length:
+            return bytes(self.shm.buf[start:start + length])
+        return bytes(self.shm.buf[start:start + first]) + bytes(self.shm.buf[:length - first])
+
+
+class SharedMemorySender(StreamSender):
+    """
+    A stream sender that moves the data through a shared memory ring when the receiver runs on the same
+    host. The receiver offers the transport in its SYN; the sender creates the ring and answers with its
+    name in the SYN-ACK. The UDP socket then only carries small control packets: the sender announces how
+    far it has written, the receiver answers how far it has read. If the receiver does not offer the
+    transport, or is not on this host, the connection falls back to sending the streams over UDP.
+    """
+
+    def __init__(self, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, ring_size=RING_SIZE, **kwargs):
+        """
+        :param server_address: the IP address of the server
+        :param server_port: the port the sender listens on
+        :param window_size: the largest number of segments in flight over UDP
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        :param ring_size: the size of the shared memory ring in bytes
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, **kwargs)
+        self.ring_size = ring_size
+        self.ring = None
+        self.head = 0
+        self.tail = 0
+
+    def negotiate(self, offer):
+        """
+        Creates the ring if the receiver offered the shared memory transport and runs on this host.
+        :param offer: the payload of the SYN packet
+        :return: the payload of the SYN-ACK packet
+        """
+        reply = decode_options(super().negotiate(offer))
+        if 'shm' in decode_options(offer) and shared_memory and is_local(self.client_address[0]):
+            shm = shared_memory.SharedMemory(create=True, size=self.ring_size)
+            self.ring = Ring(shm, self.ring_size)
+            # Records are not limited by the datagram size any more
+            self.mss = self.ring_size // 4
+            reply['shm'] = '{}:{}'.format(shm.name, self.ring_size)
+            print('Using shared memory {}'.format(shm.name))
+        return encode_options(reply)
+
+    def flush(self):
+        """
+        Sends all queued stream data and waits until the receiver has consumed it.
+        """
+        if self.ring is None:
+            super().flush()
+            return
+        while self.has_pending() or self.tail < self.head:
+            if self.fill_ring():
+                self.notify()
+            readable, _, _ = select.select([self.socket], [], [], self.timeout)
+            if not readable:
+                # The announcement or its answer was lost
+                self.notify()
+                continue
+            packet, address = self.socket.recvfrom(BUFFER_SIZE)
+            flags = struct.unpack(HEADER, packet[:HEADER_SIZE])[2]
+            if address == self.client_address and flags & SHM and flags & 2:
+                self.tail = max(self.tail, struct.unpack(POSITION, packet[HEADER_SIZE:HEADER_SIZE + POSITION_SIZE])[0])
+        for stream_id in [s for s, stream in self.streams.items() if stream.ended and not stream.pending]:
+            del self.streams[stream_id]
+
+    def fill_ring(self):
+        """
+        Copies queued segments into the ring while there is room.
+        :return: True if anything was written
+        """
+        wrote = False
+        while True:
+            stream = self.next_stream()
+            if stream is None:
+                return wrote
+            offset, chunk, end = stream.pending[0]
+            size = RECORD_HEADER_SIZE + len(chunk)
+            if self.ring_size - (self.head - self.tail) < size:
+                return wrote
+            stream.pending.popleft()
+            self.ring.write(self.head, struct.pack(RECORD_HEADER, len(chunk), stream.stream_id,
+                                                   END_OF_STREAM if end else 0, offset))
+            self.ring.write(self.head + RECORD_HEADER_SIZE, chunk)
+            self.head += size
+            self.segments_sent += 1
+            self.bytes_sent += len(chunk)
+            wrote = True
+
+    def notify(self):
+        """
+        Tells the receiver how far the ring has been written.
+        """
+        packet = struct.pack(HEADER, self.seq_num, 0, SHM, self.window_size) + struct.pack(POSITION, self.head)
+        self.socket.sendto(packet, self.client_address)
+
+    def close(self):
+        """
+        Closes the connection and removes the ring.
+        """
+        super().close()
+        if self.ring is not None:
+            self.ring.shm.close()
+            self.ring.shm.unlink()
+            self.ring = None
+
+
+class SharedMemoryReceiver(StreamReceiver):
+    """
+    The receiving side of SharedMemorySender. It offers the shared memory transport when the sender is on
+    this host and reads the streams out of the ring; otherwise it receives them over UDP.
+    """
+
+    def __init__(self, address='127.0.0.1', port=55552, server_port=55555, window_size=10, **kwargs):
+        """
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        """
+        super().__init__(address, port, server_port, window_size, **kwargs)
+        self.ring = None
+        self.tail = 0
+
+    def handshake_offer(self):
+        options = decode_options(super().handshake_offer())
+        if shared_memory and is_local(self.address):
+            options['shm'] = '1'
+        return encode_options(options)
+
+    def handshake_accepted(self, options):
+        super().handshake_accepted(options)
+        value = decode_options(options).get('shm')
+        if value:
+            name, size = value.rsplit(':', 1)
+            self.ring = Ring(attach(name), int(size))
+
+    def receive(self):
+        """
+        Reads announced records out of the ring until the connection is closed.
+        :return: a dictionary of stream id to the data of the stream
+        """
+        if self.ring is None:
+            return super().receive()
+        while True:
+            packet, address = self.socket.recvfrom(BUFFER_SIZE)
+            seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+            if flags & 1:
+                fin_ack_packet = self.create_packet(fin=True, ack=True, ack_num=self.expected_seq_num)
+                self.socket.sendto(fin_ack_packet, address)
+                break
+            if flags & SHM:
+                self.read_ring(struct.unpack(POSITION, packet[HEADER_SIZE:HEADER_SIZE + POSITION_SIZE])[0])
+                ack_packet = struct.pack(HEADER, self.seq_num, 0, SHM | 2, self.window_size) + \
+                    struct.pack(POSITION, self.tail)
+                self.socket.sendto(ack_packet, address)
+        self.ring.shm.close()
+        return self.completed
+
+    def read_ring(self, head):
+        """
+        Delivers every record between the read position and the announced write position.
+        :param head: the position the sender has written up to
+        """
+        while self.tail < head:
+            length, stream_id, stream_flags, offset = struct.unpack(
+                RECORD_HEADER, self.ring.read(self.tail, RECORD_HEADER_SIZE))
+            payload = self.ring.read(self.tail + RECORD_HEADER_SIZE, length)
+            self.deliver(stream_id, offset, payload, bool(stream_flags & END_OF_STREAM))
+            self.tail += RECORD_HEADER_SIZE + length
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'send':
+        # Send every picture of one quality folder, one stream per picture
+        folder = sys.argv[2] if len(sys.argv) > 2 else '240P'
+        sender = SharedMemorySender()
+        sender.accept()
+        start = time.time()
+        size = 0
+        for i in range(1, 21):
+            name = os.path.join(folder, '{}.png'.format(i))
+            if os.path.isfile(name):
+                with open(name, 'rb') as f:
+                    data = f.read()
+                sender.write(sender.open_stream(), data, end=True)
+                size += len(data)
+        sender.flush()
+        elapsed = time.time() - start
+        print('Sent {} bytes in {:.3f} s ({:.1f} MB/s)'.format(size, elapsed, size / elapsed / 1e6))
+        sender.close()
+    else:
+        receiver = SharedMemoryReceiver()
+        receiver.run()
@@ -0,0 +1,64 @@
+import os
+import socket
+
+# Room on top of one window for retransmissions, acknowledgements and the kernel's per-datagram overhead
+BUFFER_HEADROOM = 2
+# Segments in flight assumed for the endpoints that have no window of their own (rudp_sender.py)
+DEFAULT_WINDOW = 10
+UDP_TABLES = ('/proc/net/udp', '/proc/net/udp6')
+
+
+def bdp_buffer_size(window_size, mss):
+    """
+    Sizes the socket buffers of a connection from its window. The sender never has more than one window
+    in flight, so window_size * mss bounds the bandwidth-delay product on any path; the size does not
+    depend on a measured rate or RTT.
+    :param window_size: the largest number of segments in flight
+    :param mss: the largest segment payload
+    :return: the buffer size in bytes
+    """
+    return BUFFER_HEADROOM * window_size * mss
+
+
+def set_buffers(sock, size):
+    """
+    Sets the send and receive buffers of a socket. The kernel caps the sizes at net.core.wmem_max and
+    net.core.rmem_max, so the effective sizes may be smaller than asked for.
+    :param sock: the socket
+    :param size: the buffer size in bytes
+    :return: the effective (send, receive) buffer sizes as reported by the kernel
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    sizes = (sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+             sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+    # Linux reports twice the size that was set, so anything below size means the size was capped
+    if min(sizes) < size:
+        print('Socket buffers capped at {} bytes (asked for {}), raise net.core.rmem_max/wmem_max'.format(
+            min(sizes), size))
+    return sizes
+
+
+def kernel_drops(sock):
+    """
+    Reads how many datagrams the kernel dropped for a socket, mostly because its receive buffer was
+    full when they arrived. These losses happen on the local host, not in the network.
+    :param sock: the socket
+    :return: the drop counter of the socket, or None if it is not available (not Linux)
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except OSError:
+        return None
+    for table in UDP_TABLES:
+        try:
+            with open(table) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            # sl local rem st tx:rx tr:when retrnsmt uid timeout inode ref pointer drops
+            if len(fields) > 12 and fields[9] == inode:
+                return int(fields[12])
+    return None
@@ -0,0 +1,699 @@
+import os
+import socket
+import struct
+import sys
+import time
+from collections import OrderedDict, deque
+
+from Reliable_UDP_Receiver import TCPOverUDPReceiver
+from Reliable_UDP_Sender import TCPOverUDPSender, MSS
+from rudp_congestion import RenoCongestionControl, LedbatCongestionControl, MAX_RTO
+from rudp_profiles import load_profile
+from rudp_serial import seq_add, seq_lt
+from rudp_sockets import kernel_drops, set_buffers
+
+# Flag bit (next to SYN=4, ACK=2, FIN=1) marking a packet of the stream framing
+STREAM = 8
+# Stream flag marking the last segment of a stream
+END_OF_STREAM = 1
+
+HEADER = '!IIHH'
+HEADER_SIZE = 12
+# stream id, stream flags, offset of the segment inside the stream; the offset is 64 bits so a stream
+# can carry more than 4 GiB
+STREAM_HEADER = '!HHQ'
+STREAM_HEADER_SIZE = 12
+# Stream ids are 16 bits, ids of closed streams are used again after the last one
+MAX_STREAM_ID = 0xFFFF
+# Payload of a stream acknowledgement: the sequence number of the packet that triggered it and the time
+# the receiver got that packet, from which the sender computes one-way delays
+ACK_PAYLOAD = '!Id'
+ACK_PAYLOAD_SIZE = 12
+BUFFER_SIZE = 65536
+DUP_ACK_THRESHOLD = 3
+# Floor of the tail loss probe timeout, about two round trips otherwise
+MIN_PROBE_TIMEOUT = 0.01
+FIN_RETRIES = 5
+
+
+def encode_options(options):
+    """
+    Encodes handshake options as 'key=value;key=value'.
+    :param options: a dictionary of option names to string values
+    :return: the encoded options, or None if there are none
+    """
+    if not options:
+        return None
+    return ';'.join('{}={}'.format(key, value) for key, value in options.items()).encode()
+
+
+def decode_options(payload):
+    """
+    Decodes handshake options written by encode_options.
+    :param payload: the payload of a SYN or SYN-ACK packet (may be None or empty)
+    :return: a dictionary of option names to string values
+    """
+    options = {}
+    for item in (payload or b'').decode(errors='ignore').split(';'):
+        key, _, value = item.partition('=')
+        if key:
+            options[key] = value
+    return options
+
+
+def next_stream_id(last, in_use):
+    """
+    Picks the id of a new stream: the one after the last id handed out, wrapping from MAX_STREAM_ID back
+    to 1 and skipping the ids of streams that are still open.
+    :param last: the last id handed out, 0 if none was
+    :param in_use: the ids of the open streams
+    :return: the new id
+    """
+    for i in range(1, MAX_STREAM_ID + 1):
+        stream_id = (last + i - 1) % MAX_STREAM_ID + 1
+        if stream_id not in in_use:
+            return stream_id
+    raise RuntimeError('all {} stream ids are in use'.format(MAX_STREAM_ID))
+
+
+def seq_length(payload):
+    """
+    The amount of sequence space a stream segment consumes. Empty segments (a bare end of stream)
+    still take one number so that every packet has its own sequence number.
+    :param payload: the segment data
+    :return: the sequence space used by the segment
+    """
+    return max(len(payload), 1)
+
+
+class Stream:
+    """
+    One ordered byte stream inside a StreamSender connection.
+
+    Attributes
+    ----------
+    stream_id : int
+        The id of the stream on the wire.
+    priority : int
+        The scheduling priority, lower values are sent first.
+    offset : int
+        The offset of the next byte written to the stream.
+    pending : deque
+        Segments (offset, data, end) waiting to be sent.
+    ended : bool
+        Whether the end of the stream has been written.
+    """
+
+    def __init__(self, stream_id, priority=0):
+        self.stream_id = stream_id
+        self.priority = priority
+        self.offset = 0
+        self.pending = deque()
+        self.ended = False
+
+    def write(self, data, mss, end=False):
+        """
+        Splits the data into segments of at most mss bytes and queues them.
+        :param data: the data to append to the stream
+        :param mss: the largest segment payload
+        :param end: whether this is the last data of the stream
+        """
+        if self.ended:
+            raise ValueError('stream {} is already closed'.format(self.stream_id))
+        view = memoryview(data)
+        for i in range(0, len(view), mss):
+            chunk = view[i:i + mss]
+            self.pending.append((self.offset, chunk, False))
+            self.offset += len(chunk)
+        if end:
+            if self.pending:
+                offset, chunk, _ = self.pending.pop()
+                self.pending.append((offset, chunk, True))
+            else:
+                self.pending.append((self.offset, b'', True))
+            self.ended = True
+
+
+class StreamSender(TCPOverUDPSender):
+    """
+    A TCP-over-UDP sender that multiplexes many independent streams over one connection.
+
+    Every stream is ordered on its own, so a lost segment only delays the stream it belongs to.
+    All streams share one congestion controller; the scheduler always serves the pending stream
+    with the lowest priority value and rotates between streams of the same priority.
+
+    Usage::
+
+        sender = StreamSender()
+        sender.accept()
+        for name in names:
+            stream_id = sender.open_stream()
+            sender.write(stream_id, data, end=True)
+        sender.flush()
+        sender.close()
+    """
+
+    def __init__(self, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, mss=MSS, sock=None, scavenger=False):
+        """
+        :param server_address: the IP address of the server
+        :param server_port: the port the sender listens on
+        :param window_size: the largest number of segments in flight
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        :param mss: the largest stream payload per packet
+        :param sock: an already bound socket to use instead of binding a new one
+        :param scavenger: use delay-based LEDBAT congestion control, which yields to other traffic, instead
+            of loss-based Reno
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, sock)
+        # A socket handed in, like an RUDPServer worker's, is shared with other connections
+        self.owns_socket = sock is None
+        self.mss = mss
+        self.streams = {}
+        self.last_stream_id = 0
+        self.in_flight = OrderedDict()
+        controller = LedbatCongestionControl if scavenger else RenoCongestionControl
+        self.cc = controller(mss, max_window=window_size, initial_rto=timeout, enabled=congestion_control)
+        self.last_cumulative_ack = None
+        self.dup_acks = 0
+        self.rotation = 0
+        self.start_time = time.time()
+        self.segments_sent = 0
+        self.bytes_sent = 0
+        self.retransmissions = 0
+        self.tail_probes = 0
+        self.probe_sent = False
+        self.last_progress = time.time()
+
+    def stats(self):
+        """
+        :return: a dictionary with the transfer statistics of the connection
+        """
+        return {
+            'elapsed': time.time() - self.start_time,
+            'segments_sent': self.segments_sent,
+            'bytes_sent': self.bytes_sent,
+            'retransmissions': self.retransmissions,
+            'tail_probes': self.tail_probes,
+            'srtt': self.cc.srtt,
+            'cwnd': self.cc.cwnd,
+            'kernel_drops': kernel_drops(self.socket),
+        }
+
+    def negotiate(self, offer):
+        """
+        Loads the tuned profile of the receiver, if there is one, and asks the receiver to size its
+        receive buffer accordingly.
+        :param offer: the payload of the SYN packet
+        :return: the payload of the SYN-ACK packet
+        """
+        reply = decode_options(super().negotiate(offer))
+        profile = load_profile(self.client_address[0])
+        if profile:
+            print('Using the tuned profile for {}'.format(self.client_address[0]))
+            self.apply_profile(profile)
+            if profile.get('buffer_size'):
+                reply['rcvbuf'] = profile['buffer_size']
+        return encode_options(reply)
+
+    def apply_profile(self, profile):
+        """
+        Uses tuned transport parameters for the connection. The socket buffers are only resized on a
+        socket the connection owns, a shared socket keeps its size for the other connections on it.
+        :param profile: a dictionary with any of mss, initial_window, initial_rto and buffer_size
+        """
+        self.mss = profile.get('mss', self.mss)
+        self.cc.reconfigure(self.mss, profile.get('initial_window', 1), profile.get('initial_rto', self.timeout))
+        if profile.get('buffer_size') and self.owns_socket:
+            set_buffers(self.socket, profile['buffer_size'])
+
+    def open_stream(self, priority=0):
+        """
+        Opens a new stream on the connection.
+        :param priority: the scheduling priority, lower values are sent first
+        :return: the id of the new stream
+        """
+        stream_id = next_stream_id(self.last_stream_id, self.streams)
+        self.last_stream_id = stream_id
+        self.streams[stream_id] = Stream(stream_id, priority)
+        return stream_id
+
+    def write(self, stream_id, data, end=False):
+        """
+        Queues data on a stream. Nothing is sent until flush() is called.
+        :param stream_id: the stream to write to
+        :param data: the data to send
+        :param end: whether this is the last data of the stream
+        """
+        self.streams[stream_id].write(data, self.mss, end)
+
+    def send(self, data):
+        """
+        Sends the given data as a single stream and closes the connection.
+        :param data: the data to send
+        """
+        stream_id = self.open_stream()
+        self.write(stream_id, data, end=True)
+        self.flush()
+        self.close()
+
+    def flush(self):
+        """
+        Sends all queued stream data and waits until every segment is acknowledged.
+        """
+        while self.has_pending() or self.in_flight:
+            self.step()
+        self.socket.settimeout(self.timeout)
+        for stream_id in [s for s, stream in self.streams.items() if stream.ended and not stream.pending]:
+            del self.streams[stream_id]
+
+    def step(self):
+        """
+        One round of the send loop: fill the window, wait for acknowledgements, retransmit.
+        """
+        self.fill_window()
+        self.receive_acks()
+        self.check_timeouts()
+
+    def has_pending(self):
+        """
+        :return: True if any stream still has segments waiting to be sent
+        """
+        return any(stream.pending for stream in self.streams.values())
+
+    def next_stream(self):
+        """
+        Picks the stream to send from: the lowest priority value wins, streams with equal priority
+        take turns.
+        :return: the chosen Stream, or None if nothing is pending
+        """
+        ready = [stream for stream in self.streams.values() if stream.pending]
+        if not ready:
+            return None
+        best = min(stream.priority for stream in ready)
+        ready = [stream for stream in ready if stream.priority == best]
+        self.rotation += 1
+        return ready[self.rotation % len(ready)]
+
+    def fill_window(self):
+        """
+        Sends queued segments while the congestion window has room.
+        """
+        while True:
+            stream = self.next_stream()
+            if stream is None or self.choose_path(len(stream.pending[0][1])) is None:
+                return
+            offset, chunk, end = stream.pending.popleft()
+            self.send_segment(stream.stream_id, offset, chunk, end)
+
+    def choose_path(self, size):
+        """
+        Picks the path to send a segment on. A plain connection has the single path 0.
+        :param size: the payload size of the segment
+        :return: the path, or None if no path has room in its window
+        """
+        return 0 if self.cc.can_send(size) else None
+
+    def path_cc(self, path):
+        """
+        :param path: a path returned by choose_path
+        :return: the congestion controller of the path
+        """
+        return self.cc
+
+    def path_send(self, path, packet):
+        """
+        Sends a packet on a path.
+        :param path: a path returned by choose_path
+        :param packet: the raw packet
+        """
+        self.socket.sendto(packet, self.client_address)
+
+    def send_segment(self, stream_id, offset, chunk, end, flags=0):
+        """
+        Sends one stream segment and tracks it until it is acknowledged.
+        :param stream_id: the stream the segment belongs to
+        :param offset: the offset of the segment in the stream
+        :param chunk: the segment data
+        :param end: whether this is the last segment of the stream
+        :param flags: extra flags for the packet header
+        """
+        seq = self.seq_num
+        path = self.choose_path(len(chunk)) or 0
+        packet = struct.pack(HEADER, seq, 0, STREAM | flags, self.window_size) + \
+            struct.pack(STREAM_HEADER, stream_id, END_OF_STREAM if end else 0, offset) + chunk
+        self.path_send(path, packet)
+        # packet, send time, payload size, retransmitted, path
+        self.in_flight[seq] = [packet, time.time(), len(chunk), False, path]
+        self.seq_num = seq_add(self.seq_num, seq_length(chunk))
+        self.path_cc(path).on_send(len(chunk))
+        self.last_progress = time.time()
+        self.segments_sent += 1
+        self.bytes_sent += len(chunk)
+
+    def receive_acks(self):
+        """
+        Waits for acknowledgements until the earliest retransmission deadline.
+        """
+        if not self.in_flight:
+            return
+        self.socket.settimeout(max(self.next_deadline() - time.time(), 0.001))
+        try:
+            while True:
+                packet, address = self.socket.recvfrom(BUFFER_SIZE)
+                if address == self.client_address:
+                    self.handle_ack(packet)
+                self.socket.settimeout(0)
+        except (socket.timeout, BlockingIOError):
+            pass
+
+    def next_deadline(self):
+        """
+        :return: the time at which the send loop has to act even if no acknowledgement arrives
+        """
+        deadline = min(entry[1] + self.path_cc(entry[4]).rto for entry in self.in_flight.values())
+        probe = self.probe_deadline()
+        return deadline if probe is None else min(deadline, probe)
+
+    def probe_timeout(self):
+        """
+        :return: the tail loss probe timeout, about two smoothed round trips on the path of the last
+            segment, or None before the first RTT sample
+        """
+        path = next(reversed(self.in_flight.values()))[4] if self.in_flight else 0
+        srtt = self.path_cc(path).srtt
+        return None if srtt is None else max(2 * srtt, MIN_PROBE_TIMEOUT)
+
+    def probe_deadline(self):
+        """
+        :return: when to send a tail loss probe, or None if none is due: once nothing is left to send,
+            one probe is sent when neither a segment went out nor new data was acknowledged for a probe
+            timeout
+        """
+        if self.probe_sent or not self.in_flight or self.has_pending():
+            return None
+        timeout = self.probe_timeout()
+        return None if timeout is None else self.last_progress + timeout
+
+    def handle_ack(self, packet):
+        """
+        Processes a stream acknowledgement: the cumulative ack number, the sequence number of the packet
+        that triggered it and, if present, the time the receiver got that packet.
+        :param packet: the raw acknowledgement packet
+        """
+        seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+        if not (flags & 2 and flags & STREAM) or len(packet) < HEADER_SIZE + 4:
+            return
+        acked_seq = struct.unpack('!I', packet[HEADER_SIZE:HEADER_SIZE + 4])[0]
+        if acked_seq in self.in_flight or (self.in_flight and seq_lt(next(iter(self.in_flight)), ack_num)):
+            # New data was acknowledged, a duplicate caused by a probe does not re-arm it
+            self.last_progress = time.time()
+            self.probe_sent = False
+
+        entry = self.in_flight.pop(acked_seq, None)
+        if entry is not None:
+            if not entry[3]:
+                self.path_cc(entry[4]).on_rtt_sample(time.time() - entry[1])
+                if len(packet) >= HEADER_SIZE + ACK_PAYLOAD_SIZE:
+                    received = struct.unpack(ACK_PAYLOAD, packet[HEADER_SIZE:HEADER_SIZE + ACK_PAYLOAD_SIZE])[1]
+                    self.path_cc(entry[4]).on_delay_sample(received - entry[1])
+            self.path_cc(entry[4]).on_ack(entry[2])
+        while self.in_flight and seq_lt(next(iter(self.in_flight)), ack_num):
+            _, released = self.in_flight.popitem(last=False)
+            self.path_cc(released[4]).on_ack(released[2])
+        self.detect_loss(ack_num, acked_seq, entry)
+
+    def detect_loss(self, ack_num, acked_seq, entry):
+        """
+        Fast retransmit: the segment at the cumulative ack is resent after DUP_ACK_THRESHOLD duplicate
+        acknowledgements.
+        :param ack_num: the cumulative ack number
+        :param acked_seq: the sequence number of the packet that triggered the acknowledgement
+        :param entry: the in-flight entry that packet acknowledged, None if it was acknowledged before
+        """
+        if ack_num == self.last_cumulative_ack and ack_num in self.in_flight:
+            self.dup_acks += 1
+            if self.dup_acks == DUP_ACK_THRESHOLD:
+                self.retransmit(ack_num)
+                self.path_cc(self.in_flight[ack_num][4]).on_loss()
+        else:
+            self.last_cumulative_ack = ack_num
+            self.dup_acks = 0
+
+    def retransmit(self, seq):
+        """
+        Sends an in-flight segment again.
+        :param seq: the sequence number of the segment
+        """
+        entry = self.in_flight[seq]
+        self.path_send(entry[4], entry[0])
+        entry[1] = time.time()
+        entry[3] = True
+        self.retransmissions += 1
+
+    def check_timeouts(self):
+        """
+        Sends a tail loss probe when it is due and retransmits every segment whose retransmission timer
+        expired.
+
+        The probe resends the last segment in flight. When the tail of a transfer is lost no duplicate
+        acknowledgements follow, so without the probe only the retransmission timeout would recover it;
+        the acknowledgement of the probe exposes the loss to fast retransmit instead. The probe keeps the
+        segment's send time and does not mark it retransmitted: if the probe was spurious, its
+        acknowledgement still yields an RTT sample (a larger one, never a smaller one), so a too small
+        RTT estimate cannot keep firing probes that suppress every new sample.
+        """
+        now = time.time()
+        deadline = self.probe_deadline()
+        if deadline is not None and now >= deadline:
+            seq = next(reversed(self.in_flight))
+            print('Tail loss probe for seq_num {}'.format(seq))
+            entry = self.in_flight[seq]
+            self.path_send(entry[4], entry[0])
+            self.probe_sent = True
+            self.tail_probes += 1
+        expired = [seq for seq, entry in self.in_flight.items() if now - entry[1] > self.path_cc(entry[4]).rto]
+        for path in {self.in_flight[seq][4] for seq in expired}:
+            self.path_cc(path).on_timeout()
+        for seq in expired:
+            print('Packet with seq_num {} timed out'.format(seq))
+            self.retransmit(seq)
+
+    def fin_timeout(self, retries):
+        """
+        :param retries: the number of times the FIN was sent again already
+        :return: how long to wait for the FIN-ACK: a tail loss probe timeout, doubled on every retry
+        """
+        return min((self.probe_timeout() or self.cc.rto) * 2 ** retries, MAX_RTO)
+
+    def close(self):
+        """
+        Closes the connection by sending a FIN packet and waiting for the FIN-ACK packet. The FIN is
+        probed again like the tail of the data, up to FIN_RETRIES times, instead of waiting forever.
+        """
+        fin_packet = self.create_packet(fin=True)
+        self.socket.setblocking(True)
+        try:
+            for retries in range(FIN_RETRIES):
+                print('Sending FIN packet')
+                self.socket.settimeout(self.fin_timeout(retries))
+                try:
+                    self.socket.sendto(fin_packet, self.client_address)
+                    while True:
+                        packet, address = self.socket.recvfrom(BUFFER_SIZE)
+                        seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+                        if address == self.client_address and flags & 1 and flags & 2:
+                            print('Received FIN-ACK packet')
+                            self.socket.sendto(self.create_packet(ack=True, ack_num=seq_add(seq_num, 1)),
+                                               self.client_address)
+                            return
+                except socket.timeout:
+                    continue
+                except ConnectionRefusedError:
+                    # The receiver is gone, so it got the FIN and only its FIN-ACK was lost
+                    return
+            print('No FIN-ACK after {} attempts, closing anyway'.format(FIN_RETRIES))
+        finally:
+            self.socket.close()
+
+
+class StreamReceiver(TCPOverUDPReceiver):
+    """
+    The receiving side of StreamSender. Each stream is reassembled on its own and handed to
+    on_stream as soon as it is complete, regardless of losses in other streams. Without on_stream the
+    complete streams are kept in completed and returned by run(); with it they are not kept, so a
+    long-running receiver does not grow.
+    """
+
+    def __init__(self, address='127.0.0.1', port=55552, server_port=55555, window_size=10, MSS=MSS,
+                 on_stream=None):
+        """
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        :param MSS: MSS
+        :param on_stream: called with (stream_id, data) whenever a stream is complete
+        """
+        super().__init__(address, port, server_port, window_size, MSS)
+        self.on_stream = on_stream
+        self.streams = {}
+        self.completed = {}
+        # Stream id -> how often it was reused while an earlier stream on it was still kept
+        self.reused = {}
+        self.segments_received = 0
+        self.duplicates = 0
+
+    def stats(self):
+        """
+        :return: a dictionary with the receive statistics of the connection. Segments the kernel dropped
+            because the receive buffer was full show up in kernel_drops, not as network loss.
+        """
+        return {
+            'segments_received': self.segments_received,
+            'duplicates': self.duplicates,
+            'kernel_drops': kernel_drops(self.socket),
+            'rcvbuf': self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+        }
+
+    def run(self):
+        """
+        Connects to the sender and receives streams until the connection is closed.
+        :return: a dictionary of stream id to the data of the stream, see keep()
+        """
+        self.connect()
+        return self.receive()
+
+    def handshake_accepted(self, options):
+        super().handshake_accepted(options)
+        buffer_size = decode_options(options).get('rcvbuf')
+        if buffer_size:
+            set_buffers(self.socket, int(buffer_size))
+
+    def receive(self):
+        """
+        Receives streams on an established connection until it is closed.
+        :return: a dictionary of stream id to the data of the stream
+        """
+        while True:
+            packet, address = self.socket.recvfrom(BUFFER_SIZE)
+            seq_num, ack_num, flags, window_size = struct.unpack(HEADER, packet[:HEADER_SIZE])
+            if flags & 1:
+                fin_ack_packet = self.create_packet(fin=True, ack=True, ack_num=self.expected_seq_num)
+                self.socket.sendto(fin_ack_packet, address)
+                break
+            if flags & STREAM:
+                self.handle_segment(seq_num, flags, packet, address)
+        return self.completed
+
+    def handle_segment(self, seq_num, flags, packet, address, sock=None):
+        """
+        Delivers a stream packet if it was not seen before and acknowledges it.
+        :param seq_num: the sequence number of the packet
+        :param flags: the flags of the packet
+        :param packet: the raw packet
+        :param address: the address of the sender
+        :param sock: the socket the packet arrived on, the connection's socket by default
+        """
+        self.segments_received += 1
+        if self.mark_received(seq_num, seq_length(packet[HEADER_SIZE + STREAM_HEADER_SIZE:])):
+            self.on_segment(flags, packet)
+        else:
+            self.duplicates += 1
+
+        ack_packet = struct.pack(HEADER, self.seq_num, self.expected_seq_num, 2 | STREAM, self.window_size) + \
+            struct.pack(ACK_PAYLOAD, seq_num, time.time())
+        (sock or self.socket).sendto(ack_packet, address)
+
+    def mark_received(self, seq_num, length):
+        """
+        Records a range of the connection's sequence space as received and advances the cumulative ack.
+        :param seq_num: the first sequence number of the range
+        :param length: the length of the range
+        :return: True if the range was not received before
+        """
+        if seq_num == self.expected_seq_num:
+            self.expected_seq_num = seq_add(self.expected_seq_num, length)
+        elif seq_lt(self.expected_seq_num, seq_num) and seq_num not in self.buffer:
+            self.buffer[seq_num] = length
+        else:
+            return False
+        while self.expected_seq_num in self.buffer:
+            self.expected_seq_num = seq_add(self.expected_seq_num, self.buffer.pop(self.expected_seq_num))
+        return True
+
+    def on_segment(self, flags, packet):
+        """
+        Hands a new stream segment to its stream.
+        :param flags: the flags of the packet
+        :param packet: the raw packet
+        """
+        stream_id, stream_flags, offset = struct.unpack(
+            STREAM_HEADER, packet[HEADER_SIZE:HEADER_SIZE + STREAM_HEADER_SIZE])
+        self.deliver(stream_id, offset, packet[HEADER_SIZE + STREAM_HEADER_SIZE:],
+                     bool(stream_flags & END_OF_STREAM))
+
+    def deliver(self, stream_id, offset, payload, end):
+        """
+        Places a segment in its stream and completes the stream once all of it has arrived.
+        :param stream_id: the stream of the segment
+        :param offset: the offset of the segment in the stream
+        :param payload: the segment data
+        :param end: whether this is the last segment of the stream
+        """
+        state = self.streams.setdefault(stream_id, {'next': 0, 'segments': {}, 'chunks': []})
+        state['segments'][offset] = (payload, end)
+        while state['next'] in state['segments']:
+            payload, end = state['segments'].pop(state['next'])
+            state['chunks'].append(payload)
+            state['next'] += len(payload)
+            if end:
+                del self.streams[stream_id]
+                self.complete_stream(stream_id, b''.join(state['chunks']))
+                return
+
+    def complete_stream(self, stream_id, data):
+        """
+        Hands a complete stream to the application.
+        :param stream_id: the id of the stream
+        :param data: the data of the stream
+        """
+        print('Stream {} complete ({} bytes)'.format(stream_id, len(data)))
+        if self.on_stream:
+            self.on_stream(stream_id, data)
+        else:
+            self.keep(stream_id, data)
+
+    def keep(self, stream_id, value):
+        """
+        Records a complete stream in completed. Stream ids wrap at MAX_STREAM_ID, so an id can be reused
+        while an earlier stream on it is still kept; the earlier one is then moved to the key
+        (stream_id, n), n counting the reuses, instead of being overwritten.
+        :param stream_id: the id of the stream
+        :param value: what to keep for the stream
+        """
+        if stream_id in self.completed:
+            self.reused[stream_id] = self.reused.get(stream_id, 0) + 1
+            self.completed[(stream_id, self.reused[stream_id])] = self.completed.pop(stream_id)
+        self.completed[stream_id] = value
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'send':
+        # Send every picture of one quality folder, one stream per picture
+        folder = sys.argv[2] if len(sys.argv) > 2 else '240P'
+        sender = StreamSender()
+        sender.accept()
+        for i in range(1, 21):
+            name = os.path.join(folder, '{}.png'.format(i))
+            if os.path.isfile(name):
+                with open(name, 'rb') as f:
+                    sender.write(sender.open_stream(), f.read(), end=True)
+        sender.flush()
+        print(sender.stats())
+        sender.close()
+    else:
+        receiver = StreamReceiver()
+        receiver.run()
+        print(receiver.stats())
@@ -0,0 +1,437 @@
+import hashlib
+import itertools
+import json
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rudp_streams import StreamSender, StreamReceiver, encode_options, decode_options
+
+BLOCK_SIZE = 4096
+# Delta operations: copy `count` blocks of the receiver's old file starting at block `index`, or insert data
+COPY = b'C'
+DATA = b'D'
+COPY_OP = '!cII'
+COPY_OP_SIZE = 9
+DATA_OP = '!cI'
+DATA_OP_SIZE = 5
+
+
+def weak_checksum(block):
+    """
+    The rsync rolling checksum of a block.
+    :param block: the block data
+    :return: (a, b), the two 16 bit halves of the checksum
+    """
+    a = sum(block) & 0xffff
+    # sum((len(block) - i) * block[i]) is the sum of the prefix sums
+    b = sum(itertools.accumulate(block)) & 0xffff
+    return a, b
+
+
+def list_files(root):
+    """
+    :param root: a directory
+    :return: the sorted paths of every file below root, relative to root and separated by '/'
+    """
+    names = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith('.sync'):
+                names.append(os.path.relpath(os.path.join(directory, name), root).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def local_path(root, name):
+    """
+    :param root: the synced directory
+    :param name: a name from the manifest
+    :return: the local path of the file
+    """
+    parts = name.split('/')
+    if name.startswith('/') or '..' in parts:
+        raise ValueError('unsafe file name {!r}'.format(name))
+    return os.path.join(root, *parts)
+
+
+def file_signature(path, block_size=BLOCK_SIZE):
+    """
+    Computes the signature of a file: the rolling checksum and MD5 of every block, plus the hash of
+    the whole file so that unchanged files are skipped outright.
+    :param path: the file
+    :param block_size: the block size
+    :return: a dictionary with the size, the SHA-256 and the blocks [weak, strong] of the file
+    """
+    blocks = []
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+            size += len(block)
+            a, b = weak_checksum(block)
+            blocks.append([a | (b << 16), hashlib.md5(block).hexdigest()])
+    return {'size': size, 'sha256': digest.hexdigest(), 'blocks': blocks}
+
+
+def directory_signatures(root, block_size=BLOCK_SIZE, workers=None):
+    """
+    Computes the signatures of every file below root, one file per worker process at a time.
+    :param root: the directory
+    :param block_size: the block size
+    :param workers: the number of worker processes, one per core by default
+    :return: a dictionary of relative file name to signature
+    """
+    if not os.path.isdir(root):
+        return {}
+    names = list_files(root)
+    with ProcessPoolExecutor(workers) as pool:
+        signatures = pool.map(file_signature, [local_path(root, name) for name in names],
+                              [block_size] * len(names))
+        return dict(zip(names, signatures))
+
+
+def file_delta(data, signature, block_size=BLOCK_SIZE):
+    """
+    Encodes data as copies of blocks the receiver already holds and literal data (the rsync algorithm):
+    a window of block_size bytes slides over the data, its rolling checksum is looked up in the
+    receiver's blocks and confirmed with MD5, and matched blocks are skipped in one step.
+    :param data: the new content of the file
+    :param signature: the signature of the receiver's copy
+    :param block_size: the block size of the signature
+    :return: (the encoded delta, the number of literal bytes in it)
+    """
+    table = {}
+    for index, (weak, strong) in enumerate(signature['blocks']):
+        table.setdefault(weak, []).append((strong, index))
+
+    out = []
+    literal = 0
+    run = None  # [first block, count] of the copy being extended
+    start = 0  # first byte that is not encoded yet
+    i = 0
+    a = b = None
+    n = len(data)
+    while i + block_size <= n:
+        if a is None:
+            a, b = weak_checksum(data[i:i + block_size])
+        index = None
+        candidates = table.get(a | (b << 16))
+        if candidates:
+            strong = hashlib.md5(data[i:i + block_size]).hexdigest()
+            index = next((index for digest, index in candidates if digest == strong), None)
+        if index is not None:
+            if start < i or (run and run[0] + run[1] != index):
+                if run:
+                    out.append(struct.pack(COPY_OP, COPY, run[0], run[1]))
+                    run = None
+                if start < i:
+                    out.append(struct.pack(DATA_OP, DATA, i - start) + data[start:i])
+                    literal += i - start
+            if run:
+                run[1] += 1
+            else:
+                run = [index, 1]
+            i += block_size
+            start = i
+            a = None
+            continue
+        if i + block_size < n:
+            # Roll the window one byte forward
+            removed, added = data[i], data[i + block_size]
+            a = (a - removed + added) & 0xffff
+            b = (b - block_size * removed + a) & 0xffff
+        i += 1
+
+    if run:
+        out.append(struct.pack(COPY_OP, COPY, run[0], run[1]))
+    if start < n:
+        out.append(struct.pack(DATA_OP, DATA, n - start) + data[start:])
+        literal += n - start
+    return b''.join(out), literal
+
+
+def encode_file(path, signature, block_size=BLOCK_SIZE):
+    """
+    Prepares one file for the receiver. Runs in a worker process.
+    :param path: the sender's file
+    :param signature: the signature of the receiver's copy, or None if it has none
+    :param block_size: the block size of the signature
+    :return: (SHA-256, size, delta or None if the receiver's copy is identical, literal bytes)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if signature is not None and signature['sha256'] == digest:
+        return digest, len(data), None, 0
+    if signature is None:
+        return digest, len(data), struct.pack(DATA_OP, DATA, len(data)) + data, len(data)
+    delta, literal = file_delta(data, signature, block_size)
+    return digest, len(data), delta, literal
+
+
+def apply_delta(old_path, delta, block_size=BLOCK_SIZE):
+    """
+    Rebuilds a file from the receiver's old copy and a delta.
+    :param old_path: the old copy (need not exist if the delta holds only data)
+    :param delta: the delta written by file_delta
+    :param block_size: the block size of the signature
+    :return: the new content of the file
+    """
+    pieces = []
+    position = 0
+    old = None
+    try:
+        while position < len(delta):
+            op = delta[position:position + 1]
+            if op == COPY:
+                _, index, count = struct.unpack_from(COPY_OP, delta, position)
+                position += COPY_OP_SIZE
+                if old is None:
+                    old = open(old_path, 'rb')
+                old.seek(index * block_size)
+                pieces.append(old.read(count * block_size))
+            elif op == DATA:
+                _, length = struct.unpack_from(DATA_OP, delta, position)
+                position += DATA_OP_SIZE
+                pieces.append(delta[position:position + length])
+                position += length
+            else:
+                raise ValueError('corrupt delta at byte {}'.format(position))
+    finally:
+        if old is not None:
+            old.close()
+    return b''.join(pieces)
+
+
+class ManifestSender(StreamSender):
+    """
+    A stream sender whose transfer starts with a manifest. The manifest stream is opened during the
+    handshake and its id is sent to the receiver in the SYN-ACK (manifest=<id>), so the receiver does
+    not depend on the order in which the sender opens streams.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest_stream = None
+
+    def negotiate(self, offer):
+        reply = decode_options(super().negotiate(offer))
+        # A retransmitted SYN gets the same stream
+        if self.manifest_stream is None:
+            self.manifest_stream = self.open_stream(priority=0)
+        reply['manifest'] = self.manifest_stream
+        return encode_options(reply)
+
+
+class ManifestReceiver(StreamReceiver):
+    """
+    The receiving side of ManifestSender: it learns the id of the manifest stream from the SYN-ACK.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest_stream = None
+
+    def handshake_accepted(self, options):
+        super().handshake_accepted(options)
+        manifest = decode_options(options).get('manifest')
+        self.manifest_stream = int(manifest) if manifest else None
+
+
+class SyncSender(ManifestSender):
+    """
+    Synchronises a receiver's copy of a directory with the local one, sending only what changed.
+
+    The receiver offers sync=<port> in its SYN. After the handshake the sender connects back to that
+    port with a StreamReceiver and receives the block signatures of the receiver's files. It then
+    computes a delta per changed file in a process pool and sends a manifest, on the stream announced in
+    the handshake, followed by one stream per changed file.
+    """
+
+    def __init__(self, root, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, workers=None, **kwargs):
+        """
+        :param root: the directory to send
+        :param server_address: the IP address of the server
+        :param server_port: the port the sender listens on, the signatures arrive on server_port + 1
+        :param window_size: the largest number of segments in flight
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        :param workers: the number of worker processes computing deltas, one per core by default
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, **kwargs)
+        self.root = root
+        self.workers = workers
+        self.sync_port = None
+        self.block_size = BLOCK_SIZE
+
+    def negotiate(self, offer):
+        reply = decode_options(super().negotiate(offer))
+        options = decode_options(offer)
+        if 'sync' in options:
+            self.sync_port = int(options['sync'])
+            self.block_size = int(options.get('block', BLOCK_SIZE))
+            reply['sync'] = 1
+        return encode_options(reply)
+
+    def receive_signatures(self):
+        """
+        Connects back to the receiver and receives the signatures of its files.
+        :return: a dictionary of relative file name to signature
+        """
+        receiver = StreamReceiver(self.client_address[0], self.server_port + 1, self.sync_port,
+                                  self.window_size)
+        try:
+            streams = receiver.run()
+        finally:
+            receiver.socket.close()
+        return json.loads(b''.join(streams[stream_id] for stream_id in sorted(streams)))
+
+    def sync(self):
+        """
+        Receives the signatures, queues the manifest and the deltas and sends them.
+        """
+        signatures = self.receive_signatures()
+        start = time.time()
+        names = list_files(self.root)
+        with ProcessPoolExecutor(self.workers) as pool:
+            results = list(pool.map(encode_file, [local_path(self.root, name) for name in names],
+                                    [signatures.get(name) for name in names],
+                                    [self.block_size] * len(names)))
+        print('Computed deltas in {:.3f} s'.format(time.time() - start))
+
+        manifest = []
+        deltas = []
+        total = literal = sent = 0
+        for name, (digest, size, delta, literal_bytes) in zip(names, results):
+            entry = {'name': name, 'size': size, 'sha256': digest, 'stream': None}
+            if delta is not None:
+                entry['stream'] = self.open_stream()
+                deltas.append((entry['stream'], delta))
+                sent += len(delta)
+                literal += literal_bytes
+            manifest.append(entry)
+            total += size
+        self.write(self.manifest_stream, json.dumps(manifest).encode(), end=True)
+        for stream_id, delta in deltas:
+            self.write(stream_id, delta, end=True)
+        self.flush()
+        print('{} of {} files changed, sent {} bytes ({} literal) for {} bytes of data'.format(
+            len(deltas), len(names), sent, literal, total))
+
+    def run(self, data=None):
+        """
+        Waits for a receiver and synchronises its copy of the directory.
+        :param data: unused, the directory is sent
+        """
+        if not self.accept():
+            return
+        if self.sync_port is None:
+            print('The receiver did not ask for a sync')
+        else:
+            self.sync()
+        self.close()
+
+
+class SyncReceiver(ManifestReceiver):
+    """
+    The receiving side of SyncSender. It computes the signatures of its copy of the directory in a
+    process pool, sends them over a second connection on port + 1 and rebuilds every changed file from
+    its old copy and the delta.
+    """
+
+    def __init__(self, root, address='127.0.0.1', port=55552, server_port=55555, window_size=10,
+                 block_size=BLOCK_SIZE, workers=None, **kwargs):
+        """
+        :param root: the directory to update
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver, the signatures are sent from port + 1
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        :param block_size: the block size of the signatures
+        :param workers: the number of worker processes computing signatures, one per core by default
+        """
+        super().__init__(address, port, server_port, window_size, **kwargs)
+        self.root = root
+        self.block_size = block_size
+        self.workers = workers
+        # Bound now so that the sender's SYN waits in the socket until send_signatures() accepts it
+        self.signature_sender = StreamSender(address, port + 1, window_size)
+        self.accepted = False
+        self.updated = []
+
+    def handshake_offer(self):
+        options = decode_options(super().handshake_offer())
+        options['sync'] = self.port + 1
+        options['block'] = self.block_size
+        return encode_options(options)
+
+    def handshake_accepted(self, options):
+        super().handshake_accepted(options)
+        self.accepted = 'sync' in decode_options(options)
+
+    def run(self):
+        """
+        Computes the signatures, connects and updates the directory.
+        :return: the names of the files that were updated
+        """
+        start = time.time()
+        signatures = directory_signatures(self.root, self.block_size, self.workers)
+        print('Computed signatures of {} files in {:.3f} s'.format(len(signatures), time.time() - start))
+        self.connect()
+        if not self.accepted:
+            print('The sender does not support sync')
+            self.signature_sender.socket.close()
+            return self.updated
+        self.send_signatures(signatures)
+        self.apply(self.receive())
+        return self.updated
+
+    def send_signatures(self, signatures):
+        """
+        Accepts the sender's connection on port + 1 and sends the signatures over it.
+        :param signatures: a dictionary of relative file name to signature
+        """
+        sender = self.signature_sender
+        if not sender.accept():
+            raise ConnectionError('the sender did not connect for the signatures')
+        sender.write(sender.open_stream(), json.dumps(signatures).encode(), end=True)
+        sender.flush()
+        sender.close()
+
+    def apply(self, streams):
+        """
+        Rebuilds every changed file of the manifest and moves it into place.
+        :param streams: the received streams, the manifest is the one announced in the handshake
+        """
+        if self.manifest_stream not in streams:
+            print('No manifest was received, nothing updated')
+            return
+        for entry in json.loads(streams[self.manifest_stream]):
+            if entry['stream'] is None:
+                continue
+            if entry['stream'] not in streams:
+                print('{} did not arrive, keeping the old copy'.format(entry['name']))
+                continue
+            path = local_path(self.root, entry['name'])
+            data = apply_delta(path, streams[entry['stream']], self.block_size)
+            if hashlib.sha256(data).hexdigest() != entry['sha256']:
+                print('{} does not match the manifest, keeping the old copy'.format(entry['name']))
+                continue
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            temp_path = path + '.sync'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            self.updated.append(entry['name'])
+        print('Updated {} files'.format(len(self.updated)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'send':
+        SyncSender(sys.argv[2]).run()
+    else:
+        SyncReceiver(sys.argv[1] if len(sys.argv) > 1 else 'synced').run()
@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from rudp_sync import ManifestSender, ManifestReceiver, list_files, local_path
+
+
+class DirectorySender(ManifestSender):
+    """
+    A stream sender that transfers a whole directory.
+
+    A manifest with the name, size, SHA-256 and stream id of every file goes first, on the stream
+    announced in the handshake, then the files
+    follow, largest first, with at most `concurrency` files queued on the connection at a time. Files
+    are read only when they are admitted, so memory stays bounded by the concurrency.
+    """
+
+    def __init__(self, root, server_address='127.0.0.1', server_port=55555, window_size=10, timeout=0.5,
+                 congestion_control=True, concurrency=4, **kwargs):
+        """
+        :param root: the directory to send
+        :param server_address: the IP address of the server
+        :param server_port: the port the sender listens on
+        :param window_size: the largest number of segments in flight
+        :param timeout: the initial retransmission timeout
+        :param congestion_control: whether congestion control is enabled
+        :param concurrency: the largest number of files sent at the same time
+        """
+        super().__init__(server_address, server_port, window_size, timeout, congestion_control, **kwargs)
+        self.root = root
+        self.concurrency = concurrency
+        self.queue = []
+        self.active = []
+
+    def manifest(self):
+        """
+        Opens one stream per file, largest file first.
+        :return: the manifest entries (name, size, sha256, stream)
+        """
+        entries = []
+        for name in list_files(self.root):
+            digest = hashlib.sha256()
+            with open(local_path(self.root, name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            entries.append({'name': name, 'size': os.path.getsize(local_path(self.root, name)),
+                            'sha256': digest.hexdigest()})
+        entries.sort(key=lambda entry: entry['size'], reverse=True)
+        for entry in entries:
+            entry['stream'] = self.open_stream(priority=1)
+        return entries
+
+    def admit(self):
+        """
+        Queues the next files while fewer than `concurrency` files still have data waiting to be sent.
+        """
+        self.active = [stream_id for stream_id in self.active if self.streams[stream_id].pending]
+        while self.queue and len(self.active) < self.concurrency:
+            entry = self.queue.pop(0)
+            with open(local_path(self.root, entry['name']), 'rb') as f:
+                self.write(entry['stream'], f.read(), end=True)
+            self.active.append(entry['stream'])
+
+    def step(self):
+        self.admit()
+        super().step()
+
+    def has_pending(self):
+        return bool(self.queue) or super().has_pending()
+
+    def send_directory(self):
+        """
+        Sends the manifest and every file and waits until all of it is acknowledged.
+        :return: the manifest entries
+        """
+        entries = self.manifest()
+        self.write(self.manifest_stream, json.dumps(entries).encode(), end=True)
+        self.queue = list(entries)
+        start = time.time()
+        self.flush()
+        elapsed = time.time() - start
+        total = sum(entry['size'] for entry in entries)
+        print('Sent {} files, {} bytes in {:.3f} s ({:.2f} MB/s, {} retransmissions)'.format(
+            len(entries), total, elapsed, total / elapsed / 1e6, self.retransmissions))
+        return entries
+
+
+class DirectoryReceiver(ManifestReceiver):
+    """
+    The receiving side of DirectorySender. It checks every file against the manifest, stores it under
+    root and reports the throughput of each file and of the whole transfer.
+    """
+
+    def __init__(self, root, address='127.0.0.1', port=55552, server_port=55555, window_size=10, **kwargs):
+        """
+        :param root: the directory to store the files in
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        """
+        super().__init__(address, port, server_port, window_size, **kwargs)
+        self.root = root
+        self.entries = None
+        self.early = {}
+        self.started = {}
+        self.first_segment = None
+        self.received_bytes = 0
+
+    def deliver(self, stream_id, offset, payload, end):
+        now = time.time()
+        self.started.setdefault(stream_id, now)
+        if self.first_segment is None:
+            self.first_segment = now
+        super().deliver(stream_id, offset, payload, end)
+
+    def complete_stream(self, stream_id, data):
+        """
+        Reads the manifest, or stores a file; files that arrive before the manifest wait for it.
+        """
+        if stream_id == self.manifest_stream:
+            self.entries = {entry['stream']: entry for entry in json.loads(data)}
+            print('Manifest: {} files, {} bytes'.format(
+                len(self.entries), sum(entry['size'] for entry in self.entries.values())))
+            for early_id, early_data in self.early.items():
+                self.store(early_id, early_data)
+            self.early = {}
+        elif self.entries is None:
+            self.early[stream_id] = data
+        else:
+            self.store(stream_id, data)
+
+    def store(self, stream_id, data):
+        """
+        Checks a file against the manifest and moves it into place.
+        :param stream_id: the stream of the file
+        :param data: the content of the file
+        """
+        entry = self.entries.get(stream_id)
+        if entry is None:
+            print('Dropping stream {}, it is not in the manifest'.format(stream_id))
+            return
+        elapsed = max(time.time() - self.started.get(stream_id, time.time()), 1e-6)
+        if len(data) != entry['size'] or hashlib.sha256(data).hexdigest() != entry['sha256']:
+            print('{} does not match the manifest'.format(entry['name']))
+            return
+        path = local_path(self.root, entry['name'])
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.part', path)
+        self.keep(stream_id, path)
+        self.received_bytes += len(data)
+        print('{}: {} bytes in {:.3f} s ({:.2f} MB/s)'.format(entry['name'], len(data), elapsed,
+                                                             len(data) / elapsed / 1e6))
+        if self.on_stream:
+            self.on_stream(stream_id, path)
+
+    def receive(self):
+        completed = super().receive()
+        missing = [entry['name'] for stream_id, entry in (self.entries or {}).items()
+                   if stream_id not in completed]
+        if self.first_segment is not None:
+            elapsed = max(time.time() - self.first_segment, 1e-6)
+            print('Received {} files, {} bytes in {:.3f} s ({:.2f} MB/s)'.format(
+                len(completed), self.received_bytes, elapsed, self.received_bytes / elapsed / 1e6))
+        if missing or self.entries is None:
+            print('Missing files: {}'.format(', '.join(missing) if self.entries else 'manifest'))
+        return completed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Transfer a directory over RUDP.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    send_parser = subparsers.add_parser('send', help='wait for a receiver and send a directory')
+    send_parser.add_argument('directory')
+    send_parser.add_argument('--port', type=int, default=55555, help='the port to listen on')
+    send_parser.add_argument('--concurrency', type=int, default=4, help='files sent at the same time')
+    send_parser.add_argument('--window', type=int, default=10, help='the largest window in segments')
+    send_parser.add_argument('--scavenger', action='store_true',
+                             help='use delay-based congestion control that yields to other traffic')
+    receive_parser = subparsers.add_parser('receive', help='connect to a sender and store the directory')
+    receive_parser.add_argument('directory')
+    receive_parser.add_argument('--address', default='127.0.0.1', help='the address of the sender')
+    receive_parser.add_argument('--port', type=int, default=55552, help='the local port')
+    receive_parser.add_argument('--server-port', type=int, default=55555, help='the port of the sender')
+    args = parser.parse_args()
+
+    if args.command == 'send':
+        sender = DirectorySender(args.directory, server_port=args.port, window_size=args.window,
+                                 concurrency=args.concurrency, scavenger=args.scavenger)
+        if sender.accept():
+            sender.send_directory()
+            sender.close()
+    else:
+        DirectoryReceiver(args.directory, args.address, args.port, args.server_port).run()
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import time
+
+from rudp_profiles import save_profile, PROFILES_PATH
+from rudp_streams import StreamSender, StreamReceiver
+
+# Candidate values, searched one parameter at a time starting from DEFAULT_PROFILE
+CANDIDATES = {
+    'mss': [1400, 8192, 16384, 32768, 63000],
+    'initial_window': [1, 2, 4, 10],
+    'initial_rto': [0.1, 0.25, 0.5, 1.0],
+    # 0 keeps the system default
+    'buffer_size': [0, 262144, 1048576, 4194304],
+}
+DEFAULT_PROFILE = {'mss': 63000, 'initial_window': 1, 'initial_rto': 0.5, 'buffer_size': 0}
+# Marks a control stream that tells the probe receiver which receive buffer to use
+CONTROL = b'TUNE'
+
+
+class Tuner:
+    """
+    Searches transport parameters for one destination with short probe transfers over an established
+    StreamSender connection.
+
+    Every parameter of CANDIDATES is varied in turn while the others keep their best value so far
+    (coordinate descent). A probe sends `size` bytes `repeat` times, each time from a fresh congestion
+    controller, and scores the median throughput.
+    """
+
+    def __init__(self, sender, size=4000000, repeat=3):
+        """
+        :param sender: a StreamSender connected to a ProbeReceiver
+        :param size: the number of bytes of one probe transfer
+        :param repeat: the number of transfers per probe
+        """
+        self.sender = sender
+        self.payload = bytes(len(CONTROL)) + os.urandom(max(size - len(CONTROL), 0))
+        self.repeat = repeat
+        sock = sender.socket
+        # Linux reports twice the value that was set
+        self.default_buffers = (sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) // 2,
+                                sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2)
+
+    def configure(self, profile):
+        """
+        Applies a profile on both ends of the connection.
+        :param profile: the profile to apply
+        """
+        control = self.sender.open_stream()
+        self.sender.write(control, CONTROL + json.dumps({'rcvbuf': profile['buffer_size']}).encode(), end=True)
+        self.sender.flush()
+        self.sender.apply_profile(profile)
+        if not profile['buffer_size']:
+            self.sender.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.default_buffers[0])
+            self.sender.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.default_buffers[1])
+
+    def probe(self, profile):
+        """
+        :param profile: the profile to measure
+        :return: the median throughput of the probe transfers in bytes per second
+        """
+        self.configure(profile)
+        results = []
+        for _ in range(self.repeat):
+            self.sender.apply_profile(dict(profile, buffer_size=0))
+            stream_id = self.sender.open_stream()
+            start = time.time()
+            self.sender.write(stream_id, self.payload, end=True)
+            self.sender.flush()
+            results.append(len(self.payload) / (time.time() - start))
+        throughput = statistics.median(results)
+        print('Probe {}: {:.2f} MB/s'.format(profile, throughput / 1e6))
+        return throughput
+
+    def tune(self):
+        """
+        :return: the best profile found and its throughput in bytes per second
+        """
+        best = dict(DEFAULT_PROFILE)
+        best_throughput = self.probe(best)
+        for name, values in CANDIDATES.items():
+            for value in values:
+                if value == best[name]:
+                    continue
+                candidate = dict(best, **{name: value})
+                throughput = self.probe(candidate)
+                if throughput > best_throughput:
+                    best, best_throughput = candidate, throughput
+        return best, best_throughput
+
+
+class ProbeReceiver(StreamReceiver):
+    """
+    The receiving side of a Tuner. It applies the receive buffer sizes the tuner asks for and discards
+    the probe data.
+    """
+
+    def __init__(self, address='127.0.0.1', port=55552, server_port=55555, window_size=10, **kwargs):
+        """
+        :param address: the IP address of the receiver
+        :param port: the port of the receiver
+        :param server_port: the port of the server
+        :param window_size: window size of the receiver
+        """
+        super().__init__(address, port, server_port, window_size, **kwargs)
+        self.default_buffer = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2
+
+    def complete_stream(self, stream_id, data):
+        if data.startswith(CONTROL):
+            buffer_size = json.loads(data[len(CONTROL):])['rcvbuf'] or self.default_buffer
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+            print('Receive buffer set to {} bytes'.format(
+                self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
+        self.keep(stream_id, len(data))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune the RUDP transport parameters for a destination.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    send_parser = subparsers.add_parser('send', help='wait for a probe receiver and tune the link to it')
+    send_parser.add_argument('--port', type=int, default=55555, help='the port to listen on')
+    send_parser.add_argument('--size', type=float, default=4, help='megabytes per probe transfer')
+    send_parser.add_argument('--repeat', type=int, default=3, help='transfers per probe')
+    send_parser.add_argument('--profiles', default=PROFILES_PATH, help='the profile file to update')
+    receive_parser = subparsers.add_parser('receive', help='connect to a tuner and answer its probes')
+    receive_parser.add_argument('--address', default='127.0.0.1', help='the address of the tuner')
+    receive_parser.add_argument('--port', type=int, default=55552, help='the local port')
+    receive_parser.add_argument('--server-port', type=int, default=55555, help='the port of the tuner')
+    args = parser.parse_args()
+
+    if args.command == 'send':
+        sender = StreamSender(server_port=args.port)
+        if sender.accept():
+            destination = sender.client_address[0]
+            profile, throughput = Tuner(sender, int(args.size * 1e6), args.repeat).tune()
+            sender.close()
+            save_profile(destination, dict(profile, throughput=throughput, tuned=time.time()), args.profiles)
+            print('Best profile for {}: {} ({:.2f} MB/s), saved to {}'.format(
+                destination, profile, throughput / 1e6, args.profiles))
+    else:
+        ProbeReceiver(args.address, args.port, args.server_port).run()
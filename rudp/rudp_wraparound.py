@@ -0,0 +1,123 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import multiprocessing
+import os
+import random
+import time
+
+from rudp_serial import SEQ_SPACE
+from rudp_streams import StreamSender, StreamReceiver, MAX_STREAM_ID
+
+SERVER_PORT = 56300
+CLIENT_PORT = 57300
+
+
+class WrappingSender(StreamSender):
+    """
+    A stream sender that starts a given distance before the end of the sequence space and drops a
+    fraction of its segments, so a transfer crosses the 32-bit boundary while losses and retransmissions
+    are in flight. Its streams may start at a large offset instead of 0, so they pass 4 GiB without
+    sending that much, and its stream ids start at the last one, so the second stream wraps to id 1.
+    """
+
+    def __init__(self, before_wrap, loss=0.0, stream_base=0, **kwargs):
+        """
+        :param before_wrap: the amount of sequence space left before the boundary at the start
+        :param loss: the probability of dropping a segment
+        :param stream_base: the offset of the first byte of every stream
+        """
+        super().__init__(**kwargs)
+        self.before_wrap = before_wrap
+        self.loss = loss
+        self.stream_base = stream_base
+        self.last_stream_id = MAX_STREAM_ID - 1
+
+    def initial_seq_num(self):
+        return SEQ_SPACE - self.before_wrap
+
+    def open_stream(self, priority=0):
+        stream_id = super().open_stream(priority)
+        self.streams[stream_id].offset = self.stream_base
+        return stream_id
+
+    def path_send(self, path, packet):
+        if random.random() >= self.loss:
+            super().path_send(path, packet)
+
+
+class WrappingReceiver(StreamReceiver):
+    """
+    The receiving side of WrappingSender, expecting every stream to start at the same offset.
+    """
+
+    def __init__(self, stream_base=0, **kwargs):
+        super().__init__(**kwargs)
+        self.stream_base = stream_base
+
+    def deliver(self, stream_id, offset, payload, end):
+        self.streams.setdefault(stream_id, {'next': self.stream_base, 'segments': {}, 'chunks': []})
+        super().deliver(stream_id, offset, payload, end)
+
+
+def run_receiver(stream_base, results):
+    with contextlib.redirect_stdout(io.StringIO()):
+        receiver = WrappingReceiver(stream_base, port=CLIENT_PORT, server_port=SERVER_PORT)
+        # The receiver's own numbers wrap too when it closes the connection
+        receiver.seq_num = SEQ_SPACE - 1
+        streams = receiver.run()
+    results.put({stream_id: hashlib.sha256(data).hexdigest() for stream_id, data in streams.items()})
+
+
+def transfer(payload, before_wrap, loss, stream_base=0):
+    """
+    Sends a payload in two streams and checks that the receiver got both intact.
+    :param payload: the data to send
+    :param before_wrap: the amount of sequence space left before the boundary at the start
+    :param loss: the probability of dropping a segment
+    :param stream_base: the offset the streams start at
+    :return: the throughput in bytes per second and the number of retransmissions
+    """
+    halves = (payload[:len(payload) // 2], payload[len(payload) // 2:])
+    results = multiprocessing.Queue()
+    receiver = multiprocessing.Process(target=run_receiver, args=(stream_base, results))
+    with contextlib.redirect_stdout(io.StringIO()):
+        sender = WrappingSender(before_wrap, loss, stream_base, server_port=SERVER_PORT)
+        receiver.start()
+        sender.accept()
+        start_seq = sender.seq_num
+        start = time.time()
+        stream_ids = [sender.open_stream() for _ in halves]
+        for stream_id, half in zip(stream_ids, halves):
+            sender.write(stream_id, half, end=True)
+        sender.flush()
+        elapsed = time.time() - start
+        end_seq = sender.seq_num
+        sender.close()
+    digests = results.get()
+    receiver.join()
+    if [digests.get(stream_id) for stream_id in stream_ids] != [hashlib.sha256(half).hexdigest() for half in halves]:
+        raise RuntimeError('the received data does not match')
+    print('  stream ids {}, stream offsets {} -> {}'.format(
+        stream_ids, stream_base, stream_base + len(halves[1])))
+    print('  sequence numbers {} -> {}{}'.format(start_seq, end_seq, ', wrapped' if end_seq < start_seq else ''))
+    return len(payload) / elapsed, sender.retransmissions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Transfer across the 32-bit sequence number boundary.')
+    parser.add_argument('--size', type=int, default=256, help='megabytes to transfer')
+    parser.add_argument('--loss', type=float, nargs='+', default=[0.0, 0.01], help='segment loss rates')
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size * 1000000)
+    for loss in args.loss:
+        # Far from the boundary, then with the boundary in the middle of the transfer, then with the streams
+        # passing 4 GiB as well
+        for before_wrap, stream_base, label in ((SEQ_SPACE // 2, 0, 'no wrap'),
+                                                (len(payload) // 2, 0, 'wrap'),
+                                                (len(payload) // 2, 2 ** 32 - len(payload) // 4, 'wrap past 4 GiB')):
+            throughput, retransmissions = transfer(payload, before_wrap, loss, stream_base)
+            print('{:.0%} loss, {}: {:.1f} MB/s, {} retransmissions'.format(
+                loss, label, throughput / 1e6, retransmissions))
@@ -0,0 +1,179 @@
+import math
+import os
+from collections import deque
+
+from tcp_protocol import QUALITY_NAMES, SEGMENT_DURATION, picture_path
+
+# Half-lives in samples of the fast and slow throughput averages, the estimate is the lower of the two
+FAST_HALF_LIFE = 2
+SLOW_HALF_LIFE = 8
+# Samples in the harmonic mean
+HARMONIC_SAMPLES = 5
+# Share of the estimated throughput a segment may use
+SAFETY_FACTOR = 0.9
+# The buffer level the buffer-based policy aims at, in seconds
+BUFFER_TARGET = 5.0
+# BOLA's weight of playback smoothness against quality, larger values switch up earlier
+BOLA_GAMMA_P = 5.0
+
+
+def segment_sizes(index, folder='.'):
+    """
+    :param index: the index of the segment (picture)
+    :param folder: the folder holding one sub folder per quality
+    :return: the byte size of the segment in every quality, None where the quality lacks it
+    """
+    sizes = []
+    for name in QUALITY_NAMES:
+        path = picture_path(name, index, folder)
+        sizes.append(os.path.getsize(path) if os.path.isfile(path) else None)
+    return sizes
+
+
+def resolution(level):
+    """
+    :return: the number of lines of a quality, 1080 for '1080p'
+    """
+    return int(QUALITY_NAMES[level][:-1])
+
+
+def smallest(sizes):
+    """
+    :return: the quality with the smallest segment, None if no quality has it
+    """
+    available = [(size, level) for level, size in enumerate(sizes) if size is not None]
+    return min(available)[1] if available else None
+
+
+class ThroughputEstimator:
+    """
+    Estimates the throughput from the bytes and transfer time of every segment, either as the lower
+    of a fast and a slow exponentially weighted moving average or as the harmonic mean of the last
+    segments. Both follow drops quickly and are not pulled up by a single fast segment.
+    """
+
+    def __init__(self, method='ewma'):
+        """
+        :param method: 'ewma' or 'harmonic'
+        """
+        if method not in ('ewma', 'harmonic'):
+            raise ValueError(f'unknown throughput estimator {method}')
+        self.method = method
+        self.fast = None
+        self.slow = None
+        self.samples = deque(maxlen=HARMONIC_SAMPLES)
+
+    def add_sample(self, size, seconds):
+        """
+        :param size: the bytes of a segment
+        :param seconds: the time it took to transfer them
+        """
+        sample = size / max(seconds, 1e-6)
+        self.samples.append(sample)
+        self.fast = self.average(self.fast, sample, FAST_HALF_LIFE)
+        self.slow = self.average(self.slow, sample, SLOW_HALF_LIFE)
+
+    @staticmethod
+    def average(current, sample, half_life):
+        if current is None:
+            return sample
+        alpha = 1 - 0.5 ** (1 / half_life)
+        return (1 - alpha) * current + alpha * sample
+
+    def estimate(self):
+        """
+        :return: the estimated throughput in bytes per second, None before the first sample
+        """
+        if not self.samples:
+            return None
+        if self.method == 'harmonic':
+            return len(self.samples) / sum(1 / sample for sample in self.samples)
+        return min(self.fast, self.slow)
+
+
+class ThroughputPolicy:
+    """
+    Picks the highest quality whose next segment downloads within its playback duration at the
+    estimated throughput, or the smallest segment if none does. It is throughput-only on purpose: the
+    buffer level is left to BolaPolicy and only taken by choose() to share its interface.
+    """
+
+    def __init__(self, method='ewma', segment_duration=SEGMENT_DURATION, safety=SAFETY_FACTOR):
+        """
+        :param method: the throughput estimator, 'ewma' or 'harmonic'
+        :param segment_duration: the playback time of one segment in seconds
+        :param safety: the share of the estimated throughput a segment may use
+        """
+        self.estimator = ThroughputEstimator(method)
+        self.segment_duration = segment_duration
+        self.safety = safety
+
+    def on_segment(self, size, seconds):
+        self.estimator.add_sample(size, seconds)
+
+    def choose(self, sizes, buffer_level):
+        """
+        :param sizes: the byte size of the next segment in every quality, None where it is missing
+        :param buffer_level: the playback buffer the client reported, in seconds; not used
+        :return: the quality to send the segment in, None if no quality has it
+        """
+        throughput = self.estimator.estimate()
+        if throughput is None:
+            return smallest(sizes)
+        budget = throughput * self.segment_duration * self.safety
+        fitting = [level for level, size in enumerate(sizes) if size is not None and size <= budget]
+        return max(fitting) if fitting else smallest(sizes)
+
+
+class BolaPolicy:
+    """
+    A buffer-based policy after BOLA-BASIC (Spiteri et al., 2016). It picks the quality m that maximizes
+    (V * (v_m + gamma_p) - Q) / S_m, where S_m is the actual size of the next segment, Q the buffer level
+    in segments and V scales utility against buffer so that the highest quality wins once the buffer
+    nears its target. It needs no throughput estimate.
+
+    BOLA derives the utility v_m from the bitrate of each rendition. The bundled renditions are about
+    the same size (and 1080p is often the smallest), so the utility here is v_m = ln(P_m / P_min) of
+    the pixel count P_m of the resolution instead.
+    """
+
+    def __init__(self, segment_duration=SEGMENT_DURATION, buffer_target=BUFFER_TARGET, gamma_p=BOLA_GAMMA_P):
+        """
+        :param segment_duration: the playback time of one segment in seconds
+        :param buffer_target: the buffer level the policy aims at, in seconds
+        :param gamma_p: the weight of smooth playback against quality
+        """
+        self.segment_duration = segment_duration
+        self.buffer_target = buffer_target
+        self.gamma_p = gamma_p
+
+    def on_segment(self, size, seconds):
+        pass
+
+    def choose(self, sizes, buffer_level):
+        available = [(level, size) for level, size in enumerate(sizes) if size is not None]
+        if not available:
+            return None
+        lines = resolution(available[0][0])
+        utilities = {level: 2 * math.log(resolution(level) / lines) for level, _ in available}
+        target = max(self.buffer_target / self.segment_duration, 2)
+        v = (target - 1) / (max(utilities.values()) + self.gamma_p)
+        buffer = buffer_level / self.segment_duration
+        return max(available, key=lambda entry: (v * (utilities[entry[0]] + self.gamma_p) - buffer) / entry[1])[0]
+
+
+POLICIES = {
+    'throughput': ThroughputPolicy,
+    'harmonic': lambda: ThroughputPolicy('harmonic'),
+    'bola': BolaPolicy,
+}
+
+
+def make_policy(name):
+    """
+    :param name: a key of POLICIES
+    :return: a new policy object with on_segment(size, seconds) and choose(sizes, buffer_level)
+    """
+    if name not in POLICIES:
+        raise ValueError(f'unknown ABR policy {name}, choose one of {", ".join(POLICIES)}')
+    return POLICIES[name]()
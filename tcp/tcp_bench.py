@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import http.client
+import io
+import multiprocessing
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from tcp_protocol import FRAME_HEADER, FRAME_HEADER_SIZE, QUALITY_NAMES, quality_folder
+from tcp_http import SegmentHTTPServer
+from tcp_reciever import tcp_reciever, recv_exactly, playback_buffer
+from tcp_sender import tcp_sender, tcp_server, STARTUP_PICTURES
+from tcp_writer import FSYNC_POLICIES
+
+HOST = 'localhost'
+PORT = 30600
+
+
+def send_copy(name, s):
+    # send_picture before sendfile: read the file, then copy it again to append an end marker
+    with open(name, 'rb') as f:
+        data = f.read()
+    s.sendall(data + b"<end>")
+
+
+def drain(port, results):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.connect((HOST, port))
+        total = 0
+        while True:
+            data = s.recv(1 << 20)
+            if not data:
+                break
+            total += len(data)
+    results.put(total)
+
+
+def benchmark(send, names, rounds, port):
+    """
+    Sends the pictures `rounds` times to a receiver process that discards them.
+    :return: the throughput in Gbit/s and the sender CPU seconds per Gbit
+    """
+    results = multiprocessing.Queue()
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((HOST, port))
+        server.listen()
+        receiver = multiprocessing.Process(target=drain, args=(port, results))
+        receiver.start()
+        conn, _ = server.accept()
+        with conn, contextlib.redirect_stdout(io.StringIO()):
+            start, start_cpu = time.time(), time.process_time()
+            for _ in range(rounds):
+                for name in names:
+                    send(name, conn)
+            conn.shutdown(socket.SHUT_WR)
+            total = results.get()
+            elapsed, cpu = time.time() - start, time.process_time() - start_cpu
+    receiver.join()
+    gbits = total * 8 / 1e9
+    return gbits / elapsed, cpu / gbits
+
+
+def prepare_workdir():
+    """
+    Creates a working directory with links to the quality folders, under their own names, and an empty
+    output folder for the receiver.
+    :return: the path of the directory
+    """
+    workdir = tempfile.mkdtemp()
+    for name in QUALITY_NAMES:
+        folder = quality_folder(name)
+        os.symlink(os.path.abspath(folder), os.path.join(workdir, os.path.basename(folder)))
+    os.mkdir(os.path.join(workdir, 'output'))
+    return workdir
+
+
+def receive(port, fsync, store, results):
+    with contextlib.redirect_stdout(io.StringIO()):
+        receiver = tcp_reciever(('localhost', port), fsync, store=store)
+        receiver.run()
+    results.put(receiver.writer_stats)
+
+
+def stream_benchmark(window, port, fsync='never', store=None):
+    """
+    Streams the pictures to a tcp_reciever process, starting from the lowest quality.
+    :param window: the pictures in flight, 0 for stop-and-wait
+    :param fsync: the fsync policy of the receiver's writer
+    :param store: the folder of the receiver's segment store, None to store one file per picture
+    :return: the time until the first STARTUP_PICTURES pictures were acknowledged, the throughput in MB/s and
+        the stats of the receiver's writer
+    """
+    sender = tcp_sender(window)
+    results = multiprocessing.Queue()
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((HOST, port))
+        server.listen()
+        receiver = multiprocessing.Process(target=receive, args=(port, fsync, store, results))
+        receiver.start()
+        conn, _ = server.accept()
+        with conn, contextlib.redirect_stdout(io.StringIO()):
+            sender.serve(conn)
+    writer_stats = results.get()
+    receiver.join()
+    stats = sender.stats
+    return stats['startup'], stats['bytes'] / stats['elapsed'] / 1e6, writer_stats
+
+
+def view(port, results):
+    # A viewer that acknowledges every picture without storing it
+    start = time.time()
+    first = None
+    received = 0
+    with socket.create_connection((HOST, port)) as s:
+        header = bytearray(FRAME_HEADER_SIZE)
+        buffer = playback_buffer()
+        while recv_exactly(s, memoryview(header)):
+            length, index, quality = struct.unpack(FRAME_HEADER, header)
+            data = bytearray(length)
+            if not recv_exactly(s, memoryview(data)):
+                break
+            first = first or time.time() - start
+            received += length
+            buffer.add_picture()
+            s.sendall(buffer.ack())
+    results.append((first, received))
+
+
+def run_viewers(port, viewers, results):
+    with contextlib.redirect_stdout(io.StringIO()):
+        collected = []
+        threads = [threading.Thread(target=view, args=(port, collected)) for _ in range(viewers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    results.put(collected)
+
+
+def serve(server):
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.run()
+
+
+def concurrency_benchmark(window, viewers, port, max_sessions, cache_budget):
+    """
+    Connects many viewers to a tcp_server at once.
+    :param cache_budget: the bytes of the server's picture cache, 0 to send from the files
+    :return: the wall time until every viewer finished, the slowest time to the first picture and the
+        aggregate throughput in MB/s
+    """
+    server = multiprocessing.Process(target=serve, args=(tcp_server(window, max_sessions, port, cache_budget=cache_budget),))
+    server.start()
+    time.sleep(0.5)
+    results = multiprocessing.Queue()
+    start = time.time()
+    client = multiprocessing.Process(target=run_viewers, args=(port, viewers, results))
+    client.start()
+    collected = results.get()
+    elapsed = time.time() - start
+    client.join()
+    server.terminate()
+    server.join()
+    return elapsed, max(first or elapsed for first, _ in collected), \
+        sum(received for _, received in collected) / elapsed / 1e6
+
+
+def fetch(port, requests, keepalive, results):
+    # Fetches the pictures of every quality in turn, over one connection or a new one per request
+    pictures = [(quality, index) for quality in QUALITY_NAMES[1:] for index in range(1, 21)]
+    received = 0
+    c = http.client.HTTPConnection(HOST, port)
+    for i in range(requests):
+        c.request('GET', '/{}/{}'.format(*pictures[i % len(pictures)]))
+        received += len(c.getresponse().read())
+        if not keepalive:
+            c.close()
+    c.close()
+    results.append(received)
+
+
+def run_fetchers(port, clients, requests, keepalive, results):
+    collected = []
+    threads = [threading.Thread(target=fetch, args=(port, requests, keepalive, collected)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(collected)
+
+
+def http_benchmark(clients, requests, keepalive, port):
+    """
+    Fetches pictures from a SegmentHTTPServer with parallel clients.
+    :param requests: the requests of every client
+    :param keepalive: reuse one connection per client, else connect for every request
+    :return: the requests per second and the throughput in MB/s
+    """
+    server = multiprocessing.Process(target=serve, args=(SegmentHTTPServer(port),))
+    server.start()
+    time.sleep(0.5)
+    results = multiprocessing.Queue()
+    start = time.time()
+    client = multiprocessing.Process(target=run_fetchers, args=(port, clients, requests, keepalive, results))
+    client.start()
+    collected = results.get()
+    elapsed = time.time() - start
+    client.join()
+    server.terminate()
+    server.join()
+    return clients * requests / elapsed, sum(collected) / elapsed / 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of tcp_sender: sender CPU per Gbit/s with and '
+                                                 'without sendfile, streaming throughput per window and per '
+                                                 'receiver fsync policy, and the HTTP segment server.')
+    parser.add_argument('--quality', default='1080p', help='the folder of pictures to send')
+    parser.add_argument('--rounds', type=int, default=50, help='times every picture is sent')
+    parser.add_argument('--windows', type=int, nargs='+', default=[0, 1, 4, 8],
+                        help='pictures in flight to stream with, 0 for stop-and-wait')
+    parser.add_argument('--fsync', nargs='+', default=list(FSYNC_POLICIES), choices=FSYNC_POLICIES,
+                        help='fsync policies of the receiver to stream with')
+    parser.add_argument('--viewers', type=int, nargs='+', default=[1, 10, 100, 300],
+                        help='simultaneous viewers of the concurrent server')
+    parser.add_argument('--max-sessions', type=int, nargs='+', default=[1, 512],
+                        help='session limits of the concurrent server, 1 serves one viewer at a time')
+    parser.add_argument('--cache-mb', type=float, nargs='+', default=[0, 64],
+                        help='picture cache sizes of the concurrent server, 0 sends from the files')
+    parser.add_argument('--http-clients', type=int, nargs='+', default=[1, 16],
+                        help='parallel clients of the HTTP server')
+    parser.add_argument('--http-requests', type=int, default=200, help='requests of every HTTP client')
+    args = parser.parse_args()
+
+    folder = quality_folder(args.quality)
+    names = [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+    sender = tcp_sender()
+    for label, send in (('copy', send_copy), ('sendfile', lambda name, s: sender.send_picture(name, s, 1, 4))):
+        throughput, cpu = benchmark(send, names, args.rounds, PORT)
+        print('{}: {:.2f} Gbit/s, {:.3f} CPU s per Gbit'.format(label, throughput, cpu))
+
+    os.chdir(prepare_workdir())
+    for i, window in enumerate(args.windows):
+        # A new port every time, the receiver always connects from the same local port
+        startup, throughput, _ = stream_benchmark(window, PORT + 1 + i)
+        print('window {}: first {} pictures in {:.3f} s, {:.2f} MB/s'.format(
+            window, STARTUP_PICTURES, startup, throughput))
+
+    port = PORT + 1 + len(args.windows)
+    for store in (None, 'store'):
+        for fsync in args.fsync:
+            startup, throughput, stats = stream_benchmark(4, port, fsync, store)
+            port += 1
+            print('{}, fsync {}: {:.2f} MB/s, writer queue at most {} deep, write latency {:.1f} ms mean, '
+                  '{:.1f} ms p99, receiver blocked {:.3f} s'.format(
+                      'segment store' if store else 'file per picture', fsync, throughput, stats['max_depth'],
+                      stats['latency_mean'] * 1e3, stats['latency_p99'] * 1e3, stats['blocked']))
+
+    for cache_mb in args.cache_mb:
+        for max_sessions in args.max_sessions:
+            for viewers in args.viewers:
+                elapsed, first, throughput = concurrency_benchmark(4, viewers, port, max_sessions,
+                                                                   int(cache_mb * 1024 * 1024))
+                port += 1
+                print('{} viewers, {} sessions at a time, {} MB cache: all done in {:.2f} s, slowest first picture '
+                      'after {:.2f} s, {:.1f} MB/s'.format(viewers, max_sessions, cache_mb, elapsed, first, throughput))
+
+    for clients in args.http_clients:
+        for keepalive in (False, True):
+            requests_per_second, throughput = http_benchmark(clients, args.http_requests, keepalive, port)
+            port += 1
+            print('HTTP, {} clients, {}: {:.0f} requests/s, {:.1f} MB/s'.format(
+                clients, 'keep-alive' if keepalive else 'connection per request', requests_per_second, throughput))
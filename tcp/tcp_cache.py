@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+
+from tcp_protocol import QUALITY_NAMES, PICTURES, picture_path
+
+# Bytes of pictures kept in memory by default, all bundled qualities take about 60 MB
+DEFAULT_BUDGET = 64 * 1024 * 1024
+
+
+class SegmentCache:
+    """
+    Pictures kept in memory, keyed by (quality, index), shared by every session of a server.
+
+    Entries are read-only memoryviews of one bytes object, so concurrent sessions send the same buffer
+    without copying it. The least recently used entries are evicted once the cached pictures exceed the
+    byte budget. Missing pictures are remembered as well, so a warm cache does not touch the disk.
+    The size of every picture seen is kept in a small index apart from the entries, so sizes() neither
+    reads pictures nor changes which ones are evicted.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, folder='.'):
+        """
+        :param budget: the largest number of picture bytes to keep
+        :param folder: the folder holding one sub folder per quality
+        """
+        self.budget = budget
+        self.folder = folder
+        self.entries = OrderedDict()
+        self.bytes = 0
+        # (quality, index) -> size in bytes, None for a missing picture; kept after eviction
+        self.size_index = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, quality, index):
+        return picture_path(quality, index, self.folder)
+
+    def load(self, quality, index):
+        """
+        Reads a picture from disk and caches it.
+        :return: a memoryview of the picture, None if it does not exist
+        """
+        try:
+            with open(self.path(quality, index), 'rb') as f:
+                view = memoryview(f.read())
+        except FileNotFoundError:
+            view = None
+        with self.lock:
+            key = (quality, index)
+            self.size_index[key] = len(view) if view is not None else None
+            if key in self.entries:
+                # Another session loaded it meanwhile, share its buffer
+                return self.entries[key]
+            size = len(view) if view is not None else 0
+            if size <= self.budget:
+                self.entries[key] = view
+                self.bytes += size
+                self.evict()
+        return view
+
+    def evict(self):
+        # Called with the lock held
+        while self.bytes > self.budget:
+            _, view = self.entries.popitem(last=False)
+            self.bytes -= len(view) if view is not None else 0
+            self.evictions += 1
+
+    def lookup(self, quality, index):
+        """
+        :return: (True, the cached picture) on a hit, (False, None) on a miss
+        """
+        with self.lock:
+            key = (quality, index)
+            if key not in self.entries:
+                return False, None
+            self.entries.move_to_end(key)
+            return True, self.entries[key]
+
+    def get(self, quality, index):
+        """
+        :param quality: the quality folder name, e.g. '720p'
+        :param index: the index of the picture
+        :return: a read-only memoryview of the picture, None if it does not exist
+        """
+        hit, view = self.lookup(quality, index)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return view if hit else self.load(quality, index)
+
+    def sizes(self, index):
+        """
+        :param index: the index of the picture
+        :return: the byte size of the picture in every quality, None where the quality lacks it; not
+            counted as hits or misses and does not load the pictures
+        """
+        return [self.size(quality, index) for quality in QUALITY_NAMES]
+
+    def size(self, quality, index):
+        key = (quality, index)
+        with self.lock:
+            if key in self.size_index:
+                return self.size_index[key]
+        path = self.path(quality, index)
+        size = os.path.getsize(path) if os.path.isfile(path) else None
+        with self.lock:
+            self.size_index[key] = size
+        return size
+
+    def preload(self, pictures=PICTURES):
+        """
+        Indexes the size of every picture of every quality, and reads them, lowest quality first, while
+        they fit in the budget.
+        """
+        full = False
+        for quality in QUALITY_NAMES:
+            for index in range(1, pictures + 1):
+                size = self.size(quality, index) or 0
+                full = full or self.bytes + size > self.budget
+                if not full and not self.lookup(quality, index)[0]:
+                    self.load(quality, index)
+
+    def stats(self):
+        """
+        :return: a dictionary with the entries, bytes and hit/miss/eviction counters of the cache
+        """
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
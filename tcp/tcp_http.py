@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import re
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit
+
+from tcp_cache import SegmentCache, DEFAULT_BUDGET
+from tcp_pack import PackedCatalog
+from tcp_protocol import QUALITY_NAMES, PICTURES, SEGMENT_DURATION, picture_path
+
+HOST = 'localhost'
+PORT = 30580
+# Connections served at the same time, further connections wait in the pool's queue
+MAX_CONNECTIONS = 512
+# Seconds an idle keep-alive connection keeps its thread before it is closed
+KEEPALIVE_TIMEOUT = 15
+# bytes=first-last, bytes=first- or bytes=-suffix; a list of ranges is answered with the whole picture
+RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    :param header: the value of the Range header, None if the request has none
+    :param size: the size of the picture
+    :return: (first, last) byte of the range, None for the whole picture, or ValueError if the range
+        holds no byte of the picture
+    """
+    if header is None:
+        return None
+    match = RANGE.match(header.strip())
+    if match is None or match.group(1) == match.group(2) == '':
+        # Several ranges or another unit, sending the whole picture is allowed
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        # Syntactically invalid, RFC 7233 says to ignore the header and send the whole picture
+        return None
+    if first >= size:
+        raise ValueError(header)
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+class SegmentHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET and HEAD requests for /{quality}/{index}, e.g. /720p/3, with the picture, honouring a
+    single byte range, and /manifest with the qualities and the size of every picture in each as JSON.
+
+    Connections are kept alive (HTTP/1.1), and requests a client pipelines on one connection are read
+    from the connection's buffer and answered in order.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, body):
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if parts == ['manifest']:
+            self.send_manifest(body)
+            return
+        if len(parts) != 2 or parts[0].lower() not in QUALITY_NAMES or not parts[1].isdigit():
+            self.send_error(404, 'Expected /{quality}/{index} or /manifest')
+            return
+        quality, index = parts[0].lower(), int(parts[1])
+        cache = self.server.cache
+        if cache is not None:
+            data = cache.get(quality, index)
+            if data is None:
+                self.send_error(404, f'No picture {index} in {quality}')
+                return
+            size = len(data)
+        else:
+            path = picture_path(quality, index)
+            if not os.path.isfile(path):
+                self.send_error(404, f'No picture {index} in {quality}')
+                return
+            size = os.path.getsize(path)
+        try:
+            byte_range = parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        first, last = byte_range or (0, size - 1)
+        if byte_range is None:
+            self.send_response(200)
+        else:
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first}-{last}/{size}')
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not body or size == 0:
+            return
+        # Straight from the shared cache without copying, or from the file with os.sendfile
+        if cache is not None:
+            self.wfile.write(data[first:last + 1])
+        else:
+            with open(path, 'rb') as f:
+                self.connection.sendfile(f, first, last - first + 1)
+
+    def send_manifest(self, body):
+        cache = self.server.cache
+        manifest = {'segment_duration': SEGMENT_DURATION, 'qualities': QUALITY_NAMES, 'sizes': {}}
+        for index in range(1, self.server.pictures + 1):
+            if cache is not None:
+                sizes = cache.sizes(index)
+            else:
+                sizes = [os.path.getsize(path) if os.path.isfile(path) else None
+                         for path in (picture_path(quality, index) for quality in QUALITY_NAMES)]
+            manifest['sizes'][index] = sizes
+        data = json.dumps(manifest).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print(f'{self.address_string()} {format % args}')
+
+
+class SegmentHTTPServer(HTTPServer):
+    """
+    Serves the pictures over HTTP/1.1 from the cache of tcp_server, so clients pick the quality of every
+    picture themselves, fetch pictures in parallel and retry single ones. Connections are handled by a
+    bounded thread pool like the sessions of tcp_server.
+    """
+
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, port=PORT, max_connections=MAX_CONNECTIONS, cache_budget=DEFAULT_BUDGET, packed=None,
+                 pictures=PICTURES, verbose=False):
+        """
+        :param port: the port to listen on
+        :param max_connections: the connections served at the same time
+        :param cache_budget: the bytes of the picture cache, 0 to send every picture from its file
+        :param packed: a folder of tcp_pack.py archives to serve instead of the cache
+        :param pictures: the number of pictures in the manifest
+        :param verbose: print every request
+        """
+        super().__init__((HOST, port), SegmentHandler)
+        if packed:
+            self.cache = PackedCatalog(packed)
+        else:
+            self.cache = SegmentCache(cache_budget) if cache_budget else None
+        self.pictures = pictures
+        self.verbose = verbose
+        self.pool = ThreadPoolExecutor(max_connections)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+    def run(self):
+        if self.cache is not None:
+            self.cache.preload()
+            print(f'Loaded the pictures: {self.cache.stats()}')
+        print(f'Serving the pictures on http://{HOST}:{self.server_address[1]}/')
+        with self:
+            self.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the pictures over HTTP/1.1: GET /{quality}/{index} '
+                                                 'with byte ranges, and GET /manifest.')
+    parser.add_argument('--port', type=int, default=PORT, help='the port to listen on')
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                        help='connections served at the same time')
+    parser.add_argument('--cache-mb', type=float, default=DEFAULT_BUDGET / 1024 / 1024,
+                        help='megabytes of pictures kept in memory, 0 to send from the files')
+    parser.add_argument('--packed', help='serve the archives tcp_pack.py wrote to this folder')
+    parser.add_argument('--verbose', action='store_true', help='print every request')
+    args = parser.parse_args()
+    SegmentHTTPServer(args.port, args.max_connections, int(args.cache_mb * 1024 * 1024), args.packed,
+                      verbose=args.verbose).run()
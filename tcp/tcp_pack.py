@@ -0,0 +1,138 @@
+import argparse
+import mmap
+import os
+import struct
+
+from tcp_protocol import QUALITY_NAMES, PICTURES, quality_folder
+
+# An archive holds every picture of one quality: this header, one index entry per picture, then the
+# pictures back to back
+ARCHIVE_HEADER = '!4sI'
+ARCHIVE_HEADER_SIZE = 8
+ARCHIVE_MAGIC = b'PICS'
+# offset of the picture in the archive, size (0 if the quality lacks the picture)
+INDEX_ENTRY = '!QI'
+INDEX_ENTRY_SIZE = 12
+ARCHIVE_SUFFIX = '.pack'
+
+
+def source_folder(source, quality):
+    """
+    :param source: the folder holding one sub folder per quality
+    :param quality: a quality name
+    :return: the sub folder of the quality, matched case-insensitively (240p is stored as 240P), or None
+    """
+    folder = quality_folder(quality, source)
+    return folder if os.path.isdir(folder) else None
+
+
+def pack(source='.', output='packed', pictures=PICTURES):
+    """
+    Writes one archive per quality.
+    :param source: the folder holding one sub folder per quality
+    :param output: the folder to write the archives to
+    :param pictures: the number of pictures per quality
+    """
+    os.makedirs(output, exist_ok=True)
+    for quality in QUALITY_NAMES:
+        folder = source_folder(source, quality)
+        if folder is None:
+            print(f'No folder for {quality}')
+            continue
+        entries = []
+        offset = ARCHIVE_HEADER_SIZE + INDEX_ENTRY_SIZE * pictures
+        for index in range(1, pictures + 1):
+            path = os.path.join(folder, f'{index}.png')
+            size = os.path.getsize(path) if os.path.isfile(path) else 0
+            entries.append((offset, size, path))
+            offset += size
+        total = offset
+        archive = os.path.join(output, quality + ARCHIVE_SUFFIX)
+        with open(archive + '.tmp', 'wb') as f:
+            f.write(struct.pack(ARCHIVE_HEADER, ARCHIVE_MAGIC, pictures))
+            for picture_offset, size, _ in entries:
+                f.write(struct.pack(INDEX_ENTRY, picture_offset, size))
+            for _, size, path in entries:
+                if size:
+                    with open(path, 'rb') as picture:
+                        f.write(picture.read())
+        os.replace(archive + '.tmp', archive)
+        print(f'Packed {sum(1 for entry in entries if entry[1])} pictures of {quality} into {archive} ({total} bytes)')
+
+
+class PackedCatalog:
+    """
+    The archives written by pack(), memory-mapped. Opening reads only the index of every archive; the
+    pictures are slices of the mappings, paged in by the kernel on first use and shared by every
+    session. Lookups are list accesses, without stat or open calls.
+
+    It offers the get/sizes/preload/stats interface of tcp_cache.SegmentCache, so tcp_sender serves from
+    either.
+    """
+
+    def __init__(self, directory='packed'):
+        """
+        :param directory: the folder holding the archives
+        """
+        self.directory = directory
+        self.maps = {}
+        self.index = {}
+        for quality in QUALITY_NAMES:
+            path = os.path.join(directory, quality + ARCHIVE_SUFFIX)
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                magic, count = struct.unpack(ARCHIVE_HEADER, f.read(ARCHIVE_HEADER_SIZE))
+                if magic != ARCHIVE_MAGIC:
+                    raise ValueError(f'{path} is not a picture archive')
+                index = f.read(INDEX_ENTRY_SIZE * count)
+                # The mapping stays valid after the file is closed
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[quality] = memoryview(mapped)
+            # Entry 0 is unused, pictures are numbered from 1
+            self.index[quality] = [None] + [struct.unpack_from(INDEX_ENTRY, index, i * INDEX_ENTRY_SIZE)
+                                            for i in range(count)]
+
+    def get(self, quality, index):
+        """
+        :param quality: the quality name, e.g. '720p'
+        :param index: the index of the picture
+        :return: a read-only memoryview of the picture, None if it does not exist
+        """
+        entries = self.index.get(quality)
+        if entries is None or not 0 < index < len(entries):
+            return None
+        offset, size = entries[index]
+        return self.maps[quality][offset:offset + size] if size else None
+
+    def sizes(self, index):
+        """
+        :param index: the index of the picture
+        :return: the byte size of the picture in every quality, None where the quality lacks it
+        """
+        sizes = []
+        for quality in QUALITY_NAMES:
+            entries = self.index.get(quality)
+            size = entries[index][1] if entries is not None and 0 < index < len(entries) else 0
+            sizes.append(size or None)
+        return sizes
+
+    def preload(self):
+        # Nothing to do, the index is read on open and the pictures are paged in on demand
+        pass
+
+    def stats(self):
+        """
+        :return: a dictionary with the archives and the pictures and bytes they hold
+        """
+        entries = [entry for entries in self.index.values() for entry in entries[1:] if entry[1]]
+        return {'archives': len(self.maps), 'pictures': len(entries), 'bytes': sum(size for _, size in entries)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack the pictures of every quality into one archive each.')
+    parser.add_argument('--source', default='.', help='the folder holding one sub folder per quality')
+    parser.add_argument('--output', default='packed', help='the folder to write the archives to')
+    parser.add_argument('--pictures', type=int, default=PICTURES, help='pictures per quality')
+    args = parser.parse_args()
+    pack(args.source, args.output, args.pictures)
@@ -0,0 +1,41 @@
+import functools
+import os
+
+# Every picture is sent as a frame: this header, then `length` bytes of PNG data
+# length, picture index, quality level (an index into QUALITY_NAMES)
+FRAME_HEADER = '!IIB'
+FRAME_HEADER_SIZE = 9
+QUALITY_NAMES = ['240p', '360p', '480p', '720p', '1080p']
+# Pictures per quality
+PICTURES = 20
+# The receiver acknowledges every frame with b'ACK' and its playback buffer level in seconds
+ACK_FORMAT = '!3sf'
+ACK_SIZE = 7
+# Playback time of one picture
+SEGMENT_DURATION = 0.5
+
+
+@functools.lru_cache(maxsize=None)
+def folder_names(directory):
+    # The sub folders of a directory by lower-case name, listed once per directory
+    try:
+        return {name.lower(): name for name in os.listdir(directory)
+                if os.path.isdir(os.path.join(directory, name))}
+    except FileNotFoundError:
+        return {}
+
+
+def quality_folder(quality, folder='.'):
+    """
+    :param quality: a quality name, e.g. '240p'
+    :param folder: the folder holding one sub folder per quality
+    :return: the sub folder of the quality, matched case-insensitively (240p is stored as 240P)
+    """
+    return os.path.join(folder, folder_names(os.path.abspath(folder)).get(quality.lower(), quality))
+
+
+def picture_path(quality, index, folder='.'):
+    """
+    :return: the path of a picture of a quality, see quality_folder
+    """
+    return os.path.join(quality_folder(quality, folder), f'{index}.png')
@@ -1,16 +1,49 @@
 import socket
 import os
+import struct
+import time
+
+from tcp_protocol import FRAME_HEADER, FRAME_HEADER_SIZE, QUALITY_NAMES, ACK_FORMAT, SEGMENT_DURATION
+from tcp_store import SegmentStore
+from tcp_writer import DiskWriter, DEFAULT_QUEUE
 
 HOST = 'localhost'
 PORT = 20510
 
-def save_data_to_file(data, index):
-    with open(f'output/received_data_{index}.png', 'wb') as f:
-        f.write(data)
+def recv_exactly(s, view):
+    # Fills the whole buffer, returns False if the connection closes first
+    received = 0
+    while received < len(view):
+        n = s.recv_into(view[received:])
+        if n == 0:
+            return False
+        received += n
+    return True
+
+class playback_buffer:
+    # Models a player that shows every picture for SEGMENT_DURATION and stalls while it has none
+    def __init__(self):
+        self.end = time.time()
+
+    def add_picture(self):
+        self.end = max(self.end, time.time()) + SEGMENT_DURATION
+
+    def level(self):
+        return max(self.end - time.time(), 0.0)
+
+    def ack(self):
+        return struct.pack(ACK_FORMAT, b"ACK", self.level())
 
 class tcp_reciever:
-    def __init__(self, addr):
+    def __init__(self, addr, fsync='never', batch=8, max_queue=DEFAULT_QUEUE, store=None):
             self.port = addr[1]
+            # How the background writer stores the pictures, see tcp_writer.DiskWriter
+            self.fsync = fsync
+            self.batch = batch
+            self.max_queue = max_queue
+            # A folder to append the pictures to as a tcp_store.SegmentStore, None for one file per picture
+            self.store = store
+            self.writer_stats = {}
 
     def run(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -20,23 +53,23 @@ class tcp_reciever:
             # s.listen()
             with s:
                # print('Connected by', addr)
-                index = 1
-                chunks = []
-                while True:
-                    data = s.recv(65536)
-                    if not data:
-                        break
-                    print(f'Received {len(data)} bytes of data for received_data_{index}')
-                    # print(b"<end>" in data)
-                    if b"<end>" in data:
-                        list = data.split(b"<end>")
-                        chunks.append(list[0])
-                        data = b''.join(chunks)
-                        save_data_to_file(data, index)
-                        chunks = [list[1]]
-                        index += 1
-                        s.sendall(b"ACK")
-                    else:
-                        chunks.append(data)
+                header = bytearray(FRAME_HEADER_SIZE)
+                buffer = playback_buffer()
+                # The pictures are stored from another thread, this loop never touches the disk
+                store = SegmentStore(self.store) if self.store else None
+                writer = DiskWriter('output', self.max_queue, self.batch, self.fsync, store)
+                try:
+                    while recv_exactly(s, memoryview(header)):
+                        length, index, quality = struct.unpack(FRAME_HEADER, header)
+                        data = bytearray(length)
+                        if not recv_exactly(s, memoryview(data)):
+                            break
+                        print(f'Received {length} bytes of {QUALITY_NAMES[quality]} data for received_data_{index}')
+                        writer.put(index, data, quality)
+                        buffer.add_picture()
+                        s.sendall(buffer.ack())
+                finally:
+                    self.writer_stats = writer.close()
+                print(f'Stored the pictures: {self.writer_stats}')
 # t = tcp_reciever()
 # t.run()
\ No newline at end of file
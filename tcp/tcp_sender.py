@@ -1,63 +1,251 @@
+import argparse
 import socket
 import os
+import struct
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from tcp_abr import POLICIES, make_policy, segment_sizes
+from tcp_cache import SegmentCache, DEFAULT_BUDGET
+from tcp_pack import PackedCatalog
+from tcp_protocol import FRAME_HEADER, QUALITY_NAMES, ACK_FORMAT, ACK_SIZE, PICTURES, picture_path
+
 HOST = 'localhost'
 PORT = 30552
-start_time = time.time()
-quality = 0
-MAX_QUALITY = 16
-MIN_QUALITY = 11
+# Pictures whose delivery counts as the startup of a connection
+STARTUP_PICTURES = 4
+# Weight of a new sample in the smoothed throughput
+THROUGHPUT_GAIN = 0.25
+# Sessions streamed at the same time, further viewers wait in the pool's queue
+MAX_SESSIONS = 512
 
 class tcp_sender:
-    def update_quality(self):
-        global quality, start_time, MAX_QUALITY, MIN_QUALITY
-        rtt = time.time() - start_time
-        rescale_rtt = rtt * 1000 - 500
-        if rescale_rtt > MAX_QUALITY:
-            quality = max(0, quality - 1)
-        elif rescale_rtt < MIN_QUALITY:
-            quality = min(4, quality + 1)
-        print(f"Received ACK from receiver. Calling my_function...{(quality, rescale_rtt)}")
-
-
-    def send_picture(self, name, socket):
+    # One viewer session: the connection's quality, timing and window state
+    def __init__(self, window=0, abr='throughput', cache=None):
+        # Pictures in flight in the sliding-window mode, 0 keeps the stop-and-wait mode
+        self.window = window
+        # A SegmentCache or PackedCatalog shared with the other sessions, None to send the files with sendfile
+        self.cache = cache
+        # Picks the quality of every picture, see tcp_abr.POLICIES
+        self.abr = make_policy(abr)
+        self.quality = 0
+        # The playback buffer the receiver reported in its last ACK, in seconds
+        self.buffer_level = 0.0
+        self.ack_bytes = b''
+        self.in_flight = deque()
+        self.window_open = threading.Condition()
+        # Set by read_acks once the receiver stopped sending ACKs, nothing would open the window again
+        self.closed = False
+        self.stats = {}
+
+    def choose_quality(self, index):
+        # Asks the ABR policy for the quality of the next picture, returns the quality and the size of the
+        # picture in it, (None, None) if no quality has it
+        sizes = self.cache.sizes(index) if self.cache is not None else segment_sizes(index)
+        level = self.abr.choose(sizes, self.buffer_level)
+        if level is None:
+            return None, None
+        if level != self.quality:
+            print(f'Switching to {QUALITY_NAMES[level]} at picture {index} (buffer {self.buffer_level:.2f} s)')
+            self.quality = level
+        return level, sizes[level]
+
+    def parse_acks(self, data):
+        # Splits the received bytes into ACKs and returns the buffer level of every complete one
+        self.ack_bytes += data
+        count = len(self.ack_bytes) // ACK_SIZE
+        levels = [struct.unpack_from(ACK_FORMAT, self.ack_bytes, i * ACK_SIZE)[1] for i in range(count)]
+        self.ack_bytes = self.ack_bytes[count * ACK_SIZE:]
+        return levels
+
+
+    def send_picture(self, name, socket, index, quality):
+        # The header tells the receiver the exact frame size. The picture comes from the shared cache
+        # without copying it, or the kernel copies the file straight to the socket (os.sendfile)
+        if self.cache is not None:
+            data = self.cache.get(QUALITY_NAMES[quality], index)
+            if data is None:
+                return 0
+            socket.sendall(struct.pack(FRAME_HEADER, len(data), index, quality))
+            socket.sendall(data)
+            print(f'Sent {len(data)} bytes of data for {name} from the cache')
+            return len(data)
         with open(name, 'rb') as f:
-            data = f.read()
-        socket.sendall(data + b"<end>")
-        print(f'Sent {len(data)} bytes of data for {name}')
-        # print(data[:500])
+            size = os.fstat(f.fileno()).st_size
+            socket.sendall(struct.pack(FRAME_HEADER, size, index, quality))
+            socket.sendfile(f)
+        print(f'Sent {size} bytes of data for {name}')
+        return size
 
 
     def send_chunk(self, quality, s, start, end):
+        # Returns the number of pictures sent and their bytes
+        pictures = 0
+        sent = 0
         for i in range(start, end):
-            name = f'{quality}/{i}.png'
-            if os.path.isfile(name):
-                self.send_picture(name, s)
+            name = picture_path(quality, i)
+            if self.cache is not None or os.path.isfile(name):
+                size = self.send_picture(name, s, i, QUALITY_NAMES.index(quality))
+                pictures += 1 if size else 0
+                sent += size
+        return pictures, sent
+
+    def stop_and_wait(self, conn):
+        for i in range(1, PICTURES + 1, 2):
+            level, _ = self.choose_quality(i)
+            if level is None:
+                continue
+            start = time.time()
+            pictures, sent = self.send_chunk(QUALITY_NAMES[level], conn, i, i + 2)
+            levels = []
+            while len(levels) < pictures:
+                ack = conn.recv(1024)
+                if not ack:
+                    return
+                levels += self.parse_acks(ack)
+            if sent:
+                # Timed to the ACK of the last picture, sendall returns once the data is in the socket
+                # buffer; the pause below is not part of the transfer
+                self.abr.on_segment(sent, time.time() - start)
+            if levels:
+                self.buffer_level = levels[-1]
+            self.record(pictures, sent)
+            time.sleep(0.5)
+        time.sleep(0.5)
+
+    def read_acks(self, conn):
+        # Runs next to stream(): every ACK acknowledges the oldest picture in flight and yields a
+        # throughput sample, the window only limits how many pictures are unacknowledged
+        while True:
+            try:
+                data = conn.recv(1024)
+            except OSError:
+                data = b''
+            with self.window_open:
+                if not data:
+                    self.in_flight.clear()
+                    self.closed = True
+                    self.window_open.notify_all()
+                    return
+                for level in self.parse_acks(data):
+                    if not self.in_flight:
+                        break
+                    size, sent = self.in_flight.popleft()
+                    # The picture's transfer began when it was sent or, if the connection was still
+                    # busy with the previous one, when that one was acknowledged
+                    self.abr.on_segment(size, time.time() - max(sent, self.stats['last_ack']))
+                    self.buffer_level = level
+                    self.record(1, size)
+                self.window_open.notify_all()
+
+    def reset_stats(self):
+        self.stats = {'start': time.time(), 'last_ack': time.time(), 'acked': 0, 'bytes': 0,
+                      'startup': None, 'throughput': None, 'elapsed': None}
+
+    def record(self, pictures, size):
+        # Counts acknowledged pictures and feeds the smoothed throughput
+        now = time.time()
+        stats = self.stats
+        stats['acked'] += pictures
+        stats['bytes'] += size
+        if stats['startup'] is None and stats['acked'] >= STARTUP_PICTURES:
+            stats['startup'] = now - stats['start']
+        sample = size / max(now - stats['last_ack'], 1e-6)
+        stats['last_ack'] = now
+        stats['throughput'] = sample if stats['throughput'] is None else \
+            (1 - THROUGHPUT_GAIN) * stats['throughput'] + THROUGHPUT_GAIN * sample
+
+    def stream(self, conn):
+        self.in_flight.clear()
+        self.closed = False
+        reader = threading.Thread(target=self.read_acks, args=(conn,), daemon=True)
+        reader.start()
+        for i in range(1, PICTURES + 1):
+            with self.window_open:
+                self.window_open.wait_for(lambda: len(self.in_flight) < self.window or self.closed)
+                if self.closed:
+                    print('The receiver stopped acknowledging, ending the session')
+                    break
+                # Picked once the picture may go out, from the latest estimate and buffer level
+                level, size = self.choose_quality(i)
+                if level is None:
+                    continue
+                name = picture_path(QUALITY_NAMES[level], i)
+                self.in_flight.append((size, time.time()))
+            self.send_picture(name, conn, i, level)
+        with self.window_open:
+            self.window_open.wait_for(lambda: not self.in_flight or self.closed)
+        # Wakes the reader, a recv blocked in another thread would keep the connection from closing
+        conn.shutdown(socket.SHUT_RD)
+        reader.join()
+
+    def serve(self, conn):
+        self.reset_stats()
+        if self.window:
+            self.stream(conn)
+        else:
+            self.stop_and_wait(conn)
+        self.stats['elapsed'] = time.time() - self.stats['start']
+        print('Sent {acked} pictures, {bytes} bytes in {elapsed:.3f} s ({:.2f} MB/s)'.format(
+            self.stats['bytes'] / self.stats['elapsed'] / 1e6, **self.stats))
+
+class tcp_server:
+    # Accepts viewers and streams to each from a bounded thread pool, every viewer gets its own tcp_sender
+    def __init__(self, window=0, max_sessions=MAX_SESSIONS, port=PORT, abr='throughput', cache_budget=DEFAULT_BUDGET,
+                 packed=None):
+        self.window = window
+        self.abr = abr
+        # Shared by all sessions: the archives of tcp_pack.py in the folder packed, else a cache of
+        # cache_budget bytes, else (0 bytes) every picture is sent from its file
+        if packed:
+            self.cache = PackedCatalog(packed)
+        else:
+            self.cache = SegmentCache(cache_budget) if cache_budget else None
+        self.max_sessions = max_sessions
+        self.port = port
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+    def handle(self, conn, addr):
+        with self.lock:
+            self.sessions += 1
+        try:
+            with conn:
+                tcp_sender(self.window, self.abr, self.cache).serve(conn)
+        except OSError as e:
+            print(f'Session with {addr} failed: {e}')
+        finally:
+            with self.lock:
+                self.sessions -= 1
+            if self.cache is not None:
+                print(f'Cache: {self.cache.stats()}')
 
     def run(self):
-        global start_time
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            #s.connect((HOST, PORT))
-            s.bind((HOST, PORT))
-            s.listen()
+        if self.cache is not None:
+            self.cache.preload()
+            print(f'Loaded the pictures: {self.cache.stats()}')
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s, \
+                ThreadPoolExecutor(self.max_sessions) as pool:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((HOST, self.port))
+            s.listen(socket.SOMAXCONN)
             while True:
                 conn, addr = s.accept()
-                print(addr)
-                quality_names = ['240p', '360p', '480p', '720p', '1080p']
-                for i in range(1, 21, 2):
-                    start_time = time.time()
-                    self.send_chunk(quality_names[quality], conn, i, i + 2)
-                    time.sleep(0.5)
-                    while True:
-                        ack = conn.recv(1024)
-                        if ack:
-                            if "ACK" in ack.decode():
-                                self.update_quality()
-                                break
-                            else:
-                                print(ack)
-                time.sleep(0.5)
-                conn.close()
-
-t = tcp_sender()
-t.run()
\ No newline at end of file
+                print(f'{addr}, {self.sessions} sessions active')
+                pool.submit(self.handle, conn, addr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream the pictures to every receiver that connects.')
+    parser.add_argument('--window', type=int, default=4,
+                        help='pictures in flight, 0 to wait for an ACK after every two pictures')
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS, help='viewers streamed at the same time')
+    parser.add_argument('--abr', default='throughput', choices=sorted(POLICIES), help='the quality policy')
+    parser.add_argument('--cache-mb', type=float, default=DEFAULT_BUDGET / 1024 / 1024,
+                        help='megabytes of pictures kept in memory, 0 to send from the files')
+    parser.add_argument('--packed', help='serve the archives tcp_pack.py wrote to this folder')
+    args = parser.parse_args()
+    t = tcp_server(args.window, args.max_sessions, abr=args.abr, cache_budget=int(args.cache_mb * 1024 * 1024),
+                   packed=args.packed)
+    t.run()
@@ -0,0 +1,175 @@
+import argparse
+import mmap
+import os
+import struct
+
+from tcp_protocol import QUALITY_NAMES
+
+# Bytes of pictures per segment file before the store moves on to the next one
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+# One entry per stored picture in the index file next to its segment: picture index, quality level,
+# offset in the segment, length
+INDEX_ENTRY = '!IBQI'
+INDEX_ENTRY_SIZE = 17
+
+
+def segment_names(folder):
+    """
+    :return: the names of the segments in a store folder, without suffix, oldest first
+    """
+    return sorted(name[:-len(INDEX_SUFFIX)] for name in os.listdir(folder) if name.endswith(INDEX_SUFFIX))
+
+
+class SegmentStore:
+    """
+    An append-only store of received pictures: they are appended to a segment file and located by an
+    index file next to it, instead of creating one file per picture. Segments are preallocated to their
+    full size where the platform supports it, so appends do not grow the file, and a new segment is
+    started once the current one is full. Closing a segment trims it to the bytes it holds.
+
+    A picture is written to its segment before its index entry, so the index only points at written data.
+    Reopening a store starts a new segment after the existing ones.
+    """
+
+    def __init__(self, folder='output', segment_size=DEFAULT_SEGMENT_SIZE, preallocate=True):
+        """
+        :param folder: the folder holding the segments
+        :param segment_size: the picture bytes per segment, a larger picture gets a segment of its own
+        :param preallocate: reserve the space of every segment when it is created
+        """
+        self.folder = folder
+        self.segment_size = segment_size
+        self.preallocate = preallocate
+        os.makedirs(folder, exist_ok=True)
+        existing = segment_names(folder)
+        self.number = int(existing[-1]) + 1 if existing else 0
+        self.data = None
+        self.index = None
+        self.offset = 0
+        self.segments = 0
+
+    def segment_path(self, number, suffix):
+        return os.path.join(self.folder, f'{number:06d}{suffix}')
+
+    def open_segment(self, size):
+        data = open(self.segment_path(self.number, SEGMENT_SUFFIX), 'w+b')
+        if self.preallocate and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(data.fileno(), 0, max(size, self.segment_size))
+            except OSError:
+                # Not supported by the filesystem, the segment grows with the appends
+                pass
+        self.data = data
+        self.index = open(self.segment_path(self.number, INDEX_SUFFIX), 'ab')
+        self.offset = 0
+        self.segments += 1
+
+    def close_segment(self):
+        if self.data is None:
+            return
+        self.data.flush()
+        self.data.truncate(self.offset)
+        self.data.close()
+        self.index.close()
+        self.data = self.index = None
+        self.number += 1
+
+    def append(self, index, quality, data):
+        """
+        :param index: the index of the picture
+        :param quality: the quality level of the picture
+        :param data: the picture
+        """
+        if self.data is not None and self.offset > 0 and self.offset + len(data) > self.segment_size:
+            self.close_segment()
+        if self.data is None:
+            self.open_segment(len(data))
+        self.data.seek(self.offset)
+        self.data.write(data)
+        self.data.flush()
+        self.index.write(struct.pack(INDEX_ENTRY, index, quality, self.offset, len(data)))
+        self.index.flush()
+        self.offset += len(data)
+
+    def sync(self):
+        # The data first, so a durable index entry never points at lost data
+        if self.data is not None:
+            os.fsync(self.data.fileno())
+            os.fsync(self.index.fileno())
+
+    def close(self):
+        self.close_segment()
+
+
+class StoreReader:
+    """
+    Random access to the pictures of a SegmentStore folder. The indexes are read on open and the segments
+    are memory-mapped when first used. A picture stored more than once is read from its last copy, and
+    an incomplete index entry left by a crash is ignored.
+    """
+
+    def __init__(self, folder='output'):
+        """
+        :param folder: the folder holding the segments
+        """
+        self.folder = folder
+        self.entries = {}
+        self.maps = {}
+        for name in segment_names(folder):
+            with open(os.path.join(folder, name + INDEX_SUFFIX), 'rb') as f:
+                index = f.read()
+            for i in range(len(index) // INDEX_ENTRY_SIZE):
+                picture, quality, offset, length = struct.unpack_from(INDEX_ENTRY, index, i * INDEX_ENTRY_SIZE)
+                self.entries[picture] = (name, quality, offset, length)
+
+    def pictures(self):
+        """
+        :return: the indexes of the stored pictures, in order
+        """
+        return sorted(self.entries)
+
+    def quality(self, index):
+        """
+        :return: the quality name the picture was stored in, None if it is not stored
+        """
+        entry = self.entries.get(index)
+        return QUALITY_NAMES[entry[1]] if entry is not None else None
+
+    def segment(self, name):
+        if name not in self.maps:
+            with open(os.path.join(self.folder, name + SEGMENT_SUFFIX), 'rb') as f:
+                self.maps[name] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.maps[name]
+
+    def get(self, index):
+        """
+        :param index: the index of the picture
+        :return: a read-only memoryview of the picture, None if it is not stored
+        """
+        entry = self.entries.get(index)
+        if entry is None:
+            return None
+        name, _, offset, length = entry
+        return self.segment(name)[offset:offset + length] if length else b''
+
+    def __len__(self):
+        return len(self.entries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List the pictures of a segment store, or extract them.')
+    parser.add_argument('folder', help='the folder holding the segments')
+    parser.add_argument('--extract', help='write every picture to this folder as received_data_{index}.png')
+    args = parser.parse_args()
+
+    reader = StoreReader(args.folder)
+    if args.extract:
+        os.makedirs(args.extract, exist_ok=True)
+    for index in reader.pictures():
+        data = reader.get(index)
+        print(f'{index}: {len(data)} bytes of {reader.quality(index)}')
+        if args.extract:
+            with open(os.path.join(args.extract, f'received_data_{index}.png'), 'wb') as f:
+                f.write(data)
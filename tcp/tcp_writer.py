@@ -0,0 +1,181 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# Pictures waiting to be written before put() blocks the receiving thread
+DEFAULT_QUEUE = 64
+# Write latencies kept for the percentiles in stats()
+LATENCY_SAMPLES = 1024
+# 'never' leaves flushing to the kernel, 'batch' syncs once per batch, 'always' syncs every picture
+FSYNC_POLICIES = ('never', 'batch', 'always')
+
+
+class DiskWriter:
+    """
+    Stores received pictures from a background thread, so the thread reading the socket never waits
+    for the filesystem and ACKs leave as soon as a picture arrives.
+
+    The queue is bounded: once it holds max_queue pictures put() blocks, which slows the receiver down
+    to the disk instead of growing the memory without limit. The writer takes up to `batch` queued
+    pictures at a time; with the 'batch' fsync policy they are synced together, followed by one sync of
+    the folder.
+
+    Given a tcp_store.SegmentStore, the pictures are appended to it instead of written to files of their own.
+    """
+
+    def __init__(self, folder='output', max_queue=DEFAULT_QUEUE, batch=8, fsync='never', store=None):
+        """
+        :param folder: the folder to write the pictures to
+        :param max_queue: the pictures waiting to be written before put() blocks
+        :param batch: the most pictures written per batch
+        :param fsync: one of FSYNC_POLICIES
+        :param store: a SegmentStore to append the pictures to, None for one file per picture; closed with
+            the writer
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'unknown fsync policy {fsync}, choose one of {", ".join(FSYNC_POLICIES)}')
+        self.folder = folder
+        self.batch = max(batch, 1)
+        self.fsync = fsync
+        self.store = store
+        self.queue = queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.written = 0
+        self.bytes = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.blocked = 0.0
+        self.error = None
+        os.makedirs(folder, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def path(self, index):
+        return os.path.join(self.folder, f'received_data_{index}.png')
+
+    def put(self, index, data, quality=0):
+        """
+        Queues a picture, blocks while the queue is full.
+        :param index: the index of the picture
+        :param data: the picture, must not be changed afterwards
+        :param quality: the quality level of the picture, kept by the store
+        """
+        if self.error is not None:
+            raise self.error
+        start = time.time()
+        self.queue.put((index, quality, data, start))
+        waited = time.time() - start
+        with self.lock:
+            self.blocked += waited
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def take_batch(self):
+        # Blocks for the first picture, then takes the ones already queued; None marks the end
+        items = [self.queue.get()]
+        while len(items) < self.batch and items[-1] is not None:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def run(self):
+        done = False
+        while not done:
+            items = self.take_batch()
+            if items[-1] is None:
+                done = True
+                items.pop()
+            # After a failure the queue is still drained, so put() and close() never wait for the thread
+            if items and self.error is None:
+                try:
+                    self.write_batch(items)
+                except Exception as e:
+                    print(f'Writing the received pictures failed: {e}')
+                    self.error = e
+
+    def write_batch(self, items):
+        if self.store is not None:
+            self.append_batch(items)
+        else:
+            self.write_files(items)
+        end = time.time()
+        with self.lock:
+            # From put() to the picture being on disk (or in the page cache with 'never')
+            self.latencies.extend(end - queued for _, _, _, queued in items)
+            self.written += len(items)
+            self.bytes += sum(len(data) for _, _, data, _ in items)
+            self.batches += 1
+
+    def append_batch(self, items):
+        for index, quality, data, _ in items:
+            self.store.append(index, quality, data)
+            if self.fsync == 'always':
+                self.store.sync()
+        if self.fsync == 'batch':
+            self.store.sync()
+
+    def write_files(self, items):
+        files = []
+        try:
+            for index, _, data, _ in items:
+                f = open(self.path(index), 'wb')
+                files.append(f)
+                f.write(data)
+                if self.fsync == 'always':
+                    f.flush()
+                    os.fsync(f.fileno())
+            if self.fsync == 'batch':
+                for f in files:
+                    f.flush()
+                    os.fsync(f.fileno())
+        finally:
+            for f in files:
+                f.close()
+        if self.fsync != 'never':
+            self.sync_folder()
+
+    def sync_folder(self):
+        # Makes the new directory entries durable, not supported on every platform
+        try:
+            fd = os.open(self.folder, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """
+        Writes the queued pictures and stops the writer.
+        :return: the final stats()
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.store is not None:
+            self.store.close()
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+    def stats(self):
+        """
+        :return: a dictionary with the queue depth (now and at most), the pictures, bytes and batches
+            written, the seconds put() blocked and the mean, 99th percentile and largest write latency in
+            seconds
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {'depth': self.queue.qsize(), 'max_depth': self.max_depth, 'written': self.written,
+                     'bytes': self.bytes, 'batches': self.batches, 'blocked': self.blocked}
+        if latencies:
+            stats.update(latency_mean=sum(latencies) / len(latencies),
+                         latency_p99=latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+                         latency_max=latencies[-1])
+        return stats